@@ -0,0 +1,580 @@
+import argparse
+import concurrent.futures
+import gc
+import io
+import os
+import random
+import sys
+import tempfile
+import threading
+import time
+import tracemalloc
+
+from main.btree import *
+from main.bplustree import *
+from main.pagedtree import *
+from main.layout import *
+from model_canvas import ModelCanvas
+
+
+def timed(fn, *args):
+    # like timeit, keep the garbage collector from landing in the middle of a measurement
+    gc.collect()
+    gc.disable()
+    try:
+        start = time.perf_counter()
+        fn(*args)
+        return time.perf_counter() - start
+    finally:
+        gc.enable()
+
+
+def make_input(order, n):
+    vals = list(range(n))
+    if order == "reverse":
+        vals.reverse()
+    elif order == "random":
+        random.shuffle(vals)
+    return vals
+
+
+def bench_ops(tree_class, order, n):
+    vals = make_input(order, n)
+    lookups = random.sample(vals, len(vals))
+
+    tree = tree_class()
+    t_insert = timed(lambda: [tree.insert(v) for v in vals])
+    t_find = timed(lambda: [tree.find(v) for v in lookups])
+    t_delete = timed(lambda: [tree.delete(v) for v in lookups])
+
+    # microseconds per operation
+    return [t * 1e6 / n for t in (t_insert, t_find, t_delete)]
+
+
+def run_ops(args):
+    print(f"{'tree':<10} {'input':<8} {'n':>9} {'insert us':>10} {'find us':>10} {'delete us':>10}")
+    for tree_class in args.classes:
+        for order in ("sorted", "reverse", "random"):
+            for n in args.sizes:
+                # sorted input degenerates an unbalanced tree into a list, so it's quadratic overall
+                if order != "random" and tree_class in DEGENERATE and n > args.max_degenerate:
+                    print(f"{tree_class.__name__:<10} {order:<8} {n:>9} {'skipped (degenerate, see --max-degenerate)':>32}")
+                    continue
+                per_op = bench_ops(tree_class, order, n)
+                print(f"{tree_class.__name__:<10} {order:<8} {n:>9} " + " ".join(f"{t:>10.2f}" for t in per_op))
+
+
+class CountingKey:
+    # wraps a key and counts how many times the tree compares it
+    comparisons = 0
+
+    def __init__(self, val):
+        self.val = val
+
+    def __eq__(self, other):
+        CountingKey.comparisons += 1
+        return self.val == other.val
+
+    def __lt__(self, other):
+        CountingKey.comparisons += 1
+        return self.val < other.val
+
+    def __gt__(self, other):
+        CountingKey.comparisons += 1
+        return self.val > other.val
+
+
+def zipf_trace(n, length, s=1.1):
+    # keys ranked by popularity, with the hot keys scattered across the key space
+    keys = list(range(n))
+    random.shuffle(keys)
+    weights = [1 / rank ** s for rank in range(1, n + 1)]
+    return random.choices(keys, weights=weights, k=length)
+
+
+def run_zipf(args):
+    print(f"{'tree':<10} {'n':>9} {'lookups':>9} {'cmp/lookup':>11} {'find us':>10}")
+    for n in args.sizes:
+        keys = [CountingKey(v) for v in range(n)]
+        random.shuffle(keys)
+        trace = [keys[k] for k in zipf_trace(n, args.lookups)]
+        for tree_class in (BTree, SplayTree):
+            tree = tree_class(keys)
+            CountingKey.comparisons = 0
+            t = timed(lambda: [tree.find(k) for k in trace])
+            print(f"{tree_class.__name__:<10} {n:>9} {len(trace):>9} "
+                  f"{CountingKey.comparisons / len(trace):>11.2f} {t * 1e6 / len(trace):>10.2f}")
+
+
+def run_build(args):
+    print(f"{'tree':<10} {'input':<8} {'n':>9} {'insert s':>10} {'bulk s':>10}")
+    for tree_class in args.classes:
+        for order in ("sorted", "random"):
+            for n in args.sizes:
+                vals = make_input(order, n)
+                build = tree_class.from_sorted if order == "sorted" else tree_class.bulk_load
+                t_bulk = timed(build, vals)
+                if tree_class in DEGENERATE and n > args.max_degenerate and order == "sorted":
+                    t_insert = "skipped"
+                else:
+                    t_insert = f"{timed(tree_class, vals):.3f}"
+                print(f"{tree_class.__name__:<10} {order:<8} {n:>9} {t_insert:>10} {t_bulk:>10.3f}")
+
+
+def run_batch(args):
+    # batches of odd keys against a balanced tree holding the even ones
+    n = max(args.sizes)
+    print(f"tree of {n} keys")
+    print(f"{'tree':<10} {'batch':>7} {'op':<7} {'loop us':>9} {'batch us':>9} {'speedup':>8}")
+    for tree_class in args.classes:
+        tree = tree_class.from_sorted(range(0, 2 * n, 2))
+        for batch_size in (10, 100, 1_000, 10_000, 100_000):
+            batch = [2 * random.randrange(n) + 1 for _ in range(batch_size)]
+            hits = [2 * random.randrange(n) for _ in range(batch_size)]
+
+            t_loop = timed(lambda: [tree.find(v) for v in hits])
+            t_batch = timed(tree.find_many, hits)
+            results = [("find", t_loop, t_batch)]
+
+            t_loop = timed(lambda: [tree.insert(v) for v in batch])
+            tree.delete_many(batch)
+            t_batch = timed(tree.insert_many, batch)
+            results.append(("insert", t_loop, t_batch))
+
+            t_batch = timed(tree.delete_many, batch)
+            tree.insert_many(batch)
+            t_loop = timed(lambda: [tree.delete(v) for v in batch])
+            results.append(("delete", t_loop, t_batch))
+
+            for op, t_loop, t_batch in results:
+                print(f"{tree_class.__name__:<10} {batch_size:>7} {op:<7} {t_loop * 1e6 / batch_size:>9.2f} "
+                      f"{t_batch * 1e6 / batch_size:>9.2f} {t_loop / t_batch:>7.2f}x")
+
+
+class DictNode(BTNode):
+    # no __slots__, so this gets a __dict__ like BTNode used to have
+    pass
+
+
+class DictBTree(BTree):
+    node_class = DictNode
+
+
+def run_memory(args):
+    print(f"{'tree':<10} {'n':>9} {'bytes/key':>10}")
+    for tree_class in [DictBTree] + args.classes:
+        for n in args.sizes:
+            vals = list(range(n)) # the keys themselves aren't counted
+            tracemalloc.start()
+            tree = tree_class.from_sorted(vals)
+            used = tracemalloc.get_traced_memory()[0]
+            tracemalloc.stop()
+            print(f"{tree_class.__name__:<10} {n:>9} {used / n:>10.1f}")
+            del tree
+
+
+def run_orders(args):
+    # multiway B+ trees of various orders against the binary trees, on random input
+    print(f"{'tree':<10} {'order':>6} {'n':>9} {'depth':>6} {'insert us':>10} {'find us':>10} "
+          f"{'scan ns':>9} {'delete us':>10}")
+    for n in args.sizes:
+        vals = make_input("random", n)
+        lookups = random.sample(vals, len(vals))
+        trees = [(tree_class.__name__, "-", tree_class) for tree_class in args.classes]
+        trees += [("BPlusTree", order, lambda order=order: BPlusTree(order=order)) for order in (4, 8, 16, 32, 64, 128, 256)]
+        for name, order, make_tree in trees:
+            tree = make_tree()
+            t_insert = timed(lambda: [tree.insert(v) for v in vals])
+            depth = tree.depth()
+            t_find = timed(lambda: [tree.find(v) for v in lookups])
+            t_scan = timed(lambda: sum(1 for _ in tree.range(n // 4, 3 * n // 4)))
+            t_delete = timed(lambda: [tree.delete(v) for v in lookups])
+            print(f"{name:<10} {order:>6} {n:>9} {depth:>6} {t_insert * 1e6 / n:>10.2f} {t_find * 1e6 / n:>10.2f} "
+                  f"{t_scan * 1e9 / (n // 2):>9.1f} {t_delete * 1e6 / n:>10.2f}")
+
+
+def run_paged(args):
+    print(f"{'n':>9} {'cache':>6} {'insert us':>10} {'close ms':>9} {'reopen ms':>10} {'find us':>8} "
+          f"{'rebuild ms':>11} {'file MB':>8}")
+    with tempfile.TemporaryDirectory() as tmp:
+        for n in args.sizes:
+            for cache_pages in (64, 4096):
+                path = os.path.join(tmp, f"{n}-{cache_pages}.btpg")
+                vals = make_input("random", n)
+                tree = PagedBTree(path, cache_pages=cache_pages)
+                t_insert = timed(lambda: [tree.insert(v) for v in vals])
+                t_close = timed(tree.close)
+
+                start = time.perf_counter()
+                tree = PagedBTree(path, cache_pages=cache_pages)
+                t_reopen = time.perf_counter() - start
+                lookups = random.sample(vals, min(n, 100_000))
+                t_find = timed(lambda: [tree.find(v) for v in lookups])
+                tree.close()
+
+                # what reopening used to cost: rebuilding an in-memory tree from the values
+                t_rebuild = timed(BTree.bulk_load, vals)
+                print(f"{n:>9} {cache_pages:>6} {t_insert * 1e6 / n:>10.2f} {t_close * 1e3:>9.1f} "
+                      f"{t_reopen * 1e3:>10.2f} {t_find * 1e6 / len(lookups):>8.2f} {t_rebuild * 1e3:>11.1f} "
+                      f"{os.path.getsize(path) / 2**20:>8.1f}")
+
+
+def run_snapshot(args):
+    print(f"{'tree':<10} {'keys':<6} {'n':>9} {'MB':>7} {'dump MB/s':>10} {'load MB/s':>10} {'load s':>7} {'rebuild s':>10}")
+    for tree_class in args.classes:
+        for key_type in ("int", "str"):
+            for n in args.sizes:
+                vals = make_input("random", n)
+                if key_type == "str":
+                    vals = [f"{v:08d}" for v in vals]
+                tree = tree_class.bulk_load(vals)
+
+                f = io.BytesIO()
+                t_dump = timed(tree.dump, f)
+                mb = f.tell() / 2**20
+                f.seek(0)
+                t_load = timed(tree_class.load, f)
+                # what loading used to cost: replaying the inserts
+                t_rebuild = timed(tree_class, vals)
+                print(f"{tree_class.__name__:<10} {key_type:<6} {n:>9} {mb:>7.1f} {mb / t_dump:>10.1f} "
+                      f"{mb / t_load:>10.1f} {t_load:>7.3f} {t_rebuild:>10.3f}")
+
+
+def run_frozen(args):
+    print(f"{'n':>9} {'queries':>9} {'tree find us':>13} {'frozen find_many us':>20} {'numpy find_many ns':>19}")
+    for n in args.sizes:
+        tree = BTree.from_sorted(range(0, 2 * n, 2))
+        frozen = tree.freeze()
+        queries = [random.randrange(2 * n) for _ in range(args.lookups)]
+
+        t_tree = timed(lambda: [tree.find(q) for q in queries])
+        t_frozen = timed(frozen.find_many, queries)
+        if np is not None:
+            query_array = np.array(queries)
+            t_numpy = f"{timed(frozen.find_many, query_array) * 1e9 / len(queries):.1f}"
+        else:
+            t_numpy = "no numpy"
+        print(f"{n:>9} {len(queries):>9} {t_tree * 1e6 / len(queries):>13.2f} "
+              f"{t_frozen * 1e6 / len(queries):>20.2f} {t_numpy:>19}")
+
+
+def run_shared(args):
+    print(f"{'n':>9} {'MB':>7} {'rebuild ms':>11} {'open ms':>8} {'attach ms':>10} {'find us':>8}")
+    with tempfile.TemporaryDirectory() as tmp:
+        for n in args.sizes:
+            vals = make_input("random", n)
+            frozen = BTree.bulk_load(vals).freeze()
+            path = os.path.join(tmp, f"{n}.btfz")
+            frozen.save(path)
+            block = frozen.to_shared_memory()
+
+            # what each worker used to do at startup
+            t_rebuild = timed(lambda: BTree.bulk_load(vals).freeze())
+            t_open = timed(lambda: FrozenBTree.open(path).close())
+            start = time.perf_counter()
+            attached = FrozenBTree.attach(block.name)
+            t_attach = time.perf_counter() - start
+
+            queries = random.sample(vals, min(n, 100_000))
+            t_find = timed(lambda: [attached.contains(q) for q in queries])
+            attached.close()
+            block.close()
+            block.unlink()
+            print(f"{n:>9} {os.path.getsize(path) / 2**20:>7.1f} {t_rebuild * 1e3:>11.1f} {t_open * 1e3:>8.2f} "
+                  f"{t_attach * 1e3:>10.2f} {t_find * 1e6 / len(queries):>8.2f}")
+
+
+class LockedBTree:
+    # the obvious alternative to ConcurrentBTree: one lock around a balanced tree, for readers too
+    def __init__(self, vals):
+        self.lock = threading.Lock()
+        self.tree = AVLTree(vals)
+
+    def find(self, val):
+        with self.lock:
+            return self.tree.find(val)
+
+    def insert(self, val):
+        with self.lock:
+            self.tree.insert(val)
+
+    def delete(self, val):
+        with self.lock:
+            self.tree.delete(val)
+
+
+def bench_concurrent(tree, n, readers, writers, seconds):
+    # every thread runs for the same wall-clock time; returns total reads and writes done
+    stop = threading.Event()
+
+    def read(seed):
+        rng = random.Random(seed)
+        count = 0
+        while not stop.is_set():
+            tree.find(rng.randrange(n))
+            count += 1
+        return count
+
+    def write(seed):
+        rng = random.Random(seed)
+        count = 0
+        while not stop.is_set():
+            v = rng.randrange(n)
+            if count % 2:
+                tree.delete(v)
+            else:
+                tree.insert(v)
+            count += 1
+        return count
+
+    with concurrent.futures.ThreadPoolExecutor(readers + writers) as pool:
+        read_futures = [pool.submit(read, i) for i in range(readers)]
+        write_futures = [pool.submit(write, readers + i) for i in range(writers)]
+        time.sleep(seconds)
+        stop.set()
+        return sum(f.result() for f in read_futures), sum(f.result() for f in write_futures)
+
+
+def run_concurrent(args):
+    # Both trees are balanced, so the input order shouldn't matter; sorted input is there to check that. The
+    # ConcurrentBTree is also built one insert at a time, to time its writes on their own.
+    seconds = 1.0
+    print(f"{'n':>9} {'input':<7} {'readers':>8} {'writers':>8} {'locked r/s':>11} {'locked w/s':>11} "
+          f"{'cow r/s':>11} {'cow w/s':>11}")
+    for n in args.sizes:
+        for order in ("random", "sorted"):
+            vals = make_input(order, n)
+            tree = ConcurrentBTree()
+            t_build = timed(lambda: [tree.insert(v) for v in vals])
+            print(f"{n:>9} {order:<7} built by insert() in {t_build:.2f}s, depth {tree.snapshot().depth()}")
+            for readers, writers in [(1, 0), (4, 0), (4, 1), (8, 1), (8, 4)]:
+                locked = bench_concurrent(LockedBTree(vals), n, readers, writers, seconds)
+                cow = bench_concurrent(ConcurrentBTree(vals), n, readers, writers, seconds)
+                print(f"{n:>9} {order:<7} {readers:>8} {writers:>8} "
+                      + " ".join(f"{c / seconds:>11.0f}" for c in locked + cow))
+
+
+def run_setops(args):
+    # union of an n-key AVLTree with a tree of n or n/100 keys: inserting the smaller tree's keys one by one,
+    # the join-based union, and the parallel union on a process pool
+    workers = os.cpu_count() or 1
+    print(f"{'n':>9} {'m':>9} {'insert ms':>10} {'join ms':>10} {'parallel ms':>12}  ({workers} processes)")
+    with concurrent.futures.ProcessPoolExecutor(workers) as pool:
+        pool.submit(int).result() # start the workers up front
+        for n in args.sizes:
+            for m in (n, max(1, n // 100)):
+                a_vals = random.sample(range(2 * n), n)
+                b_vals = random.sample(range(2 * n), m)
+
+                def naive():
+                    a = AVLTree.bulk_load(a_vals)
+                    b = AVLTree.bulk_load(b_vals)
+                    start = time.perf_counter()
+                    for v in b:
+                        a.insert(v)
+                    return time.perf_counter() - start
+
+                def combined(executor):
+                    a = AVLTree.bulk_load(a_vals)
+                    b = AVLTree.bulk_load(b_vals)
+                    start = time.perf_counter()
+                    a.union(b, executor=executor)
+                    return time.perf_counter() - start
+
+                gc.disable()
+                try:
+                    t_naive, t_join, t_parallel = naive(), combined(None), combined(pool)
+                finally:
+                    gc.enable()
+                print(f"{n:>9} {m:>9} {t_naive * 1e3:>10.1f} {t_join * 1e3:>10.1f} {t_parallel * 1e3:>12.1f}")
+
+
+def run_parallel(args):
+    # bulk_load against parallel_bulk_load on process pools of increasing size
+    workers = [w for w in (1, 2, 4, 8, 16) if w <= (os.cpu_count() or 1)]
+    print(f"{'n':>9} {'bulk_load s':>12} " + " ".join(f"{f'{w} proc s':>10} {'speedup':>8}" for w in workers))
+    pools = {w: concurrent.futures.ProcessPoolExecutor(w) for w in workers}
+    try:
+        for pool in pools.values():
+            pool.submit(int).result() # start the workers up front
+        for n in args.sizes:
+            vals = make_input("random", n)
+            t_serial = timed(lambda: BTree.bulk_load(vals))
+            row = f"{n:>9} {t_serial:>12.2f} "
+            for w in workers:
+                t = timed(lambda: BTree.parallel_bulk_load(vals, pools[w], parts=max(2, w)))
+                row += f"{t:>10.2f} {t_serial / t:>8.2f} "
+            print(row)
+    finally:
+        for pool in pools.values():
+            pool.shutdown()
+
+
+def run_keys(args):
+    # CountingKeys compared directly, and through key= with their plain values cached on the nodes
+    print(f"{'tree':<10} {'n':>9} {'mode':<8} {'insert us':>10} {'find us':>10} {'cmp/find':>9}")
+    for tree_class in args.classes:
+        for n in args.sizes:
+            keys = [CountingKey(v) for v in make_input("random", n)]
+            for mode, key in (("natural", None), ("key=", lambda k: k.val)):
+                tree = tree_class(key=key)
+                t_insert = timed(lambda: [tree.insert(k) for k in keys])
+                CountingKey.comparisons = 0
+                t_find = timed(lambda: [tree.find(k) for k in keys])
+                print(f"{tree_class.__name__:<10} {n:>9} {mode:<8} {t_insert * 1e6 / n:>10.2f} "
+                      f"{t_find * 1e6 / n:>10.2f} {CountingKey.comparisons / n:>9.1f}")
+
+class CountingCanvas:
+    # Counts the calls the explorer makes into Tk, and the time spent in them, passing them on to a real canvas
+    # (or a ModelCanvas on a headless machine).
+    def __init__(self, canvas):
+        self.canvas = canvas
+        self.calls = 0
+        self.seconds = 0.0
+
+    def __getattr__(self, name):
+        target = getattr(self.canvas, name)
+
+        def call(*args, **kwargs):
+            self.calls += 1
+            start = time.perf_counter()
+            try:
+                return target(*args, **kwargs)
+            finally:
+                self.seconds += time.perf_counter() - start
+
+        return call
+
+
+def make_canvas():
+    # a CountingCanvas around a real Tk canvas if possible, and the Tk root to destroy afterwards
+    try:
+        import tkinter
+        root = tkinter.Tk()
+    except Exception: # no display
+        return CountingCanvas(ModelCanvas()), None
+    canvas = tkinter.Canvas(root, width=1024, height=768)
+    canvas.pack()
+    return CountingCanvas(canvas), root
+
+
+def run_canvas(args):
+    # Builds the explorer's tree with random keys, like main.py does, one drawn insert at a time, then in a
+    # single batch(), then with insert_many (half into the empty tree, half into the filled one), and then moves
+    # the view around the batch-built tree. Without a display the canvas is a
+    # ModelCanvas, whose bookkeeping is Python rather than Tk's C, so the time spent inside the canvas is
+    # reported separately from the explorer's.
+    sys.path.append(os.path.join(os.path.dirname(os.path.abspath(__file__)), "main"))
+    from btreecanvas import BTreeCanvas
+
+    def insert_all(tree, vals):
+        for v in vals:
+            tree.insert(v)
+
+    def insert_batch(tree, vals):
+        with tree.batch():
+            insert_all(tree, vals)
+
+    def insert_halves(tree, vals):
+        tree.insert_many(vals[::2])
+        tree.insert_many(vals[1::2])
+
+    frames = 100
+    def move_view(tree):
+        # pan across the whole tree zoomed out, then zoomed in again
+        tree.fit_view()
+        for i in range(frames):
+            if i % 10 == 0:
+                tree.zoom_by(2 if i < frames // 2 else 0.5, 512)
+            tree.scroll(101 if i < frames // 2 else -101, 13)
+
+    print(f"{'n':>9} {'mode':<8} {'canvas':<8} {'Tk calls':>12} {'calls/op':>10} {'s':>8} {'in canvas s':>12}")
+    for n in args.sizes:
+        for mode, limit in [("each", 100_000), ("batch", 1_000_000), ("many", 1_000_000), ("view", 1_000_000)]:
+            if n > limit:
+                print(f"{n:>9} {mode:<8} {'skipped (too slow for a canvas)':>32}")
+                continue
+            canvas, root = make_canvas()
+            tree = BTreeCanvas(canvas)
+            vals = make_input("random", n)
+            if mode == "view":
+                insert_batch(tree, vals)
+                canvas.calls, canvas.seconds = 0, 0.0
+                ops = frames
+                t = timed(move_view, tree)
+            else:
+                ops = n
+                t = timed({"each": insert_all, "batch": insert_batch, "many": insert_halves}[mode], tree, vals)
+            kind = "model" if root is None else "Tk"
+            print(f"{n:>9} {mode:<8} {kind:<8} {canvas.calls:>12} {canvas.calls / ops:>10.1f} {t:>8.2f} {canvas.seconds:>12.2f}")
+            if root is not None:
+                root.destroy()
+
+
+def run_export(args):
+    # lays out and exports trees of random keys without a display, tracking the peak memory used by the export
+    print(f"{'n':>9} {'layout s':>9} {'svg s':>7} {'svg MB':>8} {'svg peak MB':>12} {'png s':>7}")
+    for n in args.sizes:
+        tree = BTree.bulk_load(make_input("random", n))
+        layout_time = timed(lambda: sum(1 for _ in iter_layout(tree.root)))
+
+        with tempfile.TemporaryFile("w+") as f:
+            svg_time = timed(write_svg, tree.root, f)
+            svg_size = f.tell()
+            # again, for the memory use, since tracing slows it right down
+            f.seek(0)
+            tracemalloc.start()
+            write_svg(tree.root, f)
+            peak = tracemalloc.get_traced_memory()[1]
+            tracemalloc.stop()
+
+        png = "n/a" # needs Pillow
+        if Image is not None:
+            with tempfile.TemporaryFile() as f:
+                png = f"{timed(write_png, tree.root, f):.2f}"
+        print(f"{n:>9} {layout_time:>9.2f} {svg_time:>7.2f} {svg_size / 1e6:>8.1f} {peak / 1e6:>12.2f} {png:>7}")
+
+
+BENCHMARKS = {
+    "ops": run_ops,
+    "zipf": run_zipf,
+    "build": run_build,
+    "batch": run_batch,
+    "memory": run_memory,
+    "orders": run_orders,
+    "paged": run_paged,
+    "snapshot": run_snapshot,
+    "frozen": run_frozen,
+    "shared": run_shared,
+    "concurrent": run_concurrent,
+    "setops": run_setops,
+    "parallel": run_parallel,
+    "keys": run_keys,
+    "canvas": run_canvas,
+    "export": run_export,
+}
+TREE_CLASSES = {
+    "btree": BTree,
+    "rbtree": RBTree,
+    "avltree": AVLTree,
+    "splaytree": SplayTree,
+}
+# trees which degenerate into a linked list on sorted input
+DEGENERATE = {BTree}
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="BTree benchmarks")
+    parser.add_argument("benchmarks", nargs="*", help=f"any of {', '.join(BENCHMARKS)} (default: all)")
+    parser.add_argument("--sizes", type=int, nargs="+", default=[1_000, 10_000, 100_000, 1_000_000])
+    parser.add_argument("--max-degenerate", type=int, default=10_000)
+    parser.add_argument("--lookups", type=int, default=200_000, help="length of the zipf lookup trace")
+    parser.add_argument("--trees", nargs="+", default=list(TREE_CLASSES), choices=list(TREE_CLASSES))
+    args = parser.parse_args()
+    for name in args.benchmarks:
+        if name not in BENCHMARKS:
+            parser.error(f"unknown benchmark {name!r}")
+    args.benchmarks = args.benchmarks or list(BENCHMARKS)
+    args.classes = [TREE_CLASSES[name] for name in args.trees]
+
+    for name in args.benchmarks:
+        BENCHMARKS[name](args)
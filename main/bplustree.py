@@ -0,0 +1,304 @@
+from bisect import bisect_left, bisect_right
+
+
+# A multiway B+ tree. Unlike BTree, each node holds a sorted list of up to order - 1 keys which we search
+# with bisect, so the height is O(log_order n). All of the values live in the leaves, which are linked
+# together for range scans; the internal nodes only hold separators to steer the search.
+#
+# The value-level methods mirror BTree's (insert/delete/sorted_list/range/len/in/...), so code that only deals
+# in values can switch between the two. Anything that deals in nodes can't: find() returns the leaf holding
+# val rather than a node of its own, and there are no rotations, subtree sizes or parent pointers. That
+# includes the explorer (BTreeCanvas), which is built on BTree's binary nodes and rotations, so B+ trees are
+# out of its scope.
+# Operations that restructure the tree remember the path they took down instead of using parent pointers.
+class BPlusTree:
+    DEFAULT_ORDER = 64
+
+    def __init__(self, vals=None, order=DEFAULT_ORDER):
+        if order < 3:
+            raise ValueError("BPlusTree order must be at least 3")
+        self.order = order
+        self.max_keys = order - 1
+        self.min_keys = (order - 1) // 2 # for every node except the root
+        self.root = BPlusLeaf()
+        self._len = 0
+
+        if vals is not None:
+            for v in vals:
+                self.insert(v)
+
+    @classmethod
+    def from_sorted(cls, vals, order=DEFAULT_ORDER):
+        # Builds the tree bottom-up from sorted values in linear time, filling the leaves and then each level
+        # of internal nodes about three quarters full so that later inserts don't immediately split them.
+        tree = cls(order=order)
+        keys = []
+        for v in vals:
+            if not keys or keys[-1] < v:
+                keys.append(v)
+            elif not v == keys[-1]:
+                raise ValueError("from_sorted() needs its values in sorted order")
+        if not keys:
+            return tree
+
+        fill = max(tree.min_keys, (3 * tree.max_keys) // 4, 1)
+        level = []
+        for lo, hi in _even_chunks(len(keys), fill, tree.min_keys, tree.max_keys):
+            leaf = BPlusLeaf(keys[lo:hi])
+            if level:
+                level[-1].next, leaf.prev = leaf, level[-1]
+            level.append(leaf)
+        # the smallest key under each node on the current level, used as separators one level up
+        lows = [leaf.keys[0] for leaf in level]
+
+        while len(level) > 1:
+            parents = []
+            parent_lows = []
+            for lo, hi in _even_chunks(len(level), fill + 1, tree.min_keys + 1, tree.order):
+                parents.append(BPlusInternal(lows[lo + 1:hi], level[lo:hi]))
+                parent_lows.append(lows[lo])
+            level, lows = parents, parent_lows
+
+        tree.root = level[0]
+        tree._len = len(keys)
+        return tree
+
+    @classmethod
+    def bulk_load(cls, vals, order=DEFAULT_ORDER):
+        return cls.from_sorted(sorted(vals), order)
+
+    def __len__(self):
+        return self._len
+
+    def depth(self):
+        # all leaves are at the same depth, so just follow the leftmost path
+        depth = 1
+        node = self.root
+        while isinstance(node, BPlusInternal):
+            node = node.children[0]
+            depth += 1
+        return depth
+
+    def find(self, val):
+        # returns the leaf holding val, or None
+        leaf = self._find_leaf(val)
+        i = bisect_left(leaf.keys, val)
+        if i < len(leaf.keys) and leaf.keys[i] == val:
+            return leaf
+        return None
+
+    def __contains__(self, val):
+        return self.find(val) is not None
+
+    def _find_leaf(self, val):
+        node = self.root
+        while isinstance(node, BPlusInternal):
+            node = node.children[bisect_right(node.keys, val)]
+        return node
+
+    def _find_path(self, val):
+        # like _find_leaf, but also returns the (internal node, child index) pairs we went through
+        path = []
+        node = self.root
+        while isinstance(node, BPlusInternal):
+            i = bisect_right(node.keys, val)
+            path.append((node, i))
+            node = node.children[i]
+        return node, path
+
+    def insert(self, val):
+        # returns the leaf that val ended up in, or None if it was already in the tree
+        leaf, path = self._find_path(val)
+        i = bisect_left(leaf.keys, val)
+        if i < len(leaf.keys) and leaf.keys[i] == val:
+            return None
+        leaf.keys.insert(i, val)
+        self._len += 1
+        if len(leaf.keys) <= self.max_keys:
+            return leaf
+
+        # split the leaf in half; the right half's first key becomes the separator in the parent
+        mid = len(leaf.keys) // 2
+        new_node = BPlusLeaf(leaf.keys[mid:])
+        del leaf.keys[mid:]
+        new_node.prev, new_node.next = leaf, leaf.next
+        if leaf.next is not None:
+            leaf.next.prev = new_node
+        leaf.next = new_node
+        separator = new_node.keys[0]
+        result = leaf if i < mid else new_node
+
+        # carry splits up the path as long as the parents overflow
+        while path:
+            parent, i = path.pop()
+            parent.keys.insert(i, separator)
+            parent.children.insert(i + 1, new_node)
+            if len(parent.keys) <= self.max_keys:
+                return result
+
+            mid = len(parent.keys) // 2
+            separator = parent.keys[mid]
+            new_node = BPlusInternal(parent.keys[mid + 1:], parent.children[mid + 1:])
+            del parent.keys[mid:]
+            del parent.children[mid + 1:]
+
+        # the root itself split
+        self.root = BPlusInternal([separator], [self.root, new_node])
+        return result
+
+    def delete(self, val):
+        leaf, path = self._find_path(val)
+        i = bisect_left(leaf.keys, val)
+        if i == len(leaf.keys) or not leaf.keys[i] == val:
+            return
+        del leaf.keys[i]
+        self._len -= 1
+
+        # Separators can be left alone: a deleted key still splits its neighbours correctly.
+        # We only have to fix nodes that have become too small, working up the path.
+        node = leaf
+        while path and len(node.keys) < self.min_keys:
+            parent, i = path.pop()
+            left = parent.children[i - 1] if i > 0 else None
+            right = parent.children[i + 1] if i + 1 < len(parent.children) else None
+
+            if left is not None and len(left.keys) > self.min_keys:
+                self._borrow_from_left(parent, i, node, left)
+            elif right is not None and len(right.keys) > self.min_keys:
+                self._borrow_from_right(parent, i, node, right)
+            elif left is not None:
+                self._merge(parent, i - 1, left, node)
+            else:
+                self._merge(parent, i, node, right)
+            node = parent
+
+        if isinstance(self.root, BPlusInternal) and not self.root.keys:
+            self.root = self.root.children[0]
+
+    def _borrow_from_left(self, parent, i, node, left):
+        if isinstance(node, BPlusLeaf):
+            node.keys.insert(0, left.keys.pop())
+            parent.keys[i - 1] = node.keys[0]
+        else:
+            # rotate through the parent: its separator comes down, the left sibling's last key goes up
+            node.keys.insert(0, parent.keys[i - 1])
+            node.children.insert(0, left.children.pop())
+            parent.keys[i - 1] = left.keys.pop()
+
+    def _borrow_from_right(self, parent, i, node, right):
+        if isinstance(node, BPlusLeaf):
+            node.keys.append(right.keys.pop(0))
+            parent.keys[i] = right.keys[0]
+        else:
+            node.keys.append(parent.keys[i])
+            node.children.append(right.children.pop(0))
+            parent.keys[i] = right.keys.pop(0)
+
+    def _merge(self, parent, i, left, right):
+        # merges parent.children[i + 1] (right) into parent.children[i] (left)
+        separator = parent.keys.pop(i)
+        parent.children.pop(i + 1)
+        if isinstance(left, BPlusLeaf):
+            left.keys.extend(right.keys)
+            left.next = right.next
+            if right.next is not None:
+                right.next.prev = left
+        else:
+            left.keys.append(separator)
+            left.keys.extend(right.keys)
+            left.children.extend(right.children)
+
+    def _first_leaf(self, last=False):
+        node = self.root
+        while isinstance(node, BPlusInternal):
+            node = node.children[-1 if last else 0]
+        return node
+
+    def __iter__(self):
+        leaf = self._first_leaf()
+        while leaf is not None:
+            yield from leaf.keys
+            leaf = leaf.next
+
+    def __reversed__(self):
+        leaf = self._first_leaf(last=True)
+        while leaf is not None:
+            yield from reversed(leaf.keys)
+            leaf = leaf.prev
+
+    def sorted_list(self):
+        return iter(self)
+
+    def range(self, lo=None, hi=None, reverse=False):
+        # Lazily yields the values v with lo <= v < hi (either bound can be left out), in order or in reverse.
+        # One descent finds the starting leaf, and the leaf links take care of the rest.
+        if reverse:
+            if hi is None:
+                leaf = self._first_leaf(last=True)
+                i = len(leaf.keys)
+            else:
+                leaf = self._find_leaf(hi)
+                i = bisect_left(leaf.keys, hi)
+            while leaf is not None:
+                for j in range(i - 1, -1, -1):
+                    v = leaf.keys[j]
+                    if lo is not None and v < lo:
+                        return
+                    yield v
+                leaf = leaf.prev
+                if leaf is not None:
+                    i = len(leaf.keys)
+        else:
+            if lo is None:
+                leaf = self._first_leaf()
+                i = 0
+            else:
+                leaf = self._find_leaf(lo)
+                i = bisect_left(leaf.keys, lo)
+            while leaf is not None:
+                for j in range(i, len(leaf.keys)):
+                    v = leaf.keys[j]
+                    if hi is not None and not v < hi:
+                        return
+                    yield v
+                leaf = leaf.next
+                i = 0
+
+
+class BPlusLeaf:
+    __slots__ = ("keys", "next", "prev")
+
+    def __init__(self, keys=None):
+        self.keys = [] if keys is None else keys
+        self.next = None
+        self.prev = None
+
+    def __repr__(self):
+        return f"BPlusLeaf({self.keys})"
+
+
+class BPlusInternal:
+    # children[i] holds the values in [keys[i - 1], keys[i]), so there's always one more child than key
+    __slots__ = ("keys", "children")
+
+    def __init__(self, keys, children):
+        self.keys = keys
+        self.children = children
+
+    def __repr__(self):
+        return f"BPlusInternal({self.keys})"
+
+
+def _even_chunks(n, fill, min_size, max_size):
+    # Splits range(n) into (lo, hi) chunks of about fill items each, with sizes differing by at most one.
+    # If that would make them smaller than min_size, use as few chunks of at most max_size as possible instead,
+    # which are always at least half full.
+    count = -(-n // fill)
+    if count > 1 and n // count < min_size:
+        count = -(-n // max_size)
+    size, extra = divmod(n, count)
+    lo = 0
+    for k in range(count):
+        hi = lo + size + (1 if k < extra else 0)
+        yield lo, hi
+        lo = hi
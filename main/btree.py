@@ -1,95 +1,821 @@
+import gc
+import mmap
+import os
+import pickle
+import random
+import struct
+import sys
+import threading
+from array import array
+from bisect import bisect_left
+from collections import deque
+from multiprocessing import shared_memory
+from operator import attrgetter
+
+try:
+    import numpy as np
+except ImportError:
+    np = None
+
+
+# Values are ordered by their natural ordering, or by key(value) if a key function is given. Either way each
+# node caches its comparison key in node.key, so the key function runs once per value and searches only ever
+# compare keys, with a single < per level.
+#
+# The tree also works as a sorted mapping: tree[val] = value stores value on val's node (node.value), and
+# get/pop/items/values work like a dict's, with the values (keys, in dict terms) kept in order.
+#
+# Only trees with a key function or mapping values need room on their nodes for both a value and a key, and for
+# a mapping value, so the rest use smaller nodes (see BTNode). A tree switches over to the bigger nodes the first
+# time a mapping value is set.
 class BTree:
-    def __init__(self, vals=None):
+    node_class = None # set to BTNode below
+    rebalances = False # whether inserts restructure the tree (so the order they come in doesn't matter much)
+
+    def __init__(self, vals=None, key=None):
         self.root = None
+        self.key = key
+        if key is not None:
+            self.node_class = _full_node_class(self.node_class)
     
         if vals is not None:
             for v in vals:
                 self.insert(v)
     
+    @classmethod
+    def from_sorted(cls, vals, *args, **kwargs):
+        # Builds a perfectly balanced tree from sorted values in linear time. Any other arguments are passed on
+        # to the constructor.
+        tree = cls(*args, **kwargs)
+        tree.load_sorted(vals)
+        return tree
+
+    @classmethod
+    def bulk_load(cls, vals, *args, **kwargs):
+        # as from_sorted(), but for values in any order, which get sorted once up front
+        tree = cls(*args, **kwargs)
+        tree.load_sorted(sorted(vals, key=tree.key))
+        return tree
+
+    @classmethod
+    def parallel_bulk_load(cls, vals, executor, *args, parts=None, **kwargs):
+        # As bulk_load(), but the sorting is spread over executor (ideally a ProcessPoolExecutor). A sample of the
+        # values picks parts - 1 pivots, which cut the rest into key ranges that the workers sort. As each range
+        # comes back we build its subtree, then the pivots join the subtrees together as a balanced spine.
+        # Nodes can't be built in the workers (they'd have to be pickled back, which costs more than making
+        # them), so this only takes the sort off the critical path.
+        # With a key function the workers sort (key, index) pairs, so that the function doesn't have to be
+        # picklable and only runs once per value.
+        tree = cls(*args, **kwargs)
+        vals = list(vals)
+        keys = vals if tree.key is None else [tree.key(v) for v in vals]
+        parts = parts or os.cpu_count() or 1
+        if len(vals) < 2 * parts:
+            tree.load_sorted(sorted(vals, key=tree.key))
+            return tree
+        sample = sorted(set(random.sample(keys, min(len(keys), 32 * parts))))
+        pivots = sorted(set(sample[len(sample) * k // parts] for k in range(1, parts)))
+
+        ranges = [[] for _ in range(len(pivots) + 1)]
+        pivot_nodes = [None] * len(pivots)
+        for i, k in enumerate(keys):
+            r = bisect_left(pivots, k)
+            if r < len(pivots) and k == pivots[r]:
+                if pivot_nodes[r] is None:
+                    pivot_nodes[r] = tree._new_node(vals[i], k)
+            else:
+                ranges[r].append(k if tree.key is None else (k, i))
+        futures = [executor.submit(sorted, r) for r in ranges]
+
+        subtrees = []
+        for future in futures:
+            part = cls(*args, **kwargs)
+            if tree.key is None:
+                part.load_sorted(future.result())
+            else:
+                part._load_sorted_keys((vals[i] for _, i in future.result()), (k for k, _ in future.result()))
+            subtrees.append(part.root)
+
+        def stitch(lo, hi):
+            # the subtrees lo..hi joined by the pivots between them
+            if lo == hi:
+                return subtrees[lo]
+            mid = (lo + hi) // 2
+            left, right = stitch(lo, mid), stitch(mid + 1, hi)
+            return tree._join(left, pivot_nodes[mid], right)
+
+        tree.root = stitch(0, len(pivots))
+        return tree
+
+    def load_sorted(self, vals):
+        # replaces the contents of the tree with the given sorted values (duplicates are dropped)
+        if self.key is None:
+            self._load_sorted_keys(vals, None)
+        else:
+            vals = list(vals)
+            self._load_sorted_keys(vals, map(self.key, vals))
+
+    def _load_sorted_keys(self, vals, keys):
+        # load_sorted() with the keys already worked out (None meaning the values are their own keys)
+        # Creating millions of linked nodes keeps triggering the cyclic garbage collector, which can't free
+        # any of them anyway, so hold it off until we're done.
+        gc_was_enabled = gc.isenabled()
+        gc.disable()
+        try:
+            nodes = []
+            node_class = self.node_class
+            for v, k in zip(vals, keys) if keys is not None else ((v, v) for v in vals):
+                if not nodes or nodes[-1].key < k:
+                    node = node_class(v)
+                    node.key = k
+                    nodes.append(node)
+                elif not k == nodes[-1].key:
+                    raise ValueError("load_sorted() needs its values in sorted order")
+            self._link_sorted(nodes)
+        finally:
+            if gc_was_enabled:
+                gc.enable()
+
+    def _link_sorted(self, nodes):
+        # Links the nodes, which are in order, into a balanced tree top-down, splitting each range at its
+        # midpoint. Every node's size is known from its range, and all leaves end up within one level of the
+        # bottom. The nodes don't have to be new, whatever links they had are replaced.
+        self.root = None
+        max_depth = len(nodes).bit_length()
+        stack = [(0, len(nodes), None, False, 1)]
+        while stack:
+            lo, hi, parent, left_side, depth = stack.pop()
+            if lo == hi:
+                continue
+            mid = (lo + hi) // 2
+            node = nodes[mid]
+            node.parent = parent
+            node.left = node.right = None
+            node.size = hi - lo
+            if parent is None:
+                self.root = node
+            elif left_side:
+                parent.left = node
+            else:
+                parent.right = node
+            self._init_loaded_node(node, depth, max_depth)
+
+            stack.append((lo, mid, node, True, depth + 1))
+            stack.append((mid + 1, hi, node, False, depth + 1))
+
+    # --- Snapshots. dump() writes the values and the exact shape of the tree (so rotations made in the explorer
+    # survive), and load() rebuilds it in linear time without comparing any values.
+    #
+    # Format: a header (magic, version, number of nodes), then chunks of up to SNAPSHOT_CHUNK nodes in preorder,
+    # ending with an empty chunk. Each chunk has a header (node count, key encoding, key payload size), one flag
+    # byte per node (bit 0: has a left child, bit 1: has a right child, higher bits are up to subclasses) and the
+    # keys, packed as little-endian int64/float64 arrays when possible and pickled otherwise.
+    # Mapping values aren't part of the format, and key functions aren't stored either: pass the same one to load().
+
+    SNAPSHOT_CHUNK = 1 << 16
+
+    def dump(self, fileobj):
+        # checked up front, so that nothing gets written for a tree that can't be dumped
+        if self._has_full_nodes() and any(node.value is not None for node in self.iter_nodes()):
+            raise ValueError("dump() can't store mapping values")
+        fileobj.write(_SNAPSHOT_HEADER.pack(_SNAPSHOT_MAGIC, _SNAPSHOT_VERSION, len(self)))
+
+        flags = bytearray()
+        keys = []
+        stack = [] if self.root is None else [self.root]
+        while stack:
+            node = stack.pop()
+            flags.append(
+                (node.left is not None) | (node.right is not None) << 1 | self._snapshot_flags(node)
+            )
+            keys.append(node.val)
+            if node.right is not None:
+                stack.append(node.right)
+            if node.left is not None:
+                stack.append(node.left)
+
+            if len(keys) == BTree.SNAPSHOT_CHUNK:
+                _write_snapshot_chunk(fileobj, flags, keys)
+                flags = bytearray()
+                keys = []
+
+        if keys:
+            _write_snapshot_chunk(fileobj, flags, keys)
+        _write_snapshot_chunk(fileobj, b"", [])
+
+    @classmethod
+    def load(cls, fileobj, *args, **kwargs):
+        # reads a tree written by dump(). Any other arguments are passed on to the constructor.
+        tree = cls(*args, **kwargs)
+        tree.restore(fileobj)
+        return tree
+
+    def restore(self, fileobj):
+        # replaces the contents of the tree with a snapshot written by dump()
+        magic, version, count = _SNAPSHOT_HEADER.unpack(_read_exactly(fileobj, _SNAPSHOT_HEADER.size))
+        if magic != _SNAPSHOT_MAGIC:
+            raise ValueError("not a BTree snapshot")
+        if version != _SNAPSHOT_VERSION:
+            raise ValueError(f"unsupported BTree snapshot version {version}")
+
+        root = None
+        nodes = []
+        # the (parent, left side) slots still waiting for a node, so the next node in preorder goes in the last one
+        slots = [(None, False)] if count else []
+
+        gc_was_enabled = gc.isenabled()
+        gc.disable()
+        try:
+            while True:
+                chunk_count, encoding, length = _SNAPSHOT_CHUNK.unpack(_read_exactly(fileobj, _SNAPSHOT_CHUNK.size))
+                if chunk_count == 0:
+                    break
+                flags = _read_exactly(fileobj, chunk_count)
+                keys = _decode_snapshot_keys(encoding, _read_exactly(fileobj, length))
+                if len(keys) != chunk_count or len(nodes) + chunk_count > count:
+                    raise ValueError("corrupt BTree snapshot")
+
+                for f, v in zip(flags, keys):
+                    parent, left_side = slots.pop()
+                    node = self.node_class(v, parent)
+                    if self.key is not None:
+                        node.key = self.key(v)
+                    if parent is None:
+                        root = node
+                    elif left_side:
+                        parent.left = node
+                    else:
+                        parent.right = node
+                    self._restore_flags(node, f)
+                    nodes.append(node)
+
+                    if f & 2:
+                        slots.append((node, False))
+                    if f & 1:
+                        slots.append((node, True))
+                    if not slots and len(nodes) < count:
+                        raise ValueError("corrupt BTree snapshot")
+        finally:
+            if gc_was_enabled:
+                gc.enable()
+
+        if slots or len(nodes) != count:
+            raise ValueError("corrupt BTree snapshot")
+
+        # children come after their parents in preorder, so going backwards fixes up the sizes bottom-up
+        for node in reversed(nodes):
+            self._update(node)
+        self.root = root
+
     def insert(self, val):
+        node, inserted = self._insert_from(val, self._key_of(val), self.root)
+        return node if inserted else None
+
+    def _insert_from(self, val, key, start):
+        # Inserts val (whose key is key) into the subtree under start, which has to be a subtree that val
+        # belongs in. Returns the node holding val, and whether it's new.
         if self.root is None:
-            self.root = BTNode(val)
+            self.root = self._new_node(val, key)
+            self._after_insert(self.root)
+            return self.root, True
+
+        node, parent = self._search(key, start)
+        if node is not None:
+            return node, False # already in the tree
+
+        new_node = self._new_node(val, key, parent)
+        if key < parent.key:
+            parent.left = new_node
+        else:
+            parent.right = new_node
+        self._add_to_sizes(parent, 1)
+        self._after_insert(new_node)
+        return new_node, True
+
+    def _key_of(self, val):
+        return val if self.key is None else self.key(val)
+
+    def _new_node(self, val, key, parent=None):
+        node = self.node_class(val, parent)
+        node.key = key
+        return node
+
+    # --- Mapping interface
+
+    def __setitem__(self, val, value):
+        self._use_full_nodes()
+        node, _ = self._insert_from(val, self._key_of(val), self.root)
+        node.value = value
+
+    def _has_full_nodes(self):
+        return _full_node_class(self.node_class) is self.node_class
+
+    def _use_full_nodes(self):
+        # Switches the tree over to nodes with slots for a mapping value, copying the ones it has (along with
+        # their shape and whatever subclasses keep in their snapshot flags). Nodes found before the switch no
+        # longer belong to the tree afterwards.
+        if self._has_full_nodes():
             return
-        return self.__insert_r(val, self.root)
+        self.node_class = _full_node_class(self.node_class)
+        nodes = []
+        stack = [] if self.root is None else [(self.root, None, False)]
+        while stack:
+            old, parent, left_side = stack.pop()
+            node = self.node_class(old.val, parent)
+            node.key = old.key
+            self._restore_flags(node, self._snapshot_flags(old))
+            if parent is None:
+                self.root = node
+            elif left_side:
+                parent.left = node
+            else:
+                parent.right = node
+            nodes.append(node)
+            if old.right is not None:
+                stack.append((old.right, node, False))
+            if old.left is not None:
+                stack.append((old.left, node, True))
+        for node in reversed(nodes):
+            self._update(node)
+
+    def _new_tree(self):
+        # an empty tree like this one, with the same key function and kind of nodes
+        tree = type(self)(key=self.key)
+        tree.node_class = self.node_class
+        return tree
+
+    def __getitem__(self, val):
+        node = self.find(val)
+        if node is None:
+            raise KeyError(val)
+        return node.value
+
+    def __delitem__(self, val):
+        node = self.find(val)
+        if node is None:
+            raise KeyError(val)
+        self.delete_node(node)
+
+    def get(self, val, default=None):
+        node = self.find(val)
+        return default if node is None else node.value
 
-    def __insert_r(self, val, current):
-        if val == current.val:
+    def pop(self, val, *default):
+        # removes val and returns its value, or default if val isn't in the tree (KeyError without a default)
+        node = self.find(val)
+        if node is None:
+            if default:
+                return default[0]
+            raise KeyError(val)
+        value = node.value
+        self.delete_node(node)
+        return value
+
+    def keys(self):
+        return iter(self)
+
+    def values(self):
+        return (node.value for node in self.iter_nodes())
+
+    def items(self):
+        return ((node.val, node.value) for node in self.iter_nodes())
+
+    # --- Batch operations. These sort the batch once, then start each search from the previous key's position
+    # (a finger search) rather than from the root, so neighbouring keys share most of their path.
+
+    def insert_many(self, vals):
+        vals = sorted(vals, key=self.key)
+        keys = vals if self.key is None else list(map(self.key, vals))
+        if self.root is None:
+            # nothing to search, so link the batch up as a balanced tree (keeping the first of any duplicates)
+            self._load_sorted_keys(vals, None if self.key is None else keys)
             return
-        elif val < current.val:
-            if current.left is None:
-                current.left = BTNode(val, parent=current)
-                return
+        if not self.rebalances:
+            # In sorted order, each run of keys between two existing ones would end up as a chain, and the
+            # finger would have to climb all of it for every key. Inserting the medians first from the root
+            # gives each run a balanced subtree instead.
+            unique = [i for i in range(len(keys)) if i == 0 or keys[i - 1] < keys[i]]
+            for i in _median_first(len(unique)):
+                self._insert_from(vals[unique[i]], keys[unique[i]], self.root)
+            return
+        finger = None
+        for val, key in zip(vals, keys):
+            start = self.root if finger is None else self._climb(finger, key)
+            finger = self._insert_from(val, key, start)[0]
+
+    def find_many(self, vals):
+        # returns the nodes (or None) in the same order as vals
+        keys = list(map(self._key_of, vals))
+        found = [None] * len(keys)
+        finger = None
+        for i in sorted(range(len(keys)), key=keys.__getitem__):
+            start = self.root if finger is None else self._climb(finger, keys[i])
+            node, parent = self._search(keys[i], start)
+            found[i] = node
+            if node is not None or parent is not None:
+                finger = node if node is not None else parent
+        return found
+
+    def delete_many(self, vals):
+        # Deleting a node only ever moves other nodes around without replacing them, so it's safe to find
+        # everything first. dict.fromkeys drops missing values and duplicates, keeping the sorted order.
+        for node in dict.fromkeys(self.find_many(sorted(vals, key=self.key))):
+            if node is not None:
+                self.delete_node(node)
+
+    def _climb(self, finger, key):
+        # Climbs from finger (where a key <= key lives or would be attached) to the lowest ancestor whose
+        # subtree covers key's position. A subtree's upper bound is the parent of its first left-child ancestor.
+        node = finger
+        while True:
+            top, parent = node, node.parent
+            while parent is not None and parent.right is top:
+                top, parent = parent, parent.parent
+            if parent is None or key < parent.key:
+                return node
+            node = parent
+    
+    # --- Split, join and set operations. These move nodes between trees instead of copying values, so they leave
+    # their input trees empty. Joining two trees around a key is O(1) for the plain tree and O(log n) for AVLTree
+    # and RBTree (subclasses override _join to keep their balance), and split() takes O(log n) joins.
+    # The set operations recurse on one tree while splitting the other one, so they cost O(m log(n/m + 1)) for
+    # trees of sizes m <= n, which is much less than n when one tree is small.
+    # Pass an executor (a ThreadPoolExecutor or ProcessPoolExecutor) to cut both trees into parts by key range
+    # instead, and merge the parts' keys in parallel as sorted lists.
+    # Like dict's | operator, a union takes other's mapping value for values in both trees. Intersections and
+    # differences keep self's.
+
+    COMBINE_CUTOFF = 16
+
+    @classmethod
+    def join(cls, left, val, right):
+        # a new tree holding everything in left, val and everything in right, where left < val < right
+        if type(left) is not cls or type(right) is not cls:
+            raise TypeError(f"join() needs two {cls.__name__}s")
+        if left.key is not right.key:
+            raise ValueError("join() needs two trees with the same key function")
+        if left._has_full_nodes() or right._has_full_nodes():
+            left._use_full_nodes()
+            right._use_full_nodes()
+        tree = left._new_tree()
+        key = tree._key_of(val)
+        if left.root is not None and not left._extreme_node(largest=True).key < key:
+            raise ValueError("join() needs every value in left to be less than val")
+        if right.root is not None and not key < right._extreme_node().key:
+            raise ValueError("join() needs every value in right to be greater than val")
+        tree.root = tree._join(left._take_root(), tree._new_node(val, key), right._take_root())
+        return tree
+
+    def split(self, val):
+        # returns two new trees, with the values < val and the values >= val
+        left, right = self._new_tree(), self._new_tree()
+        left.root, node, right.root = left._split(self._take_root(), self._key_of(val))
+        if node is not None:
+            right.root = right._join(None, node, right.root)
+        return left, right
+
+    def union(self, other, executor=None, parts=None):
+        return self._set_operation(other, "union", executor, parts)
+
+    def intersection(self, other, executor=None, parts=None):
+        return self._set_operation(other, "intersection", executor, parts)
+
+    def difference(self, other, executor=None, parts=None):
+        return self._set_operation(other, "difference", executor, parts)
+
+    def _set_operation(self, other, mode, executor, parts):
+        if type(other) is not type(self):
+            raise TypeError(f"{mode}() needs another {type(self).__name__}")
+        if other is self:
+            raise ValueError(f"{mode}() needs two different trees")
+        if other.key is not self.key:
+            raise ValueError(f"{mode}() needs two trees with the same key function")
+        if self._has_full_nodes() or other._has_full_nodes():
+            # values can move between the trees' nodes
+            self._use_full_nodes()
+            other._use_full_nodes()
+        tree = self._new_tree()
+        if executor is None or (self.root is None and other.root is None):
+            tree.root = tree._combine(self._take_root(), other._take_root(), mode)
+            return tree
+
+        # The workers only see the keys, and say which nodes to keep, which then get linked into a new tree.
+        nodes_a, nodes_b = self.sorted_nodes(), other.sorted_nodes()
+        a, b = [node.key for node in nodes_a], [node.key for node in nodes_b]
+        self.root = other.root = None
+        parts = parts or os.cpu_count() or 1
+        longer = a if len(a) >= len(b) else b
+        pivots = [longer[len(longer) * k // parts] for k in range(1, parts)]
+        cuts_a = [0] + [bisect_left(a, p) for p in pivots] + [len(a)]
+        cuts_b = [0] + [bisect_left(b, p) for p in pivots] + [len(b)]
+        futures = [
+            executor.submit(_merge_sorted, mode, a[cuts_a[k]:cuts_a[k + 1]], b[cuts_b[k]:cuts_b[k + 1]])
+            for k in range(parts)
+        ]
+        kept = []
+        for k, future in enumerate(futures):
+            for i in future.result():
+                kept.append(nodes_a[cuts_a[k] + i] if i >= 0 else nodes_b[cuts_b[k] - i - 1])
+        tree._link_sorted(kept)
+        return tree
+
+    def _take_root(self):
+        # empties the tree, handing back its nodes
+        root, self.root = self.root, None
+        return root
+
+    def _join(self, left, node, right):
+        # Joins the detached subtrees left and right (either may be None) with node between them, and returns
+        # the new subtree's root. Rotations on the way count it as the root of this tree.
+        node.left, node.right, node.parent = left, right, None
+        self._set_parent(left, node)
+        self._set_parent(right, node)
+        self._update(node)
+        self.root = node
+        return node
+
+    def _join_at(self, parent, node, left, right, right_side):
+        # Hangs node, with left and right as its children, under parent in place of the subtree it takes over
+        # (left when going down parent's right side, right otherwise).
+        replaced = left if right_side else right
+        replaced_size = _size(replaced)
+        node.left, node.right, node.parent = left, right, parent
+        self._set_parent(left, node)
+        self._set_parent(right, node)
+        if right_side:
+            parent.right = node
+        else:
+            parent.left = node
+        self._update(node)
+        self._add_to_sizes(parent, node.size - replaced_size)
+
+    def _join2(self, left, right):
+        # joins two detached subtrees without a node between them, by taking the largest node out of left
+        if left is None or right is None:
+            return right if left is None else left
+        largest = left
+        while largest.right is not None:
+            largest = largest.right
+        left, node, _ = self._split(left, largest.key)
+        return self._join(left, node, right)
+
+    def _split(self, root, key):
+        # Splits the detached subtree under root into the keys < key and > key, both detached, and returns
+        # them along with the node holding key (or None). Walks down to key, then joins the pieces on either
+        # side of the path back together on the way up.
+        path = []
+        node = root
+        while node is not None and not key == node.key:
+            path.append(node)
+            node = node.left if key < node.key else node.right
+        if node is None:
+            left = right = None
+        else:
+            left, right = _detach(node.left), _detach(node.right)
+        for ancestor in reversed(path):
+            if key < ancestor.key:
+                right = self._join(right, ancestor, _detach(ancestor.right))
             else:
-                return self.__insert_r(val, current.left)
-        elif val > current.val:
-            if current.right is None:
-                current.right = BTNode(val, parent=current)
-                return
+                left = self._join(_detach(ancestor.left), ancestor, left)
+        return left, node, right
+
+    def _combine(self, a, b, mode):
+        # The join-based set operations on the detached subtrees a and b. Each step splits one subtree by the
+        # other's root, works on both halves and then joins the results back around that root (or without it).
+        # We keep our own stack, since the plain tree can be too deep to recurse over.
+        results = []
+        stack = [(False, a, b)]
+        while stack:
+            joining, a, b = stack.pop()
+            if joining:
+                # the last two results go either side of a, or straight together if a is None
+                right = results.pop()
+                left = results.pop()
+                results.append(self._join2(left, right) if a is None else self._join(left, a, right))
+            elif a is None or b is None:
+                if mode == "union":
+                    results.append(a if b is None else b)
+                else:
+                    results.append(a if mode == "difference" else None)
+            elif min(_size(a), _size(b)) <= BTree.COMBINE_CUTOFF:
+                results.append(self._combine_small(a, b, mode))
+            elif mode == "difference":
+                # b's root and any match for it in a are dropped
+                left, _, right = self._split(a, b.key)
+                stack.append((True, None, None))
+                stack.append((False, right, _detach(b.right)))
+                stack.append((False, left, _detach(b.left)))
             else:
-                return self.__insert_r(val, current.right)
-    
+                left, found, right = self._split(b, a.key)
+                if mode == "union":
+                    keep = a if found is None else found
+                else:
+                    keep = None if found is None else a
+                stack.append((True, keep, None))
+                stack.append((False, _detach(a.right), right))
+                stack.append((False, _detach(a.left), left))
+        return results[0]
+
+    def _combine_small(self, a, b, mode):
+        # One side is tiny, so it's cheaper to deal with its values one at a time than to keep splitting the
+        # other side all the way down.
+        if mode == "union":
+            # b's values win, wherever they get inserted
+            b_wins = _size(a) >= _size(b)
+            if not b_wins:
+                a, b = b, a
+            self.root = a
+            for other in _subtree_nodes(b):
+                node, inserted = self._insert_from(other.val, other.key, self.root)
+                if (inserted or b_wins) and self._has_full_nodes():
+                    node.value = other.value
+        elif mode == "difference" and _size(b) <= _size(a):
+            self.root = a
+            for other in _subtree_nodes(b):
+                self.delete_node(self._search(other.key, self.root)[0])
+        else:
+            keep = mode == "intersection"
+            if _size(a) <= _size(b):
+                # a's nodes that are (or for a difference, aren't) in b
+                kept = [node for node in _subtree_nodes(a) if (self._search(node.key, b)[0] is not None) == keep]
+            else:
+                # an intersection with a smaller b, so look up b's values in a instead
+                kept = [self._search(other.key, a)[0] for other in _subtree_nodes(b)]
+                kept = [node for node in kept if node is not None]
+            self._link_sorted(kept)
+        return self.root
+
     def delete(self, val):
         return self.delete_node(self.find(val))
     
     def delete_node(self, node):
-        return self.__delete_node_r(node)
-    
-    def __delete_node_r(self, node):
         if node is None:
             return
 
-        if node.left is None and node.right is None:
-            # case 1: no children, so just delete the reference
-            if node.is_left_child():
-                self._set_left_child(node.parent, None)
-            else:
-                self._set_right_child(node.parent, None)
-                
-            if self.root == node:
-                self.root = None
-
-        elif node.left is None:
-            # node has only a right child
-            if node.is_left_child():
-                self._set_left_child(node.parent, node.right)
-            else:
-                self._set_right_child(node.parent, node.right)
-
-            self._set_parent(node.right, node.parent)
-        
-        elif node.right is None:
-            #node has only a left child
-            if node.is_left_child():
-                self._set_left_child(node.parent, node.left)
-            else:
-                self._set_right_child(node.parent, node.left)
-
-            self._set_parent(node.left, node.parent)
-        
-        else:
+        if node.left is not None and node.right is not None:
             # node has two children. We swap it with its successor, which will have at most one child, then delete it.
             self._swap_nodes(node, self.successor(node))
-            return self.__delete_node_r(node)
+
+        # node now has at most one child (possibly None), which takes its place
+        child = node.left if node.left is not None else node.right
+        parent = node.parent
+        if node.is_left_child():
+            self._set_left_child(parent, child)
+        else:
+            self._set_right_child(parent, child)
+        self._set_parent(child, parent)
+
+        if self.root == node:
+            self.root = child
         
         # delete internal references from deleted node. Most likely unnecessary.
         node.left = node.right = node.parent = None
+        node.size = 1
+
+        self._add_to_sizes(parent, -1)
+        self._after_delete(node, child, parent)
             
     def find(self, val):
-        return self.__find_r(val, self.root)
+        return self._search(self._key_of(val), self.root)[0]
     
-    def __find_r(self, val, current):
-        if current is None:
-            return None
-        
-        if val == current.val:
-            return current
-        elif val < current.val:
-            return self.__find_r(val, current.left)
-        else:
-            return self.__find_r(val, current.right)
+    def _search(self, key, current):
+        # Walk down from current without recursing, so degenerate (e.g. sorted) input can't hit the recursion limit.
+        # Returns the node holding key (or None), along with the last node visited, i.e. where key would be
+        # attached if missing. Rather than testing for equality at every level, remember the last node whose
+        # key wasn't greater than ours and check that one at the end, so it's one comparison per level.
+        parent = candidate = None
+        while current is not None:
+            parent = current
+            if key < current.key:
+                current = current.left
+            else:
+                candidate = current
+                current = current.right
+        if candidate is not None and not candidate.key < key:
+            return candidate, parent
+        return None, parent
         
     def __contains__(self, val):
         return self.find(val)
+
+    def floor(self, val):
+        # the node with the largest value <= val, or None
+        key = self._key_of(val)
+        result = None
+        current = self.root
+        while current is not None:
+            if key < current.key:
+                current = current.left
+            else:
+                result = current
+                current = current.right
+        return result
+
+    def ceiling(self, val):
+        # the node with the smallest value >= val, or None
+        return self.lower_bound(val)
+
+    def lower_bound(self, val):
+        # the first node (in order) whose value is not less than val, or None
+        key = self._key_of(val)
+        result = None
+        current = self.root
+        while current is not None:
+            if current.key < key:
+                current = current.right
+            else:
+                result = current
+                current = current.left
+        return result
+
+    def upper_bound(self, val):
+        # the first node (in order) whose value is greater than val, or None
+        key = self._key_of(val)
+        result = None
+        current = self.root
+        while current is not None:
+            if key < current.key:
+                result = current
+                current = current.left
+            else:
+                current = current.right
+        return result
+
+    def _last_below(self, val):
+        # the last node (in order) whose value is less than val, or None
+        key = self._key_of(val)
+        result = None
+        current = self.root
+        while current is not None:
+            if current.key < key:
+                result = current
+                current = current.right
+            else:
+                current = current.left
+        return result
+
+    def range(self, lo=None, hi=None, reverse=False):
+        # Lazily yields the values v with lo <= v < hi (either bound can be left out), in order or in reverse.
+        # We only descend once to find where to start, then follow successor/predecessor, so k values cost
+        # O(log n + k) in a balanced tree.
+        if reverse:
+            node = self._extreme_node(largest=True) if hi is None else self._last_below(hi)
+            lo_key = None if lo is None else self._key_of(lo)
+            while node is not None and (lo is None or not node.key < lo_key):
+                yield node.val
+                node = self.predecessor(node)
+        else:
+            node = self._extreme_node() if lo is None else self.lower_bound(lo)
+            hi_key = None if hi is None else self._key_of(hi)
+            while node is not None and (hi is None or node.key < hi_key):
+                yield node.val
+                node = self.successor(node)
+
+    def __len__(self):
+        return _size(self.root)
+
+    def freeze(self):
+        # an immutable, compact copy of the tree's current values for fast lookups
+        if self.key is not None:
+            raise TypeError("freeze() doesn't support key functions")
+        return FrozenBTree(node.val for node in self.iter_nodes())
+
+    def rank(self, val):
+        # the number of values in the tree smaller than val, using the subtree sizes to skip whole subtrees
+        key = self._key_of(val)
+        rank = 0
+        current = self.root
+        while current is not None:
+            if key < current.key:
+                current = current.left
+            else:
+                if not current.key < key:
+                    return rank + _size(current.left)
+                rank += _size(current.left) + 1
+                current = current.right
+        return rank
+
+    def select(self, k):
+        # the node holding the k-th smallest value, counting from 0. Negative k counts from the end, like a list.
+        if k < 0:
+            k += len(self)
+        if not 0 <= k < len(self):
+            raise IndexError("BTree index out of range")
+
+        current = self.root
+        while True:
+            left_size = _size(current.left)
+            if k == left_size:
+                return current
+            elif k < left_size:
+                current = current.left
+            else:
+                k -= left_size + 1
+                current = current.right
+
+    def count_range(self, lo, hi):
+        # the number of values v with lo <= v < hi
+        return max(0, self.rank(hi) - self.rank(lo))
     
     def depth_of_node(self, node):
         depth = 1
@@ -102,27 +828,61 @@ class BTree:
         return self.depth_of_node(self.find(val))
     
     def depth(self):
-        depths = map(self.depth_of_node, self.sorted_nodes())
-        return max(depths, default=0)
+        return max((depth for _, depth in self._iter_depths()), default=0)
     
     def sorted_list(self):
-        return map(lambda x: x.val, self.sorted_nodes())
+        return iter(self)
     
     def sorted_nodes(self):
-        if self.root is None:
-            return []
-        return self.__sorted_nodes_r(self.root)
-    
-    def __sorted_nodes_r(self, node):
-        left = (
-            [] if node.left is None
-            else self.__sorted_nodes_r(node.left)
-        )
-        right = (
-            [] if node.right is None
-            else self.__sorted_nodes_r(node.right)
-        )
-        return left + [node] + right
+        return list(self.iter_nodes())
+
+    def __iter__(self):
+        return (node.val for node in self.iter_nodes())
+
+    def __reversed__(self):
+        return (node.val for node in self.iter_nodes(reverse=True))
+
+    def iter_nodes(self, reverse=False):
+        # Lazily walks the nodes in order by following successor/predecessor, so it needs no extra memory
+        # and can be stopped early. Don't modify the tree while iterating over it.
+        step = self.predecessor if reverse else self.successor
+        node = self._extreme_node(reverse)
+        while node is not None:
+            yield node
+            node = step(node)
+
+    def _extreme_node(self, largest=False):
+        # the node with the smallest (or largest) value, if any
+        node = self.root
+        if node is None:
+            return None
+        if largest:
+            while node.right is not None:
+                node = node.right
+        else:
+            while node.left is not None:
+                node = node.left
+        return node
+
+    def _iter_depths(self):
+        # like iter_nodes(), but also keeps track of each node's depth as we move through the tree,
+        # rather than climbing up to the root from every node
+        node, depth = self.root, 1
+        if node is None:
+            return
+        while node.left is not None:
+            node, depth = node.left, depth + 1
+
+        while node is not None:
+            yield node, depth
+            if node.right is not None:
+                node, depth = node.right, depth + 1
+                while node.left is not None:
+                    node, depth = node.left, depth + 1
+            else:
+                while node.is_right_child():
+                    node, depth = node.parent, depth - 1
+                node, depth = node.parent, depth - 1
     
     def successor(self, node):
         # if node has a right child, go right once, then left all the way down to a leaf node
@@ -168,6 +928,9 @@ class BTree:
         self._transplant(pivot.left, node, False)
         self._transplant(node, pivot, True)
         self._transplant(pivot, node_parent, node_was_left)
+        # node is now pivot's child, so it has to be updated first
+        self._update(node)
+        self._update(pivot)
     
     def rotate_right(self, node):
         if node.left is None:
@@ -179,6 +942,8 @@ class BTree:
         self._transplant(pivot.right, node, True)
         self._transplant(node, pivot, False)
         self._transplant(pivot, node_parent, node_was_left)
+        self._update(node)
+        self._update(pivot)
 
     def rotate_pivot(self, pivot):
         if self.root == pivot:
@@ -188,6 +953,37 @@ class BTree:
         else:
             return self.rotate_left(pivot.parent)
     
+    # --- Hooks for balanced subclasses. The plain tree doesn't rebalance.
+
+    def _after_insert(self, node):
+        pass
+
+    def _after_delete(self, node, child, parent):
+        # node has just been removed, and child (possibly None) has taken its place under parent
+        pass
+
+    def _init_loaded_node(self, node, depth, max_depth):
+        # called for each node built by load_sorted(), where every leaf is at depth max_depth or max_depth - 1
+        pass
+
+    def _snapshot_flags(self, node):
+        # extra flag bits (from 1 << 2 up) to store with node in a snapshot
+        return 0
+
+    def _restore_flags(self, node, flags):
+        pass
+    
+    # --- Subtree sizes. Subclasses that store more per-node data keep it up to date by extending _update.
+
+    def _update(self, node):
+        # recompute node's augmented data from its children
+        node.size = 1 + _size(node.left) + _size(node.right)
+
+    def _add_to_sizes(self, node, delta):
+        while node is not None:
+            node.size += delta
+            node = node.parent
+    
     # --- The following methods can destroy the ordering property or worse, so they are for internal use only.
     
     def _set_parent(self, node, parent):
@@ -227,7 +1023,7 @@ class BTree:
             node1_wes_left = node1.is_left_child()
 
             if node2.is_left_child():
-                node1.right, node2.right = node2.right, node2.right
+                node1.right, node2.right = node2.right, node1.right
                 node1.left, node2.left = node2.left, node1
             else:
                 node1.left, node2.left = node2.left, node1.left
@@ -267,12 +1063,25 @@ class BTree:
         elif self.root == node2:
             self.root = node1
 
+        # the sizes belong to the positions in the tree, which the nodes have swapped
+        node1.size, node2.size = node2.size, node1.size
+
 class BTNode:
+    # No per-instance __dict__: with millions of nodes the dicts would dominate memory use.
+    # Subclasses that add attributes need to declare __slots__ too.
+    # A plain node's value is its key, and it has no mapping value. Trees with a key function or mapping values
+    # use a subclass with val and value slots of its own (see _full_node_class). Searches only look at keys, so
+    # it's val that goes through a property here, not key.
+    __slots__ = ("key", "parent", "left", "right", "size")
+    val = property(attrgetter("key"))
+    value = None
+
     def __init__(self, val, parent=None):
-        self.val = val
+        self.key = val # the tree sets this to key(val) when it has a key function
         self.parent = parent
         self.left = None
         self.right = None
+        self.size = 1 # number of nodes in the subtree rooted here
     
     def is_left_child(self):
         return self.parent is not None and self.parent.left == self
@@ -295,3 +1104,1140 @@ class BTNode:
     
     def __repr__(self):
         return f"BTNode({self.val})"
+
+BTree.node_class = BTNode
+
+
+_full_node_classes = {}
+
+def _full_node_class(node_class):
+    # node_class's subclass with slots for the value and mapping value (or node_class itself, if it is one)
+    full = _full_node_classes.get(node_class)
+    if full is None:
+        def __init__(self, val, parent=None):
+            node_class.__init__(self, val, parent)
+            self.val = val
+            self.value = None
+        full = type(node_class.__name__, (node_class,), {
+            "__slots__": ("val", "value"), "__init__": __init__, "__module__": node_class.__module__
+        })
+        _full_node_classes[node_class] = _full_node_classes[full] = full
+    return full
+
+
+def _size(node):
+    return 0 if node is None else node.size
+
+
+def _detach(node):
+    # cuts node off from its parent, so that it can be handed around as a subtree of its own
+    if node is not None:
+        node.parent = None
+    return node
+
+
+def _subtree_nodes(node):
+    # the nodes under node, in order
+    nodes = []
+    stack = []
+    while stack or node is not None:
+        while node is not None:
+            stack.append(node)
+            node = node.left
+        node = stack.pop()
+        nodes.append(node)
+        node = node.right
+    return nodes
+
+
+def _median_first(n):
+    # the indexes 0..n-1, each range's midpoint before the midpoints of its two halves
+    ranges = deque([(0, n)])
+    while ranges:
+        lo, hi = ranges.popleft()
+        if lo < hi:
+            mid = (lo + hi) // 2
+            yield mid
+            ranges.append((lo, mid))
+            ranges.append((mid + 1, hi))
+
+
+def _merge_sorted(mode, a, b):
+    # A union/intersection/difference of two sorted lists of keys; module level so that process pools can pickle
+    # it. Returns where the keys came from, i for a[i] and -1 - j for b[j]. Unions take b's copy of a shared key.
+    merged = []
+    i = j = 0
+    while i < len(a) and j < len(b):
+        if a[i] < b[j]:
+            if mode != "intersection":
+                merged.append(i)
+            i += 1
+        elif b[j] < a[i]:
+            if mode == "union":
+                merged.append(-1 - j)
+            j += 1
+        else:
+            if mode == "union":
+                merged.append(-1 - j)
+            elif mode == "intersection":
+                merged.append(i)
+            i += 1
+            j += 1
+    if mode != "intersection":
+        merged.extend(range(i, len(a)))
+    if mode == "union":
+        merged.extend(range(-1 - j, -1 - len(b), -1))
+    return merged
+
+
+_SNAPSHOT_MAGIC = b"BTSN"
+_SNAPSHOT_VERSION = 1
+_SNAPSHOT_HEADER = struct.Struct("<4sBQ") # magic, version, node count
+_SNAPSHOT_CHUNK = struct.Struct("<IBQ") # node count, key encoding, key payload size
+_KEYS_INT64, _KEYS_FLOAT64, _KEYS_PICKLE = range(3)
+_NATIVE_BYTEORDER = b"<" if sys.byteorder == "little" else b">"
+
+
+def _write_snapshot_chunk(fileobj, flags, keys):
+    encoding, payload = _encode_snapshot_keys(keys)
+    fileobj.write(_SNAPSHOT_CHUNK.pack(len(keys), encoding, len(payload)))
+    fileobj.write(flags)
+    fileobj.write(payload)
+
+
+def _pack_keys(vals):
+    # store ints and floats unboxed in an array, anything else in a tuple
+    if all(type(v) is int for v in vals):
+        try:
+            return array("q", vals)
+        except OverflowError:
+            pass
+    elif all(type(v) is float for v in vals):
+        return array("d", vals)
+    return tuple(vals)
+
+
+def _encode_snapshot_keys(keys):
+    packed = _pack_keys(keys)
+    if isinstance(packed, tuple):
+        return _KEYS_PICKLE, pickle.dumps(keys, protocol=pickle.HIGHEST_PROTOCOL)
+    if sys.byteorder == "big":
+        packed.byteswap()
+    return (_KEYS_INT64 if packed.typecode == "q" else _KEYS_FLOAT64), packed.tobytes()
+
+
+def _decode_snapshot_keys(encoding, payload):
+    if encoding == _KEYS_PICKLE:
+        return pickle.loads(payload)
+    if encoding not in (_KEYS_INT64, _KEYS_FLOAT64):
+        raise ValueError(f"unknown key encoding {encoding} in BTree snapshot")
+    keys = array("q" if encoding == _KEYS_INT64 else "d")
+    keys.frombytes(payload)
+    if sys.byteorder == "big":
+        keys.byteswap()
+    return keys.tolist()
+
+
+def _read_exactly(fileobj, n):
+    data = fileobj.read(n)
+    if len(data) != n:
+        raise ValueError("truncated BTree snapshot")
+    return data
+
+
+class RBNode(BTNode):
+    __slots__ = ("red",)
+
+    def __init__(self, val, parent=None):
+        super().__init__(val, parent)
+        self.red = True # new nodes are always inserted red
+
+    def __repr__(self):
+        return f"RBNode({self.val}, {'red' if self.red else 'black'})"
+
+
+def _is_red(node):
+    # missing (leaf) children count as black
+    return node is not None and node.red
+
+
+def _black_height(node):
+    # the number of black nodes on any path from node down to a missing child, node included
+    height = 0
+    while node is not None:
+        height += not node.red
+        node = node.left
+    return height
+
+
+# Red-black tree built on the rotations from BTree, so the height stays below 2*log2(n+1).
+class RBTree(BTree):
+    node_class = RBNode
+    rebalances = True
+
+    def _after_insert(self, node):
+        while _is_red(node.parent):
+            parent = node.parent
+            grandparent = parent.parent # exists, since the root is always black
+            uncle = node.uncle()
+
+            if _is_red(uncle):
+                # case 1: red uncle, so push the blackness down from the grandparent and continue from there
+                parent.red = uncle.red = False
+                grandparent.red = True
+                node = grandparent
+                continue
+
+            if parent.is_left_child():
+                if node.is_right_child():
+                    # case 2: zig-zag, rotate into the zig-zig shape of case 3
+                    self.rotate_left(parent)
+                    node, parent = parent, node
+                self.rotate_right(grandparent)
+            else:
+                if node.is_left_child():
+                    self.rotate_right(parent)
+                    node, parent = parent, node
+                self.rotate_left(grandparent)
+
+            # case 3: parent has taken the grandparent's place, so it takes its colour too
+            parent.red = False
+            grandparent.red = True
+            break
+
+        self.root.red = False
+
+    def _after_delete(self, node, child, parent):
+        if node.red:
+            return # removing a red node never changes any black heights
+
+        # child is "doubly black" until we can either recolour it or fix things up with rotations
+        while child is not self.root and not _is_red(child):
+            # the removed node was black, so the child's sibling exists
+            if child is parent.left:
+                sibling = parent.right
+                if sibling.red:
+                    sibling.red = False
+                    parent.red = True
+                    self.rotate_left(parent)
+                    sibling = parent.right
+
+                if not _is_red(sibling.left) and not _is_red(sibling.right):
+                    sibling.red = True
+                    child, parent = parent, parent.parent
+                    continue
+
+                if not _is_red(sibling.right):
+                    sibling.left.red = False
+                    sibling.red = True
+                    self.rotate_right(sibling)
+                    sibling = parent.right
+
+                sibling.red = parent.red
+                parent.red = False
+                sibling.right.red = False
+                self.rotate_left(parent)
+            else:
+                sibling = parent.left
+                if sibling.red:
+                    sibling.red = False
+                    parent.red = True
+                    self.rotate_right(parent)
+                    sibling = parent.left
+
+                if not _is_red(sibling.left) and not _is_red(sibling.right):
+                    sibling.red = True
+                    child, parent = parent, parent.parent
+                    continue
+
+                if not _is_red(sibling.left):
+                    sibling.right.red = False
+                    sibling.red = True
+                    self.rotate_left(sibling)
+                    sibling = parent.left
+
+                sibling.red = parent.red
+                parent.red = False
+                sibling.left.red = False
+                self.rotate_right(parent)
+            child = self.root
+            break
+
+        if child is not None:
+            child.red = False
+
+    def _join(self, left, node, right):
+        return self._join_heights(left, _black_height(left), node, right, _black_height(right))[0]
+
+    def _join_heights(self, left, left_height, node, right, right_height):
+        # _join, given the black heights of left and right, and returning the new root along with its black
+        # height. Blackening a root keeps a red-black tree valid, so start from two black roots. If their black
+        # heights match, a black node can join them directly. Otherwise hang node, red, on the inner edge of the
+        # taller one, on top of the first black subtree with the shorter one's black height, and fix up the
+        # red-red violation that may leave just like after an insert. That's O(difference in heights + 1).
+        if left is not None and left.red:
+            left.red = False
+            left_height += 1
+        if right is not None and right.red:
+            right.red = False
+            right_height += 1
+        if left_height == right_height:
+            node.red = False
+            return super()._join(left, node, right), left_height + 1
+
+        node.red = True
+        if left_height > right_height:
+            self.root = parent = left
+            height = left_height - 1
+            current = left.right
+            while _is_red(current) or height > right_height:
+                parent, current = current, current.right
+                height -= not parent.red
+            self._join_at(parent, node, current, right, True)
+            shorter, height = right, right_height
+        else:
+            self.root = parent = right
+            height = right_height - 1
+            current = right.left
+            while _is_red(current) or height > left_height:
+                parent, current = current, current.left
+                height -= not parent.red
+            self._join_at(parent, node, left, current, False)
+            shorter, height = left, left_height
+        self._after_insert(node)
+
+        # The fixup only restructures the path above node, so the shorter tree is still whole, and the new black
+        # height is its own plus the black nodes above it, which is about as far up as we walked down.
+        if shorter is None:
+            return self.root, _black_height(self.root) # only the first join onto an empty tree
+        while shorter.parent is not None:
+            shorter = shorter.parent
+            height += not shorter.red
+        return self.root, height
+
+    def _split(self, root, key):
+        # BTree._split, but working out the black heights on the way down, so that the joins on the way back up
+        # don't each have to walk down a spine for them. Each join then costs about the difference in height
+        # of its pieces, and those add up to O(log n) for the whole split.
+        path = [] # (ancestor, its subtree's black height)
+        height = _black_height(root)
+        node = root
+        while node is not None and not key == node.key:
+            path.append((node, height))
+            height -= not node.red
+            node = node.left if key < node.key else node.right
+        if node is None:
+            left = right = None
+            left_height = right_height = 0
+        else:
+            left, right = _detach(node.left), _detach(node.right)
+            left_height = right_height = height - (not node.red)
+        for ancestor, ancestor_height in reversed(path):
+            side_height = ancestor_height - (not ancestor.red)
+            if key < ancestor.key:
+                right, right_height = self._join_heights(
+                    right, right_height, ancestor, _detach(ancestor.right), side_height
+                )
+            else:
+                left, left_height = self._join_heights(
+                    _detach(ancestor.left), side_height, ancestor, left, left_height
+                )
+        return left, node, right
+
+    def _combine_small(self, a, b, mode):
+        # the insert and delete fixups expect a black root
+        for root in (a, b):
+            if root is not None:
+                root.red = False
+        return super()._combine_small(a, b, mode)
+
+    def _init_loaded_node(self, node, depth, max_depth):
+        # colouring just the bottom level red gives every path the same number of black nodes
+        node.red = depth == max_depth and depth > 1
+
+    def _snapshot_flags(self, node):
+        return 1 << 2 if node.red else 0
+
+    def _restore_flags(self, node, flags):
+        node.red = bool(flags & 1 << 2)
+
+    def _swap_nodes(self, node1, node2):
+        # colours belong to positions in the tree, not to values
+        super()._swap_nodes(node1, node2)
+        node1.red, node2.red = node2.red, node1.red
+
+
+class AVLNode(BTNode):
+    __slots__ = ("height",)
+
+    def __init__(self, val, parent=None):
+        super().__init__(val, parent)
+        self.height = 1 # height of the subtree rooted here, counted in nodes like depth()
+
+    def __repr__(self):
+        return f"AVLNode({self.val}, h={self.height})"
+
+
+def _height(node):
+    return 0 if node is None else node.height
+
+
+# AVL tree: the subtree heights of every node's children differ by at most one.
+# This gives a tighter height bound than RBTree (about 1.44*log2(n)) at the cost of a few more rotations.
+class AVLTree(BTree):
+    node_class = AVLNode
+    rebalances = True
+
+    def depth(self):
+        return _height(self.root)
+
+    def _after_insert(self, node):
+        self._rebalance(node.parent)
+
+    def _after_delete(self, node, child, parent):
+        self._rebalance(parent)
+
+    def _rebalance(self, node):
+        # walk up towards the root, fixing heights and rotating wherever the balance is off by two
+        while node is not None:
+            old_height = node.height
+            self._update(node)
+            balance = _height(node.left) - _height(node.right)
+
+            if balance > 1:
+                if _height(node.left.left) < _height(node.left.right):
+                    self.rotate_left(node.left)
+                self.rotate_right(node)
+                node = node.parent # the subtree's new root, whose height the rotation already fixed
+            elif balance < -1:
+                if _height(node.right.right) < _height(node.right.left):
+                    self.rotate_right(node.right)
+                self.rotate_left(node)
+                node = node.parent
+            elif node.height == old_height:
+                break # nothing above here can have changed
+
+            node = node.parent
+
+    def _join(self, left, node, right):
+        # If the heights are within one of each other, node can just go between them. Otherwise walk down the
+        # inner edge of the taller tree to the first subtree at most one taller than the other tree, put node
+        # there and rebalance upwards, like after an insert.
+        left_height, right_height = _height(left), _height(right)
+        if abs(left_height - right_height) <= 1:
+            return super()._join(left, node, right)
+
+        if left_height > right_height:
+            self.root = parent = left
+            current = left.right
+            while _height(current) > right_height + 1:
+                parent, current = current, current.right
+            self._join_at(parent, node, current, right, True)
+        else:
+            self.root = parent = right
+            current = right.left
+            while _height(current) > left_height + 1:
+                parent, current = current, current.left
+            self._join_at(parent, node, left, current, False)
+        self._rebalance(parent)
+        return self.root
+
+    def _init_loaded_node(self, node, depth, max_depth):
+        # load_sorted() splits evenly, so a subtree of n nodes has the minimum possible height
+        node.height = node.size.bit_length()
+
+    def _update(self, node):
+        super()._update(node)
+        node.height = 1 + max(_height(node.left), _height(node.right))
+
+    def _swap_nodes(self, node1, node2):
+        # like colours in RBTree, heights belong to positions in the tree
+        super()._swap_nodes(node1, node2)
+        node1.height, node2.height = node2.height, node1.height
+
+
+# Splay tree: every access rotates the accessed node up to the root with rotate_pivot. Operations are
+# amortized O(log n), and frequently accessed values stay near the top, so skewed lookups get very cheap.
+class SplayTree(BTree):
+    rebalances = True
+
+    def find(self, val):
+        node, parent = self._search(self._key_of(val), self.root)
+        # on a miss, splay the last node we looked at instead so that the search still pays for itself
+        self._splay(node if node is not None else parent)
+        return node
+
+    def depth_of(self, val):
+        # looking at a node's depth shouldn't move it to the root
+        return self.depth_of_node(self._search(self._key_of(val), self.root)[0])
+
+    def _after_insert(self, node):
+        self._splay(node)
+
+    def _after_delete(self, node, child, parent):
+        self._splay(parent)
+
+    def _splay(self, node):
+        if node is None:
+            return
+        while node.parent is not None:
+            parent = node.parent
+            if parent.parent is None:
+                # zig: parent is the root, a single rotation finishes the job
+                self.rotate_pivot(node)
+            elif node.is_left_child() == parent.is_left_child():
+                # zig-zig: rotate the parent up first, then the node
+                self.rotate_pivot(parent)
+                self.rotate_pivot(node)
+            else:
+                # zig-zag: rotate the node up twice
+                self.rotate_pivot(node)
+                self.rotate_pivot(node)
+
+
+# A read-only snapshot of a tree's values, made by BTree.freeze(). The values are stored in one sorted array
+# (an array.array of int64/float64 when they all fit, otherwise a tuple), with no nodes at all, and every lookup
+# is a binary search done in C by bisect. find_many() answers whole batches of lookups in one call, using NumPy
+# when it's installed.
+#
+# Numeric snapshots can also be written to a file (save) or a shared memory block (to_shared_memory) once, and
+# then mapped read-only by any number of processes (open/attach). Attaching doesn't copy or decode anything:
+# the keys are read straight out of the shared pages.
+class FrozenBTree:
+    # magic, version, typecode, byte order of the keys ("<" or ">"), number of keys; 16 bytes, so that the keys
+    # after it stay 8-byte aligned. The keys are written in the machine's own byte order so that they can be used
+    # in place; a snapshot from a machine with the other byte order gets copied and swapped instead.
+    SHARED_HEADER = struct.Struct("<4sBccxQ")
+    SHARED_MAGIC = b"BTFZ"
+    SHARED_VERSION = 2 # version 1 had no byte order, and was always little-endian
+
+    def __init__(self, sorted_vals):
+        self.keys = _pack_keys(list(sorted_vals))
+        self._typecode = None if isinstance(self.keys, tuple) else self.keys.typecode
+        self._buffer = None # the mmap or SharedMemory the keys live in, if any
+
+    # --- Sharing between processes
+
+    def save(self, path):
+        # the bytes are built first, so that a snapshot that can't be saved leaves the file alone
+        data = self._shared_bytes()
+        with open(path, "wb") as f:
+            f.write(data)
+
+    @classmethod
+    def open(cls, path):
+        # maps a file written by save() read-only; call close() when done with it
+        with open(path, "rb") as f:
+            buffer = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+        return cls._from_buffer(buffer, buffer)
+
+    def to_shared_memory(self, name=None):
+        # Copies the snapshot into a new shared memory block, and returns the SharedMemory. Its .name is what
+        # other processes pass to attach(). The caller owns the block: call close() and unlink() on it when
+        # every process is done.
+        data = self._shared_bytes()
+        block = shared_memory.SharedMemory(name=name, create=True, size=len(data))
+        block.buf[:len(data)] = data
+        return block
+
+    @classmethod
+    def attach(cls, name):
+        # attaches to a block made by to_shared_memory() in any process; call close() when done with it
+        try:
+            block = shared_memory.SharedMemory(name=name, track=False)
+        except TypeError:
+            # Before Python 3.13, attaching always registers the block with the resource tracker. That's harmless
+            # for workers started by the process that made the block, since they share its tracker, but an
+            # unrelated process's tracker would unlink the block when it exits; use save()/open() there instead.
+            block = shared_memory.SharedMemory(name=name)
+        return cls._from_buffer(block.buf, block)
+
+    @classmethod
+    def _from_buffer(cls, buf, owner):
+        magic, version, typecode, byteorder, count = cls.SHARED_HEADER.unpack_from(buf, 0)
+        if version == 1:
+            byteorder = b"<"
+        if magic != cls.SHARED_MAGIC or version not in (1, cls.SHARED_VERSION) or byteorder not in (b"<", b">"):
+            owner.close()
+            raise ValueError("not a shareable FrozenBTree")
+        start = cls.SHARED_HEADER.size
+        frozen = cls.__new__(cls)
+        frozen._typecode = typecode.decode("ascii")
+        keys = memoryview(buf)[start:start + 8 * count]
+        if byteorder == _NATIVE_BYTEORDER:
+            frozen.keys = keys.cast(frozen._typecode)
+            frozen._buffer = owner
+        else:
+            frozen.keys = array(frozen._typecode, keys.tobytes())
+            frozen.keys.byteswap()
+            frozen._buffer = None
+            keys.release()
+            owner.close()
+        return frozen
+
+    def _shared_bytes(self):
+        if self._typecode is None:
+            raise TypeError("only int64 and float64 snapshots can be shared")
+        keys = self.keys if isinstance(self.keys, array) else array(self._typecode, self.keys)
+        header = FrozenBTree.SHARED_HEADER.pack(
+            FrozenBTree.SHARED_MAGIC, FrozenBTree.SHARED_VERSION, self._typecode.encode("ascii"),
+            _NATIVE_BYTEORDER, len(keys)
+        )
+        return header + keys.tobytes()
+
+    def close(self):
+        # Releases the mapping behind an opened or attached snapshot. The keys go with it, so using the snapshot
+        # afterwards fails rather than finding nothing.
+        if self._buffer is None:
+            return
+        self.keys.release()
+        self.keys = None
+        self._buffer.close()
+        self._buffer = None
+
+    def __len__(self):
+        return len(self.keys)
+
+    def __iter__(self):
+        return iter(self.keys)
+
+    def __reversed__(self):
+        return reversed(self.keys)
+
+    def __getitem__(self, k):
+        # the k-th smallest value, like BTree.select(k).val
+        return self.keys[k]
+
+    def sorted_list(self):
+        return iter(self.keys)
+
+    def __contains__(self, val):
+        return self.contains(val)
+
+    def contains(self, val):
+        i = self.rank(val)
+        return i < len(self.keys) and self.keys[i] == val
+
+    def rank(self, val):
+        # the number of values smaller than val
+        return bisect_left(self.keys, val)
+
+    def count_range(self, lo, hi):
+        return max(0, self.rank(hi) - self.rank(lo))
+
+    def range(self, lo=None, hi=None, reverse=False):
+        # lazily yields the values v with lo <= v < hi (either bound can be left out), in order or in reverse
+        start = 0 if lo is None else self.rank(lo)
+        stop = len(self.keys) if hi is None else max(start, self.rank(hi))
+        indices = range(stop - 1, start - 1, -1) if reverse else range(start, stop)
+        keys = self.keys
+        return (keys[i] for i in indices)
+
+    def find_many(self, vals):
+        # For each value, its index in sorted order if it's in the tree, or -1. With NumPy installed and numeric
+        # keys this is vectorized, and an ndarray of queries gets an ndarray of results back.
+        if np is not None and self._typecode is not None:
+            keys = np.frombuffer(self.keys, dtype=np.int64 if self._typecode == "q" else np.float64)
+            queries = np.asarray(vals)
+            result = np.full(queries.shape, -1, dtype=np.int64)
+            if len(keys) and queries.size:
+                # searching for the queries in sorted order walks through the keys in order too, which is much
+                # kinder to the CPU caches than jumping around at random
+                flat = queries.ravel()
+                order = np.argsort(flat, kind="stable")
+                sorted_queries = flat[order]
+                indices = np.searchsorted(keys, sorted_queries)
+                found = keys[np.minimum(indices, len(keys) - 1)] == sorted_queries
+                result.ravel()[order] = np.where(found, indices, -1)
+            return result if isinstance(vals, np.ndarray) else result.tolist()
+
+        keys = self.keys
+        n = len(keys)
+        result = []
+        for v in vals:
+            i = bisect_left(keys, v)
+            result.append(i if i < n and keys[i] == v else -1)
+        return result
+
+    def __repr__(self):
+        if self.keys is None:
+            return "FrozenBTree(closed)"
+        return f"FrozenBTree({len(self.keys)} values)"
+
+
+# A persistent (immutable) version of the plain BTree. insert/delete/rotate_pivot leave the tree alone and
+# return a new one, which copies only the nodes on the path they changed and shares every other subtree with
+# the old version. That makes a snapshot free (just keep the old tree around), and readers holding a version
+# never see it change under them.
+#
+# The nodes can't have parent pointers, since a shared subtree would need a different parent in each version,
+# so nodes are identified by value, and operations walk down from the root and rebuild the path on the way back.
+# Each operation has the same effect on the shape as the matching BTree operation, which is what the explorer's
+# undo history needs, but it also means that, like BTree, nothing keeps the tree balanced: an operation copies
+# O(h) nodes, and h can be n (after sorted inserts, say). For versions of a data set rather than of a shape, use
+# PersistentAVLTree below.
+class PersistentBTree:
+    def __init__(self, root=None):
+        self.root = root
+
+    @classmethod
+    def from_btree(cls, tree, previous=None, changed=()):
+        # Copies the shape and values of any BTree in O(n). If the tree matched the version previous until some
+        # changes were made, pass the nodes where they were made as changed (e.g. new nodes, and the parents of
+        # removed ones): only those nodes and their ancestors get copied, and every other subtree is shared with
+        # previous, at the cost of a search in previous for each one.
+        if tree.key is not None:
+            raise TypeError("PersistentBTree doesn't support key functions")
+        changed_paths = set()
+        for node in changed:
+            while node is not None and node not in changed_paths:
+                changed_paths.add(node)
+                node = node.parent
+
+        built = {}
+        stack = [] if tree.root is None else [(tree.root, False)]
+        while stack:
+            node, children_done = stack.pop()
+            if previous is not None and not children_done and node not in changed_paths:
+                pnode = previous.find(node.val)
+                if pnode is not None and pnode.size == node.size:
+                    built[node] = pnode
+                    continue
+            if children_done:
+                # children are built before their parents, and only ever needed by them
+                left = None if node.left is None else built.pop(node.left)
+                right = None if node.right is None else built.pop(node.right)
+                built[node] = PNode(node.val, left, right)
+            else:
+                stack.append((node, True))
+                for child in (node.left, node.right):
+                    if child is not None:
+                        stack.append((child, False))
+        return cls(built[tree.root] if tree.root is not None else None)
+
+    def to_btree(self, tree_class=None):
+        # a mutable copy with the same shape
+        tree = (BTree if tree_class is None else tree_class)()
+        stack = [] if self.root is None else [(self.root, None, False)]
+        while stack:
+            pnode, parent, left_side = stack.pop()
+            node = tree.node_class(pnode.val, parent)
+            node.size = pnode.size
+            if parent is None:
+                tree.root = node
+            elif left_side:
+                parent.left = node
+            else:
+                parent.right = node
+            if pnode.right is not None:
+                stack.append((pnode.right, node, False))
+            if pnode.left is not None:
+                stack.append((pnode.left, node, True))
+        return tree
+
+    def __len__(self):
+        return _size(self.root)
+
+    def __iter__(self):
+        stack = []
+        current = self.root
+        while stack or current is not None:
+            while current is not None:
+                stack.append(current)
+                current = current.left
+            current = stack.pop()
+            yield current.val
+            current = current.right
+
+    def sorted_list(self):
+        return iter(self)
+
+    def depth(self):
+        depth = 0
+        stack = [] if self.root is None else [(self.root, 1)]
+        while stack:
+            node, d = stack.pop()
+            depth = max(depth, d)
+            for child in (node.left, node.right):
+                if child is not None:
+                    stack.append((child, d + 1))
+        return depth
+
+    def find(self, val):
+        current = self.root
+        while current is not None:
+            if val == current.val:
+                return current
+            current = current.left if val < current.val else current.right
+        return None
+
+    def __contains__(self, val):
+        return self.find(val) is not None
+
+    def _path_to(self, val):
+        # the (node, went left) steps from the root down to val's position, and the node there (or None)
+        path = []
+        current = self.root
+        while current is not None and not val == current.val:
+            went_left = val < current.val
+            path.append((current, went_left))
+            current = current.left if went_left else current.right
+        return path, current
+
+    def _rebuild(self, path, subtree):
+        # copies the nodes along path, hanging subtree where the path ended, and returns the new tree
+        for node, went_left in reversed(path):
+            if went_left:
+                subtree = PNode(node.val, subtree, node.right)
+            else:
+                subtree = PNode(node.val, node.left, subtree)
+        return PersistentBTree(subtree)
+
+    def insert(self, val):
+        path, node = self._path_to(val)
+        if node is not None:
+            return self
+        return self._rebuild(path, PNode(val))
+
+    def delete(self, val):
+        path, node = self._path_to(val)
+        if node is None:
+            return self
+
+        if node.left is None or node.right is None:
+            return self._rebuild(path, node.left if node.right is None else node.right)
+
+        # like BTree, the successor takes the deleted node's place and its right child takes the successor's
+        right_path = []
+        successor = node.right
+        while successor.left is not None:
+            right_path.append((successor, True))
+            successor = successor.left
+        new_right = self._rebuild(right_path, successor.right).root
+        return self._rebuild(path, PNode(successor.val, node.left, new_right))
+
+    def rotate_pivot(self, val):
+        # rotates the node holding val above its parent, as BTree.rotate_pivot does
+        path, pivot = self._path_to(val)
+        if pivot is None or not path:
+            return self
+        parent, pivot_is_left = path.pop()
+        if pivot_is_left:
+            subtree = PNode(pivot.val, pivot.left, PNode(parent.val, pivot.right, parent.right))
+        else:
+            subtree = PNode(pivot.val, PNode(parent.val, parent.left, pivot.left), pivot.right)
+        return self._rebuild(path, subtree)
+
+    def __repr__(self):
+        return f"PersistentBTree({len(self)} values)"
+
+
+class PNode:
+    __slots__ = ("val", "left", "right", "size")
+
+    def __init__(self, val, left=None, right=None):
+        self.val = val
+        self.left = left
+        self.right = right
+        self.size = 1 + _size(left) + _size(right)
+
+    def __repr__(self):
+        return f"PNode({self.val})"
+
+
+# A persistent AVL tree, for keeping versions of a data set: like PersistentBTree, every operation returns a new
+# version that shares all but the O(log n) nodes on the changed path with the old one, and rotations on the way
+# back up keep it balanced whatever order the values come in. Searches compare keys, as in BTree, so a key
+# function can be given.
+class PersistentAVLTree:
+    def __init__(self, root=None, key=None):
+        self.root = root
+        self.key = key
+
+    @classmethod
+    def from_sorted(cls, vals, key=None):
+        # builds a perfectly balanced version from sorted values in O(n) (duplicates are dropped)
+        vals = list(vals)
+        keys = vals if key is None else list(map(key, vals))
+        unique = []
+        for i, k in enumerate(keys):
+            if not unique or keys[unique[-1]] < k:
+                unique.append(i)
+            elif not k == keys[unique[-1]]:
+                raise ValueError("from_sorted() needs its values in sorted order")
+
+        def build(lo, hi):
+            # the recursion only goes log2(n) deep
+            if lo == hi:
+                return None
+            mid = (lo + hi) // 2
+            i = unique[mid]
+            return PAVLNode(vals[i], keys[i], build(lo, mid), build(mid + 1, hi))
+
+        return cls(build(0, len(unique)), key)
+
+    def _key_of(self, val):
+        return val if self.key is None else self.key(val)
+
+    def __len__(self):
+        return _size(self.root)
+
+    def __iter__(self):
+        return self.range()
+
+    def __reversed__(self):
+        return self.range(reverse=True)
+
+    def sorted_list(self):
+        return iter(self)
+
+    def depth(self):
+        return _height(self.root)
+
+    def find(self, val):
+        # the node holding val, or None
+        key = self._key_of(val)
+        current, candidate = self.root, None
+        while current is not None:
+            if key < current.key:
+                current = current.left
+            else:
+                candidate = current
+                current = current.right
+        return candidate if candidate is not None and not candidate.key < key else None
+
+    def __contains__(self, val):
+        return self.find(val) is not None
+
+    def rank(self, val):
+        # the number of values smaller than val
+        key = self._key_of(val)
+        rank = 0
+        current = self.root
+        while current is not None:
+            if current.key < key:
+                rank += _size(current.left) + 1
+                current = current.right
+            else:
+                current = current.left
+        return rank
+
+    def select(self, k):
+        # the node holding the k-th smallest value, counting from 0. Negative k counts from the end, like a list.
+        if k < 0:
+            k += len(self)
+        if not 0 <= k < len(self):
+            raise IndexError("PersistentAVLTree index out of range")
+        current = self.root
+        while True:
+            left_size = _size(current.left)
+            if k == left_size:
+                return current
+            elif k < left_size:
+                current = current.left
+            else:
+                k -= left_size + 1
+                current = current.right
+
+    def count_range(self, lo, hi):
+        # the number of values v with lo <= v < hi
+        return max(0, self.rank(hi) - self.rank(lo))
+
+    def range(self, lo=None, hi=None, reverse=False):
+        # Lazily yields the values v with lo <= v < hi (either bound can be left out), in order or in reverse.
+        # The stack holds the nodes still to be yielded on the way back up, so it's O(log n + k) for k values.
+        lo_key = None if lo is None else self._key_of(lo)
+        hi_key = None if hi is None else self._key_of(hi)
+        stack = []
+        current = self.root
+        if reverse:
+            while current is not None:
+                if hi is not None and not current.key < hi_key:
+                    current = current.left
+                else:
+                    stack.append(current)
+                    current = current.right
+            while stack:
+                node = stack.pop()
+                if lo is not None and node.key < lo_key:
+                    return
+                yield node.val
+                current = node.left
+                while current is not None:
+                    stack.append(current)
+                    current = current.right
+        else:
+            while current is not None:
+                if lo is not None and current.key < lo_key:
+                    current = current.right
+                else:
+                    stack.append(current)
+                    current = current.left
+            while stack:
+                node = stack.pop()
+                if hi is not None and not node.key < hi_key:
+                    return
+                yield node.val
+                current = node.right
+                while current is not None:
+                    stack.append(current)
+                    current = current.left
+
+    def _path_to(self, key):
+        # the (node, went left) steps from the root down to key's position, and the node there (or None)
+        path = []
+        current = self.root
+        while current is not None and (key < current.key or current.key < key):
+            went_left = key < current.key
+            path.append((current, went_left))
+            current = current.left if went_left else current.right
+        return path, current
+
+    def _rebuild(self, path, subtree):
+        # copies the nodes along path, rebalancing each one, with subtree where the path ended
+        for node, went_left in reversed(path):
+            if went_left:
+                subtree = _pavl_balanced(node.val, node.key, subtree, node.right)
+            else:
+                subtree = _pavl_balanced(node.val, node.key, node.left, subtree)
+        return type(self)(subtree, self.key)
+
+    def insert(self, val):
+        # returns the new version, or this one if val is already in it
+        key = self._key_of(val)
+        path, node = self._path_to(key)
+        if node is not None:
+            return self
+        return self._rebuild(path, PAVLNode(val, key))
+
+    def delete(self, val):
+        path, node = self._path_to(self._key_of(val))
+        if node is None:
+            return self
+        if node.left is None or node.right is None:
+            return self._rebuild(path, node.left if node.right is None else node.right)
+
+        # the successor takes the deleted node's place
+        right_path = []
+        successor = node.right
+        while successor.left is not None:
+            right_path.append((successor, True))
+            successor = successor.left
+        new_right = self._rebuild(right_path, successor.right).root
+        return self._rebuild(path, _pavl_balanced(successor.val, successor.key, node.left, new_right))
+
+    def __repr__(self):
+        return f"PersistentAVLTree({len(self)} values)"
+
+
+class PAVLNode:
+    __slots__ = ("val", "key", "left", "right", "size", "height")
+
+    def __init__(self, val, key, left=None, right=None):
+        self.val = val
+        self.key = key
+        self.left = left
+        self.right = right
+        self.size = 1 + _size(left) + _size(right)
+        self.height = 1 + max(_height(left), _height(right))
+
+    def __repr__(self):
+        return f"PAVLNode({self.val}, h={self.height})"
+
+
+def _pavl_balanced(val, key, left, right):
+    # A new node over left and right, whose heights differ by at most 2, rotated if needed so that they differ
+    # by at most 1. This is AVLTree._rebalance, but building new nodes instead of relinking old ones.
+    left_height, right_height = _height(left), _height(right)
+    if left_height > right_height + 1:
+        if _height(left.left) < _height(left.right):
+            middle = left.right
+            return PAVLNode(
+                middle.val, middle.key,
+                PAVLNode(left.val, left.key, left.left, middle.left),
+                PAVLNode(val, key, middle.right, right)
+            )
+        return PAVLNode(left.val, left.key, left.left, PAVLNode(val, key, left.right, right))
+    if right_height > left_height + 1:
+        if _height(right.right) < _height(right.left):
+            middle = right.left
+            return PAVLNode(
+                middle.val, middle.key,
+                PAVLNode(val, key, left, middle.left),
+                PAVLNode(right.val, right.key, middle.right, right.right)
+            )
+        return PAVLNode(right.val, right.key, PAVLNode(val, key, left, right.left), right.right)
+    return PAVLNode(val, key, left, right)
+
+
+# A tree that any number of threads can use at once. Readers never take a lock: they grab the current
+# PersistentAVLTree version (a single attribute read) and search that, and since versions never change, a reader
+# can't see a half-finished update the way it could in the middle of BTree._swap_nodes or _transplant.
+# Writers take turns on a lock, build the next version off to the side and then publish it by swapping the
+# reference. The versions are balanced, so a write copies O(log n) nodes whatever order the values come in.
+# Iterating and range queries work on the version that was current when they started.
+class ConcurrentBTree:
+    def __init__(self, vals=None, key=None):
+        self._write_lock = threading.Lock()
+        self._version = PersistentAVLTree.from_sorted(sorted(vals, key=key) if vals is not None else [], key)
+
+    def snapshot(self):
+        # the current version, which stays consistent however long the caller holds on to it
+        return self._version
+
+    def find(self, val):
+        return self._version.find(val)
+
+    def __contains__(self, val):
+        return val in self._version
+
+    def __len__(self):
+        return len(self._version)
+
+    def __iter__(self):
+        return iter(self._version)
+
+    def sorted_list(self):
+        return iter(self._version)
+
+    def rank(self, val):
+        return self._version.rank(val)
+
+    def select(self, k):
+        return self._version.select(k)
+
+    def count_range(self, lo, hi):
+        return self._version.count_range(lo, hi)
+
+    def range(self, lo=None, hi=None, reverse=False):
+        return self._version.range(lo, hi, reverse)
+
+    def insert(self, val):
+        # returns whether val was added
+        with self._write_lock:
+            version = self._version.insert(val)
+            changed = version is not self._version
+            self._version = version
+        return changed
+
+    def delete(self, val):
+        with self._write_lock:
+            self._version = self._version.delete(val)
+
+    def insert_many(self, vals):
+        # publishes all of vals at once, so readers see either none of them or all of them
+        with self._write_lock:
+            version = self._version
+            if version.root is None:
+                version = PersistentAVLTree.from_sorted(sorted(vals, key=version.key), version.key)
+            else:
+                for v in vals:
+                    version = version.insert(v)
+            self._version = version
+
+    def delete_many(self, vals):
+        with self._write_lock:
+            version = self._version
+            for v in vals:
+                version = version.delete(v)
+            self._version = version
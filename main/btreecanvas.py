@@ -1,7 +1,11 @@
+import itertools
+from bisect import bisect_left, bisect_right
+from contextlib import contextmanager
 from tkinter import *
 from tkinter import ttk
 
-from btree import BTree
+from btree import BTree, PersistentBTree, _size
+from layout import view_layout
 
 
 class NodeItem:
@@ -13,107 +17,63 @@ class NodeItem:
     OUTLINE_WIDTH = 2
     LABEL_COLOR = "black"
 
+    _ids = itertools.count()
+
     def __init__(self, canvas, coords, text=""):
         self.canvas = canvas
         self.coords = coords
         self.text = text
-        self.on_mouse1 = None
-        self.on_mouse2 = None
+        self.node = None # the BTNode this item is showing, since items get reused for other nodes
 
         self.items = object()
+        # both items carry this tag too, so that one canvas.move() call moves the whole node
+        self.tag = f"{NodeItem.TAG}{next(NodeItem._ids)}"
 
         x, y = coords
 
-        self.item_highlight_circle = self.canvas.create_oval(
-            x - NodeItem.SELECT_RADIUS, y - NodeItem.SELECT_RADIUS,
-            x + NodeItem.SELECT_RADIUS, y + NodeItem.SELECT_RADIUS,
-            outline=NodeItem.OUTLINE_COLOR,
-            width=NodeItem.OUTLINE_WIDTH,
-            state=HIDDEN,
-            tags=[NodeItem.TAG]
-        )
-
         self.item_main_circle = self.canvas.create_oval(
             x - NodeItem.RADIUS, y - NodeItem.RADIUS,
             x + NodeItem.RADIUS, y + NodeItem.RADIUS,
             fill=NodeItem.FILL_COLOR,
             outline=NodeItem.OUTLINE_COLOR,
             width=NodeItem.OUTLINE_WIDTH,
-            tags=[NodeItem.TAG]
+            tags=[NodeItem.TAG, self.tag]
         )
 
         self.item_label = self.canvas.create_text(
             x, y,
             text=text,
             fill=NodeItem.LABEL_COLOR,
-            tags=[NodeItem.TAG]
+            tags=[NodeItem.TAG, self.tag]
         )
-
-        def mouse_in(evt):
-            self.canvas.itemconfig(self.item_highlight_circle, state=NORMAL)
-
-        def mouse_out(evt):
-            self.canvas.itemconfig(self.item_highlight_circle, state=HIDDEN)
-        
-        self.canvas.tag_bind(self.item_main_circle, "<Enter>", mouse_in)
-        self.canvas.tag_bind(self.item_label, "<Enter>", mouse_in)
-        self.canvas.tag_bind(self.item_main_circle, "<Leave>", mouse_out)
-    
-    def bind_mouse1(self, callback):
-        self.on_mouse1 = callback
-        self.canvas.tag_bind(self.item_main_circle, "<Button-1>", self.on_mouse1)
-        self.canvas.tag_bind(self.item_label, "<Button-1>", self.on_mouse1)
-    
-    def unbind_mouse1(self):
-        self.canvas.tag_bind(self.item_main_circle, "<Button-1>", None)
-        self.canvas.tag_bind(self.item_label, "<Button-1>", None)
-    
-    def bind_mouse2(self, callback):
-        self.on_mouse2 = callback
-        # Tk inexplicably uses Button-2 for the middle mouse button and Button-3 for the right mouse button
-        self.canvas.tag_bind(self.item_main_circle, "<Button-3>", self.on_mouse2)
-        self.canvas.tag_bind(self.item_label, "<Button-3>", self.on_mouse2)
-    
-    def unbind_mouse2(self):
-        self.canvas.tag_bind(self.item_main_circle, "<Button-3>", None)
-        self.canvas.tag_bind(self.item_label, "<Button-3>", None)
     
     def set_text(self, text):
-        self.canvas.itemconfigure(self.item_label, text=text)
+        if text != self.text:
+            self.text = text
+            self.canvas.itemconfigure(self.item_label, text=text)
     
     def move_to(self, coords, update=False):
-        self.coords = coords
-        self._update_items()
+        # does nothing (and makes no Tk calls) if the node is already there
+        if coords != self.coords:
+            (x1, y1), (x2, y2) = self.coords, coords
+            self.coords = coords
+            self.canvas.move(self.tag, x2 - x1, y2 - y1)
         
         if update:
             self.canvas.update()
     
-    def _update_items(self):
-        self._update_highlight_circle()
-        self._update_main_circle()
-        self._update_label()
-    
-    def _update_main_circle(self):
+    def shifted(self, dx, dy):
+        # for when the canvas has moved all of its items at once
         x, y = self.coords
-        x1, y1 = x - NodeItem.RADIUS, y - NodeItem.RADIUS
-        x2, y2 = x + NodeItem.RADIUS, y + NodeItem.RADIUS
-        self.canvas.coords(self.item_main_circle, x1, y1, x2, y2)
-    
-    def _update_highlight_circle(self):
-        # We need to hide the highlight circle, otherwise it might remain visible after moving away from the mouse cursor
-        self.canvas.itemconfigure(self.item_highlight_circle, state=HIDDEN)
-        x, y = self.coords
-        x1, y1 = x - NodeItem.SELECT_RADIUS, y - NodeItem.SELECT_RADIUS,
-        x2, y2 = x + NodeItem.SELECT_RADIUS, y + NodeItem.SELECT_RADIUS
-        self.canvas.coords(self.item_highlight_circle, x1, y1, x2, y2)
-    
-    def _update_label(self):
-        x, y = self.coords
-        self.canvas.coords(self.item_label, x, y)
-        self.canvas.itemconfig(self.item_label, text=self.text)
-    
+        self.coords = (x + dx, y + dy)
+
+    def hide(self):
+        self.canvas.itemconfigure(self.tag, state=HIDDEN)
+
+    def show(self):
+        self.canvas.itemconfigure(self.tag, state=NORMAL)
+
     def delete(self):
-        self.canvas.delete(self.item_highlight_circle)
         self.canvas.delete(self.item_main_circle)
         self.canvas.delete(self.item_label)
     
@@ -124,44 +84,33 @@ class ConnectionItem:
     TAG = "connection"
     LINE_COLOR = "black"
 
-    def __init__(self, canvas, node_item1, node_item2):
+    def __init__(self, canvas, coords):
         self.canvas = canvas
-        self.node_item1 = node_item1
-        self.node_item2 = node_item2
-
-        coords1 = self.node_item1.coords
-        coords2 = self.node_item2.coords
+        self.coords = coords # x1, y1, x2, y2: the parent's end, then the child's
 
         self.item_line = self.canvas.create_line(
-            (coords1, coords2),
+            coords,
             fill=ConnectionItem.LINE_COLOR,
             tags=[ConnectionItem.TAG]
         )
     
-    def set_node1(self, node):
-        self.node_item1 = node
-        self.update_coords()
-    
-    def set_node2(self, node):
-        self.node_item2 = node
-        self.update_coords()
-    
-    def set_nodes(self, node1, node2):
-        self.node_item1 = node1
-        self.node_item2 = node2
-        self.update_coords()
-    
-    def update_coords(self, update=False):
-        coords1 = self.node_item1.coords
-        coords2 = self.node_item2.coords
-
-        self.move_to(coords1 + coords2, update)
-
     def move_to(self, coords, update=False):
-        self.canvas.coords(self.item_line, *coords)
+        if coords != self.coords:
+            self.coords = coords
+            self.canvas.coords(self.item_line, *coords)
         
         if update:
             self.canvas.update()
+
+    def shifted(self, dx, dy):
+        x1, y1, x2, y2 = self.coords
+        self.coords = (x1 + dx, y1 + dy, x2 + dx, y2 + dy)
+
+    def hide(self):
+        self.canvas.itemconfigure(self.item_line, state=HIDDEN)
+
+    def show(self):
+        self.canvas.itemconfigure(self.item_line, state=NORMAL)
     
     def delete(self):
         self.canvas.delete(self.item_line)
@@ -169,109 +118,526 @@ class ConnectionItem:
     # def __del__(self):
     #     self.delete()
 
+class SubtreeItem:
+    # Stands in for a whole subtree when it's too narrow on screen to draw its nodes: a triangle hanging from
+    # where the subtree's root would be, as wide as the subtree, labelled with the number of nodes in it.
+    TAG = "subtree"
+    HEIGHT = 20
+    FILL_COLOR = "gray60"
+    OUTLINE_COLOR = "black"
+    LABEL_COLOR = "black"
+
+    def __init__(self, canvas, coords, text=""):
+        self.canvas = canvas
+        self.coords = coords # x, y of the subtree's root, then the x of its leftmost and rightmost nodes
+        self.text = text
+        self.node = None
+
+        self.item_triangle = self.canvas.create_polygon(
+            SubtreeItem.triangle_coords(coords),
+            fill=SubtreeItem.FILL_COLOR,
+            outline=SubtreeItem.OUTLINE_COLOR,
+            tags=[SubtreeItem.TAG]
+        )
+
+        x, y, _, _ = coords
+        self.item_label = self.canvas.create_text(
+            x, y + SubtreeItem.HEIGHT,
+            text=text,
+            anchor=N,
+            fill=SubtreeItem.LABEL_COLOR,
+            tags=[SubtreeItem.TAG]
+        )
+
+    @staticmethod
+    def triangle_coords(coords):
+        x, y, left_x, right_x = coords
+        bottom = y + SubtreeItem.HEIGHT
+        return (x, y, left_x, bottom, right_x, bottom)
+
+    def set_text(self, text):
+        if text != self.text:
+            self.text = text
+            self.canvas.itemconfigure(self.item_label, text=text)
+
+    def move_to(self, coords):
+        if coords != self.coords:
+            self.coords = coords
+            x, y, _, _ = coords
+            self.canvas.coords(self.item_triangle, *SubtreeItem.triangle_coords(coords))
+            self.canvas.coords(self.item_label, x, y + SubtreeItem.HEIGHT)
+
+    def shifted(self, dx, dy):
+        x, y, left_x, right_x = self.coords
+        self.coords = (x + dx, y + dy, left_x + dx, right_x + dx)
+
+    def hide(self):
+        self.canvas.itemconfigure(self.item_triangle, state=HIDDEN)
+        self.canvas.itemconfigure(self.item_label, state=HIDDEN)
+
+    def show(self):
+        self.canvas.itemconfigure(self.item_triangle, state=NORMAL)
+        self.canvas.itemconfigure(self.item_label, state=NORMAL)
+
+    def delete(self):
+        self.canvas.delete(self.item_triangle)
+        self.canvas.delete(self.item_label)
+
+def _unsupported(name):
+    def method(*args, **kwargs):
+        raise TypeError(f"BTreeCanvas doesn't support {name}(), use a BTree and load_sorted() the result")
+    return method
+
+
 # It's tempting to inherit from Canvas, but I'd rather avoid name conflicts etc.
 # Instead we inherit from BTree and store the canvas as an attribute.
 class BTreeCanvas(BTree):
     HORIZ_SPACING = 40
     VERT_SPACING = 40
     TOP_PADDING = 40
+    MIN_ZOOM = 1e-6
+    MAX_ZOOM = 4
+    DETAIL_ZOOM = 0.5 # zoomed out further than this, narrow subtrees get drawn as SubtreeItems
+    COLLAPSE_WIDTH = 60 # how narrow, in pixels
+
+    # Splitting, joining and the set operations make new trees out of this one's nodes, and each new tree would
+    # need a canvas of its own. from_sorted, bulk_load and load work, given the canvas: from_sorted(vals, canvas).
+    split = _unsupported("split")
+    union = _unsupported("union")
+    intersection = _unsupported("intersection")
+    difference = _unsupported("difference")
+    join = classmethod(_unsupported("join"))
+    parallel_bulk_load = classmethod(_unsupported("parallel_bulk_load"))
 
     def __init__(self, canvas, vals=None):
-        super().__init__(vals)
-
+        # everything has to be in place before BTree.__init__ inserts the initial values
         self.canvas = canvas
+
+        # Only what's in view has canvas items. The items of anything that goes out of view are hidden and pooled
+        # for reuse, so that moving around a huge tree doesn't keep creating and deleting them.
         self.node_items = {} # dict : BTNode -> NodeItem
-        self.connection_items = {} # dict : BTNode -> ConnectionItem | None,
-                                   # connecting the node with its parent (or None if root)
+        self.connection_items = {} # dict : BTNode -> ConnectionItem, connecting the node with its parent
+        self.subtree_items = {} # dict : BTNode -> SubtreeItem, standing in for the subtree under the node
+        self.free_node_items = []
+        self.free_connection_items = []
+        self.free_subtree_items = []
         self.guideline_items = {} # dict: BTNode -> id of line item in canvas
 
-        if vals is not None:
-            self.build_items()
+        # The view: the unzoomed x coordinate (relative to the root) in the middle of the canvas, how far down
+        # it's scrolled, and the zoom. Zooming only squeezes the tree horizontally, since trees get a lot wider
+        # than they get deep.
+        self.view_x = 0
+        self.view_y = 0
+        self.zoom = 1
+
+        # The mouse is handled by a few bindings on the whole canvas rather than by bindings on every item.
+        # build_items indexes what it draws by row, so the handlers can find what's under the mouse with a bisect.
+        self.node_rows = {} # dict : y -> ([x], [BTNode]), sorted by x
+        self.subtree_rows = {} # dict : y -> ([left x], [(coords, BTNode)]), sorted by left x
+        self.hovered = None
+        self.hovered_coords = None
+        self.highlight_item = self.canvas.create_oval(
+            0, 0, 0, 0,
+            outline=NodeItem.OUTLINE_COLOR,
+            width=NodeItem.OUTLINE_WIDTH,
+            state=HIDDEN
+        )
+        self.canvas.bind("<Motion>", self.on_motion)
+        self.canvas.bind("<Leave>", lambda evt: self.set_hovered(None))
+        self.canvas.bind("<Button-1>", self.on_mouse1)
+        # Tk inexplicably uses Button-2 for the middle mouse button and Button-3 for the right mouse button
+        self.canvas.bind("<Button-3>", self.on_mouse2)
+
+        # Undo history. Every change is mirrored in a PersistentBTree, so each version costs only the nodes on
+        # the changed path, and undo/redo just reshape the tree to match an older or newer version.
+        self.versions = [PersistentBTree()]
+        self.version_index = 0
+
+        # inside batch(), changes are only noted, and drawn and recorded when the batch ends
+        self.batch_depth = 0
+        self.batch_changed = False
+        self.batch_touched = [] # nodes where the batch changed the tree, so the rest can share the last version
+
+        with self.batch():
+            super().__init__(vals)
     
+    @contextmanager
+    def batch(self):
+        # Suspends drawing while the tree is changed, e.g.
+        #     with btree_canvas.batch():
+        #         for v in vals:
+        #             btree_canvas.insert(v)
+        # The tree is laid out and drawn once at the end, and the whole batch becomes a single undo step.
+        # Batches can be nested; only the outermost one draws.
+        self.batch_depth += 1
+        try:
+            yield self
+        finally:
+            self.batch_depth -= 1
+            if self.batch_depth == 0 and self.batch_changed:
+                self.batch_changed = False
+                touched, self.batch_touched = self.batch_touched, []
+                self._record(PersistentBTree.from_btree(self, self.versions[self.version_index], touched))
+                self.build_items()
+
     def insert(self, val):
         new_node = super().insert(val)
-        self.build_items()
+        if new_node is None:
+            return None
+
+        if self.batch_depth:
+            self.batch_changed = True
+        else:
+            self._record(self.versions[self.version_index].insert(val))
+            self.build_items()
 
         return new_node
     
+    def insert_many(self, vals):
+        with self.batch():
+            size = len(self)
+            super().insert_many(vals)
+            self.batch_changed |= len(self) != size
+
+    def delete_many(self, vals):
+        with self.batch():
+            super().delete_many(vals)
+
+    def load_sorted(self, vals):
+        self.clear_items()
+        try:
+            super().load_sorted(vals)
+            self._record(PersistentBTree.from_btree(self))
+        finally:
+            self.build_items()
+
+    def restore(self, fileobj):
+        self.clear_items()
+        try:
+            super().restore(fileobj)
+            self._record(PersistentBTree.from_btree(self))
+        finally:
+            self.build_items() # the old tree is left alone if the snapshot is bad
+
+    def undo(self):
+        if self.version_index > 0:
+            self.version_index -= 1
+            self._show_version(self.versions[self.version_index])
+
+    def redo(self):
+        if self.version_index + 1 < len(self.versions):
+            self.version_index += 1
+            self._show_version(self.versions[self.version_index])
+
+    def _record(self, version):
+        # make version the current one, forgetting anything that had been undone
+        del self.versions[self.version_index + 1:]
+        self.versions.append(version)
+        self.version_index += 1
+
+    def _show_version(self, version):
+        # Reshape the tree to match version. Nodes whose values are in both keep their BTNode, and with it their
+        # canvas items, so that they just move to their new places.
+        old_nodes = {node.val: node for node in self.iter_nodes()}
+        self.root = None
+        stack = [] if version.root is None else [(version.root, None, False)]
+        while stack:
+            pnode, parent, left_side = stack.pop()
+            node = old_nodes.pop(pnode.val, None)
+            if node is None:
+                node = self.node_class(pnode.val)
+            node.parent = parent
+            node.left = node.right = None
+            node.size = pnode.size
+            if parent is None:
+                self.root = node
+            elif left_side:
+                parent.left = node
+            else:
+                parent.right = node
+            if pnode.right is not None:
+                stack.append((pnode.right, node, False))
+            if pnode.left is not None:
+                stack.append((pnode.left, node, True))
+
+        for node in old_nodes.values(): # values that aren't in this version
+            self.delete_items(node)
+        self.build_items()
+
+    # Within a batch, note where the tree changes. Deletions and rotations keep every subtree below the node
+    # they're noted at, and the new nodes from _link_sorted are all noted.
+
+    def _after_insert(self, node):
+        if self.batch_depth:
+            self.batch_touched.append(node)
+
+    def _after_delete(self, node, child, parent):
+        if self.batch_depth:
+            self.batch_touched.append(parent)
+
+    def _init_loaded_node(self, node, depth, max_depth):
+        if self.batch_depth:
+            self.batch_touched.append(node)
+
+    def clear_items(self):
+        # for when all of the nodes get replaced, so that drawing starts from scratch
+        for items, free_items in self._item_kinds():
+            for item in itertools.chain(items.values(), free_items):
+                item.delete()
+            items.clear()
+            free_items.clear()
+
     def delete_node(self, node):
-        # if self.node_items.get(node, None) is not None:
-        self.node_items[node].delete()
-        del self.node_items[node]
-        
-        if self.connection_items.get(node, None) is not None:
-            self.connection_items[node].delete()
-            del self.connection_items[node]
-        
+        if node is None:
+            return
+        self.delete_items(node)
+        val = node.val
         super().delete_node(node)
+        if self.batch_depth:
+            self.batch_changed = True
+            return
+        self._record(self.versions[self.version_index].delete(val))
         
         self.build_items()
 
+    def delete_items(self, node):
+        # hands whatever items the node has back to the pools
+        for items, free_items in self._item_kinds():
+            item = items.pop(node, None)
+            if item is not None:
+                item.hide()
+                free_items.append(item)
+        
+    def _item_kinds(self):
+        return [
+            (self.node_items, self.free_node_items),
+            (self.connection_items, self.free_connection_items),
+            (self.subtree_items, self.free_subtree_items),
+        ]
+
     def rotate_pivot(self, pivot):
+        if pivot is self.root:
+            return
+        parent = pivot.parent
         super().rotate_pivot(pivot)
+        if self.batch_depth:
+            self.batch_changed = True
+            self.batch_touched.append(parent)
+            return
+        self._record(self.versions[self.version_index].rotate_pivot(pivot.val))
         self.build_items()
     
-    def build_items(self):
-        if self.root is None:
-            return
+    # --- The view
+
+    def scroll(self, dx, dy):
+        # Moves the view by dx, dy pixels. Everything on the canvas moves together with one Tk call, so only
+        # what comes into or goes out of view needs any more.
+        dy = max(0, self.view_y + dy) - self.view_y
+        self.view_x += dx / self.zoom
+        self.view_y += dy
+        self.canvas.move(ALL, -dx, -dy)
+        for items, free_items in self._item_kinds():
+            for item in itertools.chain(items.values(), free_items):
+                item.shifted(-dx, -dy)
+        self.build_items()
 
-        nodes = self.sorted_nodes()
-        coords = self.build_inorder_coords(nodes)
-        
-        # create/update NodeItems
-        for i in range(len(nodes)):
-            if nodes[i] in self.node_items:
-                self.node_items[nodes[i]].move_to(coords[i])
-            else:
-                self.node_items[nodes[i]] = self.build_node_item(nodes[i], coords[i])
-            
-        # create/update ConnectionItems to parents
-        for i in range(len(nodes)):
-            if nodes[i].parent is None:
-                if self.connection_items.get(nodes[i], None) is not None:
-                    self.connection_items[nodes[i]].delete()
-                self.connection_items[nodes[i]] = None
-            else:
-                if self.connection_items.get(nodes[i], None) is not None:
-                    self.connection_items[nodes[i]].set_nodes(
-                        self.node_items[nodes[i].parent],
-                        self.node_items[nodes[i]]
-                    )
-                else:
-                    self.connection_items[nodes[i]] = ConnectionItem(
-                        self.canvas, 
-                        self.node_items[nodes[i].parent],
-                        self.node_items[nodes[i]]
-                    )
-
-        self.canvas.tag_raise(NodeItem.TAG)
-        self.canvas.update()
-    
-    def build_inorder_coords(self, nodes):
+    def zoom_by(self, factor, x=None):
+        # zooms in (or out, for factor < 1) around x on the canvas, the middle by default
+        offset = 0 if x is None else x - self.canvas_size()[0] // 2
+        anchor = self.view_x + offset / self.zoom
+        self.zoom = min(max(self.zoom * factor, BTreeCanvas.MIN_ZOOM), BTreeCanvas.MAX_ZOOM)
+        self.view_x = anchor - offset / self.zoom
+        self.build_items()
+
+    def show_subtree(self, node):
+        # fits the subtree under node to the width of the canvas, with node at the top
+        width = self.canvas_size()[0]
+        first = self.rank(node.val) - _size(node.left)
+        self.zoom = min(max(width / ((node.size + 1) * BTreeCanvas.HORIZ_SPACING), BTreeCanvas.MIN_ZOOM), 1)
+        self.view_x = (first + (node.size - 1) / 2 - _size(self.root.left)) * BTreeCanvas.HORIZ_SPACING
+        self.view_y = (self.depth_of_node(node) - 1) * BTreeCanvas.VERT_SPACING
+        self.build_items()
+
+    def fit_view(self):
+        if self.root is not None:
+            self.show_subtree(self.root)
+
+    def reset_view(self):
+        self.view_x = self.view_y = 0
+        self.zoom = 1
+        self.build_items()
+
+    def canvas_size(self):
         canvas_config = self.canvas.config()
-        width, height = int(canvas_config["width"][-1]), int(canvas_config["height"][-1])
-        midpoint = width // 2
+        return int(canvas_config["width"][-1]), int(canvas_config["height"][-1])
 
-        root_index = nodes.index(self.root)
+    def build_items(self):
+        # Brings the canvas up to date with the tree and the view. Only the part of the tree that's in view gets
+        # laid out and drawn, so this costs about the same for a million nodes as for a hundred, and items that
+        # are already in the right place make no Tk calls at all.
+        nodes, connections, subtrees = self.build_view_coords()
 
-        # keep the root node centred, evenly space the nodes on either side
-        x_coords = [midpoint + (i - root_index) * BTreeCanvas.HORIZ_SPACING for i in range(len(nodes))]
+        created = self._sync_items(
+            self.node_items, self.free_node_items, nodes, self.build_node_item, self._place_node_item
+        )
+        created |= self._sync_items(
+            self.connection_items, self.free_connection_items, connections,
+            self.build_connection_item, self._place_connection_item
+        )
+        created |= self._sync_items(
+            self.subtree_items, self.free_subtree_items, subtrees, self.build_subtree_item, self._place_subtree_item
+        )
 
-        # the nodes are in order horizontally, and lowered vertically based on their depth
-        depths = map(self.depth_of_node, nodes)
-        y_coords = [BTreeCanvas.TOP_PADDING + d * BTreeCanvas.VERT_SPACING for d in depths]
+        if created:
+            # new lines go on top, so put everything else back above them
+            self.canvas.tag_raise(SubtreeItem.TAG)
+            self.canvas.tag_raise(NodeItem.TAG)
 
-        return list(zip(x_coords, y_coords))
+        self.index_items(nodes, subtrees)
+        if self.hovered is not None and nodes.get(self.hovered) != self.hovered_coords:
+            self.set_hovered(None) # otherwise it might remain visible after moving away from the mouse cursor
+        self.canvas.update()
+    
+    def _sync_items(self, items, free_items, coords, build, place):
+        # Makes items (dict : BTNode -> item) match coords (dict : BTNode -> coords), taking items from the pool
+        # before building new ones. Returns whether any were built.
+        for node in [node for node in items if node not in coords]:
+            item = items.pop(node)
+            item.hide()
+            free_items.append(item)
+
+        created = False
+        for node, node_coords in coords.items():
+            item = items.get(node)
+            if item is not None:
+                place(item, node, node_coords)
+            elif free_items:
+                item = items[node] = free_items.pop()
+                place(item, node, node_coords)
+                item.show()
+            else:
+                items[node] = build(node, node_coords)
+                created = True
+        return created
+
+    def index_items(self, nodes, subtrees):
+        # view_layout goes through each row from left to right, so the rows come out sorted
+        self.node_rows = {}
+        for node, (x, y) in nodes.items():
+            xs, row_nodes = self.node_rows.setdefault(y, ([], []))
+            xs.append(x)
+            row_nodes.append(node)
+
+        self.subtree_rows = {}
+        for node, coords in subtrees.items():
+            left_xs, entries = self.subtree_rows.setdefault(coords[1], ([], []))
+            left_xs.append(coords[2])
+            entries.append((coords, node))
+
+    def node_at(self, x, y):
+        # the node drawn at x, y on the canvas, if any
+        depth = round((y + self.view_y - BTreeCanvas.TOP_PADDING) / BTreeCanvas.VERT_SPACING)
+        row_y = BTreeCanvas.TOP_PADDING + depth * BTreeCanvas.VERT_SPACING - self.view_y
+        xs, row_nodes = self.node_rows.get(row_y, ((), ()))
+
+        # zoomed out, neighbouring nodes can overlap, so take the closest
+        found, found_distance = None, NodeItem.RADIUS ** 2
+        i = bisect_left(xs, x - NodeItem.RADIUS)
+        while i < len(xs) and xs[i] <= x + NodeItem.RADIUS:
+            distance = (xs[i] - x) ** 2 + (row_y - y) ** 2
+            if distance <= found_distance:
+                found, found_distance = row_nodes[i], distance
+            i += 1
+        return found
+
+    def subtree_at(self, x, y):
+        # the node whose subtree is drawn as a SubtreeItem at x, y on the canvas, if any
+        depth = (y + self.view_y - BTreeCanvas.TOP_PADDING) // BTreeCanvas.VERT_SPACING
+        row_y = BTreeCanvas.TOP_PADDING + depth * BTreeCanvas.VERT_SPACING - self.view_y
+        left_xs, entries = self.subtree_rows.get(row_y, ((), ()))
+        if not row_y <= y <= row_y + SubtreeItem.HEIGHT:
+            return None
+
+        # Inside the triangle, give or take a couple of pixels so that the thin ones can be clicked on too. That
+        # makes the neighbours overlap a little, so it could be either of the last two starting left of x.
+        t = (y - row_y) / SubtreeItem.HEIGHT
+        i = bisect_right(left_xs, x + 2)
+        for (top_x, _, left_x, right_x), node in reversed(entries[max(0, i - 2):i]):
+            if top_x + (left_x - top_x) * t - 2 <= x <= top_x + (right_x - top_x) * t + 2:
+                return node
+        return None
+
+    def set_hovered(self, node):
+        if node is self.hovered:
+            return
+        self.hovered = node
+        if node is None:
+            self.hovered_coords = None
+            self.canvas.itemconfigure(self.highlight_item, state=HIDDEN)
+        else:
+            x, y = self.hovered_coords = self.node_items[node].coords
+            self.canvas.coords(
+                self.highlight_item,
+                x - NodeItem.SELECT_RADIUS, y - NodeItem.SELECT_RADIUS,
+                x + NodeItem.SELECT_RADIUS, y + NodeItem.SELECT_RADIUS
+            )
+            self.canvas.itemconfigure(self.highlight_item, state=NORMAL)
+
+    def on_motion(self, evt):
+        self.set_hovered(self.node_at(evt.x, evt.y))
+
+    def on_mouse1(self, evt):
+        node = self.node_at(evt.x, evt.y)
+        if node is not None:
+            self.rotate_pivot(node)
+            return
+        node = self.subtree_at(evt.x, evt.y)
+        if node is not None:
+            self.show_subtree(node)
+
+    def on_mouse2(self, evt):
+        node = self.node_at(evt.x, evt.y)
+        if node is not None:
+            self.delete_node(node)
+
+    def build_view_coords(self):
+        # Lays out the part of the tree that's in view (see layout.view_layout). Returns three dicts : BTNode ->
+        # coords, for the nodes to draw, the lines up to their parents, and the subtrees to draw as SubtreeItems.
+        width, height = self.canvas_size()
+        margin = BTreeCanvas.HORIZ_SPACING
+        # where rank 0 goes, given that the root's rank is the size of its left subtree
+        root_rank = 0 if self.root is None else _size(self.root.left)
+        base = width // 2 - (root_rank * BTreeCanvas.HORIZ_SPACING + self.view_x) * self.zoom
+        return view_layout(
+            self.root,
+            base, BTreeCanvas.HORIZ_SPACING * self.zoom,
+            BTreeCanvas.TOP_PADDING + BTreeCanvas.VERT_SPACING - self.view_y, BTreeCanvas.VERT_SPACING,
+            (-margin, -margin, width + margin, height + margin),
+            BTreeCanvas.COLLAPSE_WIDTH if self.zoom < BTreeCanvas.DETAIL_ZOOM else None
+        )
 
     def build_node_item(self, node, coords):
         node_item = NodeItem(self.canvas, coords, text=str(node.val))
-        
-        def mouse1_callback(evt):
-            self.rotate_pivot(node)
-        node_item.bind_mouse1(mouse1_callback)
+        node_item.node = node
+        return node_item
 
-        def mouse2_callback(evt):
-            self.delete_node(node)
-        node_item.bind_mouse2(mouse2_callback)
+    def _place_node_item(self, node_item, node, coords):
+        node_item.node = node
+        node_item.set_text(str(node.val))
+        node_item.move_to(coords)
+
+    def build_connection_item(self, node, coords):
+        return ConnectionItem(self.canvas, coords)
+
+    def _place_connection_item(self, connection_item, node, coords):
+        connection_item.move_to(coords)
+
+    def build_subtree_item(self, node, coords):
+        subtree_item = SubtreeItem(self.canvas, coords, text=str(node.size))
+        subtree_item.node = node
+        return subtree_item
 
-        return node_item
\ No newline at end of file
+    def _place_subtree_item(self, subtree_item, node, coords):
+        subtree_item.node = node
+        subtree_item.set_text(str(node.size))
+        subtree_item.move_to(coords)
@@ -0,0 +1,162 @@
+from math import hypot
+from xml.sax.saxutils import escape
+
+try:
+    from PIL import Image, ImageDraw
+except ImportError:
+    Image = ImageDraw = None
+
+
+# Works out where to draw the nodes of a binary search tree: a node's x position comes from its rank (its index
+# in sorted order) and its y position from its depth. Only the nodes' left, right and size attributes are used,
+# so this works for BTree and PersistentBTree nodes alike, and there's no Tk in here, so trees can be drawn (or
+# exported with write_svg/write_png) on machines without a display.
+
+def _size(node):
+    return 0 if node is None else node.size
+
+
+def iter_layout(root):
+    # Yields (node, rank, depth, parent's rank) for every node in one top-down pass, parents before their
+    # children. The root has depth 0 and no parent (None). The ranks come from the subtree sizes on the way
+    # down, so each node's position is known as soon as we get to it, without walking the tree in order first.
+    if root is None:
+        return
+    stack = [(root, 0, 0, None)] # node, rank of the first node in its subtree, depth, parent's rank
+    while stack:
+        node, first, depth, parent_rank = stack.pop()
+        rank = first + _size(node.left)
+        yield node, rank, depth, parent_rank
+        if node.right is not None:
+            stack.append((node.right, rank + 1, depth + 1, rank))
+        if node.left is not None:
+            stack.append((node.left, first, depth + 1, rank))
+
+
+def tree_depth(root):
+    # the number of levels in the tree
+    depth = 0
+    stack = [] if root is None else [(root, 1)]
+    while stack:
+        node, node_depth = stack.pop()
+        depth = max(depth, node_depth)
+        if node.left is not None:
+            stack.append((node.left, node_depth + 1))
+        if node.right is not None:
+            stack.append((node.right, node_depth + 1))
+    return depth
+
+
+def view_layout(root, base, step, y0, row_height, box, collapse_width=None):
+    # Lays out just the part of the tree inside box = (left, top, right, bottom), for drawing it zoomed and
+    # scrolled: the node with rank r at depth d goes at (base + r * step, y0 + d * row_height), with x rounded to
+    # a whole pixel. Subtrees that are out of the box get skipped without looking inside them, so this costs
+    # about the same for a million nodes as for a hundred. With collapse_width, subtrees (of more than one node)
+    # narrower than that are left out too, to be drawn as a single shape.
+    #
+    # Returns three dicts : node -> coords, for the nodes in the box, for the lines up to their parents that
+    # cross the box (x1, y1, x2, y2, parent first), and for the collapsed subtrees (x, y of the subtree's root,
+    # then the x of its leftmost and rightmost nodes).
+    nodes, connections, subtrees = {}, {}, {}
+    if root is None:
+        return nodes, connections, subtrees
+    left, top, right, bottom = box
+
+    stack = [(root, 0, 0, None)] # node, rank of the first node in its subtree, depth, parent's coords
+    while stack:
+        node, first, depth, parent_coords = stack.pop()
+        rank = first + _size(node.left)
+        x = round(base + rank * step) # whole pixels, so that scrolling by whole pixels moves nothing else
+        y = y0 + depth * row_height
+
+        # a line can cross the box with both of its ends outside it
+        if parent_coords is not None:
+            px, py = parent_coords
+            if min(px, x) <= right and max(px, x) >= left and py <= bottom and y >= top:
+                connections[node] = (px, py, x, y)
+
+        left_x, right_x = round(base + first * step), round(base + (first + node.size - 1) * step)
+        if right_x < left or left_x > right or y > bottom:
+            continue # nothing under here is in the box
+        if collapse_width is not None and node.size > 1 and node.size * step < collapse_width:
+            subtrees[node] = (x, y, left_x, right_x)
+            continue
+
+        if left <= x <= right and y >= top:
+            nodes[node] = (x, y)
+        if node.right is not None:
+            stack.append((node.right, rank + 1, depth + 1, (x, y)))
+        if node.left is not None:
+            stack.append((node.left, first, depth + 1, (x, y)))
+
+    return nodes, connections, subtrees
+
+
+def _edge(parent_coords, coords, radius):
+    # the line between two nodes, minus the parts inside their circles, or None if they overlap. Drawing lines
+    # like this means they never cover a node, so each node can be drawn as soon as we get to it.
+    (px, py), (x, y) = parent_coords, coords
+    length = hypot(x - px, y - py)
+    if length <= 2 * radius:
+        return None
+    dx, dy = (x - px) * radius / length, (y - py) * radius / length
+    return px + dx, py + dy, x - dx, y - dy
+
+
+def write_svg(root, fileobj, h_spacing=40, v_spacing=40, radius=10, margin=20, label=str):
+    # Writes the tree under root to the text file fileobj as an SVG image, a chunk at a time, so memory use only
+    # depends on the tree's depth and even million-node trees can be exported. label turns a node's value into
+    # its label; pass label=None to leave the labels out.
+    count, depth = _size(root), tree_depth(root)
+    width = 2 * margin + max(count - 1, 0) * h_spacing
+    height = 2 * margin + max(depth - 1, 0) * v_spacing
+    fileobj.write(
+        f'<svg xmlns="http://www.w3.org/2000/svg" width="{width}" height="{height}" viewBox="0 0 {width} {height}">\n'
+        '<style>line{stroke:black}circle{fill:white;stroke:black;stroke-width:2}'
+        'text{font:12px sans-serif;text-anchor:middle;dominant-baseline:central}</style>\n'
+    )
+
+    chunk = []
+    for node, rank, depth, parent_rank in iter_layout(root):
+        x, y = margin + rank * h_spacing, margin + depth * v_spacing
+        if parent_rank is not None:
+            edge = _edge((margin + parent_rank * h_spacing, y - v_spacing), (x, y), radius)
+            if edge is not None:
+                chunk.append('<line x1="%g" y1="%g" x2="%g" y2="%g"/>\n' % edge)
+        chunk.append(f'<circle cx="{x}" cy="{y}" r="{radius}"/>\n')
+        if label is not None:
+            chunk.append(f'<text x="{x}" y="{y}">{escape(label(node.val))}</text>\n')
+        if len(chunk) >= 4096:
+            fileobj.write("".join(chunk))
+            chunk.clear()
+    chunk.append("</svg>\n")
+    fileobj.write("".join(chunk))
+
+
+def write_png(root, fileobj, h_spacing=40, v_spacing=40, radius=10, margin=20, label=str, max_width=16384):
+    # Draws the tree under root as a PNG, written to fileobj (a binary file or a path). Needs Pillow. Unlike an
+    # SVG the whole image has to be in memory, so wide trees get squeezed into max_width pixels, with smaller
+    # circles and no labels once they stop fitting.
+    if Image is None:
+        raise ImportError("write_png() needs Pillow")
+    count, depth = _size(root), tree_depth(root)
+    if count > 1:
+        h_spacing = min(h_spacing, (max_width - 2 * margin) / (count - 1))
+    if h_spacing < 2 * radius:
+        radius = max(h_spacing / 2, 1)
+        label = None
+    width = max(round(2 * margin + max(count - 1, 0) * h_spacing), 1)
+    height = 2 * margin + max(depth - 1, 0) * v_spacing
+
+    image = Image.new("RGB", (width, height), "white")
+    draw = ImageDraw.Draw(image)
+    for node, rank, depth, parent_rank in iter_layout(root):
+        x, y = margin + rank * h_spacing, margin + depth * v_spacing
+        if parent_rank is not None:
+            edge = _edge((margin + parent_rank * h_spacing, y - v_spacing), (x, y), radius)
+            if edge is not None:
+                draw.line(edge, fill="black")
+        draw.ellipse((x - radius, y - radius, x + radius, y + radius), fill="white", outline="black", width=2)
+        if label is not None:
+            draw.text((x, y), label(node.val), fill="black", anchor="mm")
+    image.save(fileobj, "PNG")
@@ -20,7 +20,38 @@ btree_canvas = BTreeCanvas(canvas)
 vals = list(range(10))
 random.shuffle(vals)
 
-for v in vals:
-    btree_canvas.insert(v)
+with btree_canvas.batch():
+    for v in vals:
+        btree_canvas.insert(v)
+
+root.bind("<Control-z>", lambda evt: btree_canvas.undo())
+root.bind("<Control-y>", lambda evt: btree_canvas.redo())
+root.bind("<Control-Z>", lambda evt: btree_canvas.redo())
+
+# moving around: arrow keys or dragging with the middle mouse button to scroll, the mouse wheel or +/- to zoom,
+# f to fit the whole tree in, Home to go back to the start
+root.bind("<Left>", lambda evt: btree_canvas.scroll(-100, 0))
+root.bind("<Right>", lambda evt: btree_canvas.scroll(100, 0))
+root.bind("<Up>", lambda evt: btree_canvas.scroll(0, -100))
+root.bind("<Down>", lambda evt: btree_canvas.scroll(0, 100))
+root.bind("<plus>", lambda evt: btree_canvas.zoom_by(1.25))
+root.bind("<equal>", lambda evt: btree_canvas.zoom_by(1.25))
+root.bind("<minus>", lambda evt: btree_canvas.zoom_by(0.8))
+root.bind("f", lambda evt: btree_canvas.fit_view())
+root.bind("<Home>", lambda evt: btree_canvas.reset_view())
+canvas.bind("<MouseWheel>", lambda evt: btree_canvas.zoom_by(1.25 if evt.delta > 0 else 0.8, evt.x))
+canvas.bind("<Button-4>", lambda evt: btree_canvas.zoom_by(1.25, evt.x)) # X11 sends the wheel as buttons 4 and 5
+canvas.bind("<Button-5>", lambda evt: btree_canvas.zoom_by(0.8, evt.x))
+
+drag_from = None
+def drag_start(evt):
+    global drag_from
+    drag_from = (evt.x, evt.y)
+def drag(evt):
+    global drag_from
+    btree_canvas.scroll(drag_from[0] - evt.x, drag_from[1] - evt.y)
+    drag_from = (evt.x, evt.y)
+canvas.bind("<ButtonPress-2>", drag_start)
+canvas.bind("<B2-Motion>", drag)
 
 root.mainloop()
\ No newline at end of file
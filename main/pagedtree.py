@@ -0,0 +1,343 @@
+import mmap
+import os
+import struct
+from bisect import bisect_left, bisect_right
+from collections import OrderedDict
+
+
+# A B+ tree that lives in a file of fixed-size pages, read and written through mmap, for indexes that don't fit
+# in memory as Python objects. Keys are fixed-size values packed with a struct format (64-bit ints by default).
+#
+# Pages are decoded into _Page objects on first use and kept in an LRU cache of cache_pages pages. Changed pages
+# are only written back into the mapping when they're evicted, or on flush()/close(). Reopening an existing file
+# only reads its header, so it's instant no matter how many keys are in it.
+#
+# Deletes just remove the key from its leaf without merging underfull pages (like many on-disk B-trees),
+# so the file never shrinks.
+class PagedBTree:
+    MAGIC = b"BTPG"
+    VERSION = 1
+    # magic, version, page size, root page, page count, number of keys, key format
+    FILE_HEADER = struct.Struct("<4sHIQQQ16s")
+    # leaf flag, key count, next leaf, previous leaf
+    PAGE_HEADER = struct.Struct("<BIQQ")
+    CHILD = struct.Struct("<Q")
+    GROW_PAGES = 64 # how many pages to add to the file at a time
+
+    def __init__(self, path, key_format=None, page_size=None, cache_pages=1024):
+        # key_format and page_size default to "q" and 4096 for a new file; an existing file brings its own,
+        # and giving different ones for it is an error rather than something we'd silently ignore
+        self.path = path
+        self.cache_pages = cache_pages
+        self._cache = OrderedDict() # page number -> _Page, least recently used first
+        self._header_dirty = False
+
+        exists = os.path.exists(path) and os.path.getsize(path) > 0
+        if exists:
+            self._file = open(path, "r+b")
+            try:
+                self._map = mmap.mmap(self._file.fileno(), 0)
+                try:
+                    self._read_header()
+                    if key_format is not None and key_format != self.key_format:
+                        raise ValueError(f"{path} has key format {self.key_format!r}, not {key_format!r}")
+                    if page_size is not None and page_size != self.page_size:
+                        raise ValueError(f"{path} has {self.page_size} byte pages, not {page_size}")
+                except Exception:
+                    self._map.close()
+                    raise
+            except Exception:
+                self._file.close()
+                raise
+        else:
+            # check the layout before creating the file, so that bad arguments don't leave an empty one behind
+            self.page_size = 4096 if page_size is None else page_size
+            self.key_format = "q" if key_format is None else key_format
+            self._init_layout()
+            self._file = open(path, "w+b")
+            try:
+                self._file.truncate(PagedBTree.GROW_PAGES * self.page_size)
+                self._map = mmap.mmap(self._file.fileno(), 0)
+            except Exception:
+                self._file.close()
+                os.remove(path)
+                raise
+            self.page_count = 1 # the header page
+            self._len = 0
+            self.root = self._new_page(leaf=True).number
+            self._header_dirty = True
+            self.flush()
+
+    def _init_layout(self):
+        if self.page_size > 1 << 20 or self.page_size < 128:
+            raise ValueError("page_size has to be between 128 bytes and 1MB")
+        self.key = struct.Struct("<" + self.key_format)
+        space = self.page_size - PagedBTree.PAGE_HEADER.size
+        self.leaf_capacity = space // self.key.size
+        # internal pages hold n keys and n + 1 children
+        self.internal_capacity = (space - PagedBTree.CHILD.size) // (self.key.size + PagedBTree.CHILD.size)
+        if min(self.leaf_capacity, self.internal_capacity) < 3:
+            raise ValueError("page_size is too small for this key format")
+
+    def _read_header(self):
+        if len(self._map) < PagedBTree.FILE_HEADER.size:
+            raise ValueError(f"{self.path} is not a PagedBTree file")
+        magic, version, page_size, root, page_count, length, key_format = PagedBTree.FILE_HEADER.unpack_from(self._map, 0)
+        if magic != PagedBTree.MAGIC:
+            raise ValueError(f"{self.path} is not a PagedBTree file")
+        if version != PagedBTree.VERSION:
+            raise ValueError(f"unsupported PagedBTree file version {version}")
+        self.page_size = page_size
+        self.key_format = key_format.rstrip(b"\0").decode("ascii")
+        self._init_layout()
+        self.root = root
+        self.page_count = page_count
+        self._len = length
+
+    def _write_header(self):
+        PagedBTree.FILE_HEADER.pack_into(
+            self._map, 0, PagedBTree.MAGIC, PagedBTree.VERSION, self.page_size,
+            self.root, self.page_count, self._len, self.key_format.encode("ascii")
+        )
+        self._header_dirty = False
+
+    # --- Page cache
+
+    def _page(self, number):
+        page = self._cache.get(number)
+        if page is None:
+            page = self._decode(number)
+            self._cache[number] = page
+        else:
+            self._cache.move_to_end(number)
+        return page
+
+    def _new_page(self, leaf, keys=None, children=None):
+        if self.page_count * self.page_size >= len(self._map):
+            self._grow()
+        page = _Page(self.page_count, leaf, [] if keys is None else keys, [] if children is None else children)
+        page.dirty = True
+        self.page_count += 1
+        self._header_dirty = True
+        self._cache[page.number] = page
+        return page
+
+    def _grow(self):
+        # mmap can't always be resized in place, so write everything back and map the bigger file again
+        self.flush()
+        self._map.close()
+        self._file.truncate((self.page_count + PagedBTree.GROW_PAGES) * self.page_size)
+        self._map = mmap.mmap(self._file.fileno(), 0)
+
+    def _trim_cache(self):
+        # Only called between operations: an operation may hold on to any page it has looked at, so evicting
+        # (and later re-reading) one of them in the middle could lose changes.
+        while len(self._cache) > self.cache_pages:
+            _, page = self._cache.popitem(last=False)
+            if page.dirty:
+                self._encode(page)
+
+    def flush(self):
+        for page in self._cache.values():
+            if page.dirty:
+                self._encode(page)
+        if self._header_dirty:
+            self._write_header()
+        self._map.flush()
+
+    def close(self):
+        if self._map is None:
+            return
+        self.flush()
+        self._map.close()
+        self._file.close()
+        self._map = None
+        self._cache.clear()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc_info):
+        self.close()
+
+    def _decode(self, number):
+        offset = number * self.page_size
+        leaf, count, next_page, prev_page = PagedBTree.PAGE_HEADER.unpack_from(self._map, offset)
+        offset += PagedBTree.PAGE_HEADER.size
+        key_bytes = count * self.key.size
+        keys = [k[0] for k in self.key.iter_unpack(self._map[offset:offset + key_bytes])]
+        children = []
+        if not leaf:
+            offset += key_bytes
+            child_bytes = (count + 1) * PagedBTree.CHILD.size
+            children = [c[0] for c in PagedBTree.CHILD.iter_unpack(self._map[offset:offset + child_bytes])]
+        page = _Page(number, bool(leaf), keys, children)
+        page.next, page.prev = next_page, prev_page
+        return page
+
+    def _encode(self, page):
+        offset = page.number * self.page_size
+        PagedBTree.PAGE_HEADER.pack_into(self._map, offset, page.leaf, len(page.keys), page.next, page.prev)
+        offset += PagedBTree.PAGE_HEADER.size
+        for k in page.keys:
+            self.key.pack_into(self._map, offset, k)
+            offset += self.key.size
+        for c in page.children:
+            PagedBTree.CHILD.pack_into(self._map, offset, c)
+            offset += PagedBTree.CHILD.size
+        page.dirty = False
+
+    # --- Tree operations
+
+    def __len__(self):
+        return self._len
+
+    def depth(self):
+        depth = 1
+        page = self._page(self.root)
+        while not page.leaf:
+            page = self._page(page.children[0])
+            depth += 1
+        self._trim_cache()
+        return depth
+
+    def _find_path(self, val):
+        path = []
+        page = self._page(self.root)
+        while not page.leaf:
+            i = bisect_right(page.keys, val)
+            path.append((page, i))
+            page = self._page(page.children[i])
+        return page, path
+
+    def find(self, val):
+        # unlike BTree there are no node objects to hand out, so this just says whether val is stored
+        leaf, _ = self._find_path(val)
+        i = bisect_left(leaf.keys, val)
+        self._trim_cache()
+        return i < len(leaf.keys) and leaf.keys[i] == val
+
+    def __contains__(self, val):
+        return self.find(val)
+
+    def insert(self, val):
+        # returns whether val was added
+        try:
+            return self._insert(val)
+        finally:
+            self._trim_cache()
+
+    def _insert(self, val):
+        self.key.pack(val) # fail before changing anything if val doesn't fit the key format
+        leaf, path = self._find_path(val)
+        i = bisect_left(leaf.keys, val)
+        if i < len(leaf.keys) and leaf.keys[i] == val:
+            return False
+        leaf.keys.insert(i, val)
+        leaf.dirty = True
+        self._len += 1
+        self._header_dirty = True
+        if len(leaf.keys) <= self.leaf_capacity:
+            return True
+
+        # Split off the right half before allocating its page: allocating can grow the file, which writes back
+        # every dirty page, and an overfull page would spill into the next one.
+        mid = len(leaf.keys) // 2
+        right_keys = leaf.keys[mid:]
+        del leaf.keys[mid:]
+        new_page = self._new_page(True, right_keys)
+        new_page.prev, new_page.next = leaf.number, leaf.next
+        if leaf.next:
+            next_page = self._page(leaf.next)
+            next_page.prev = new_page.number
+            next_page.dirty = True
+        leaf.next = new_page.number
+        leaf.dirty = True
+        separator = new_page.keys[0]
+
+        while path:
+            parent, i = path.pop()
+            parent.keys.insert(i, separator)
+            parent.children.insert(i + 1, new_page.number)
+            parent.dirty = True
+            if len(parent.keys) <= self.internal_capacity:
+                return True
+
+            mid = len(parent.keys) // 2
+            separator = parent.keys[mid]
+            right_keys, right_children = parent.keys[mid + 1:], parent.children[mid + 1:]
+            del parent.keys[mid:]
+            del parent.children[mid + 1:]
+            new_page = self._new_page(False, right_keys, right_children)
+            parent.dirty = True
+
+        self.root = self._new_page(False, [separator], [self.root, new_page.number]).number
+        return True
+
+    def delete(self, val):
+        leaf, _ = self._find_path(val)
+        i = bisect_left(leaf.keys, val)
+        if i < len(leaf.keys) and leaf.keys[i] == val:
+            del leaf.keys[i]
+            leaf.dirty = True
+            self._len -= 1
+            self._header_dirty = True
+        self._trim_cache()
+
+    def _leaves(self, start, reverse=False):
+        number = start
+        while number:
+            leaf = self._page(number)
+            number = leaf.prev if reverse else leaf.next
+            keys = list(leaf.keys) # so that the page can be evicted while the caller holds on to these
+            self._trim_cache()
+            yield keys
+
+    def _edge_leaf(self, last=False):
+        page = self._page(self.root)
+        while not page.leaf:
+            page = self._page(page.children[-1 if last else 0])
+        return page.number
+
+    def __iter__(self):
+        for keys in self._leaves(self._edge_leaf()):
+            yield from keys
+
+    def __reversed__(self):
+        for keys in self._leaves(self._edge_leaf(last=True), reverse=True):
+            yield from reversed(keys)
+
+    def sorted_list(self):
+        return iter(self)
+
+    def range(self, lo=None, hi=None, reverse=False):
+        # lazily yields the values v with lo <= v < hi, in order or in reverse
+        if reverse:
+            start = self._edge_leaf(last=True) if hi is None else self._find_path(hi)[0].number
+            for keys in self._leaves(start, reverse=True):
+                for v in reversed(keys):
+                    if hi is not None and not v < hi:
+                        continue
+                    if lo is not None and v < lo:
+                        return
+                    yield v
+        else:
+            start = self._edge_leaf() if lo is None else self._find_path(lo)[0].number
+            for keys in self._leaves(start):
+                for v in keys[bisect_left(keys, lo) if lo is not None else 0:]:
+                    if hi is not None and not v < hi:
+                        return
+                    yield v
+
+
+class _Page:
+    __slots__ = ("number", "leaf", "keys", "children", "next", "prev", "dirty")
+
+    def __init__(self, number, leaf, keys, children):
+        self.number = number
+        self.leaf = leaf
+        self.keys = keys
+        self.children = children # page numbers, for internal pages
+        self.next = 0 # neighbouring leaves' page numbers; page 0 is the file header, so it doubles as "none"
+        self.prev = 0
+        self.dirty = False
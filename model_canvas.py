@@ -0,0 +1,74 @@
+import itertools
+
+
+# Shared by the tests and by bench_btree.py's canvas benchmark when Tk can't start.
+class ModelCanvas:
+    # Enough of a Tk canvas to run the explorer without a display: it keeps track of each item's coordinates,
+    # tags and state, but doesn't draw anything.
+    def __init__(self, width=1024, height=768):
+        self.width = width
+        self.height = height
+        self.items = {} # id -> [coords, tags, state, text, bounding box]
+        self._ids = itertools.count(1)
+
+    def config(self):
+        return {"width": ("width", str(self.width)), "height": ("height", str(self.height))}
+
+    def _create(self, *coords, tags=(), state="normal", text="", **options):
+        # Tk takes the coordinates flat or as pairs
+        while any(isinstance(c, (tuple, list)) for c in coords):
+            coords = [v for c in coords for v in (c if isinstance(c, (tuple, list)) else [c])]
+        item = next(self._ids)
+        self.items[item] = [list(coords), set(tags), state, text, None]
+        self._set_bbox(item)
+        return item
+
+    create_oval = create_line = create_polygon = create_text = _create
+
+    def _set_bbox(self, item):
+        entry = self.items[item]
+        coords, text = entry[0], entry[3]
+        xs, ys = coords[0::2], coords[1::2]
+        w, h = (len(text) * 7 + 2, 16) if len(coords) == 2 else (2, 2) # text is about 7 pixels a character
+        entry[4] = (min(xs) - w / 2, min(ys) - h / 2, max(xs) + w / 2, max(ys) + h / 2)
+
+    def _find(self, tag_or_id):
+        if isinstance(tag_or_id, int):
+            return [tag_or_id] if tag_or_id in self.items else []
+        if tag_or_id == "all":
+            return list(self.items)
+        return [i for i, entry in self.items.items() if tag_or_id in entry[1]]
+
+    def coords(self, item, *coords):
+        self.items[item][0] = list(coords)
+        self._set_bbox(item)
+
+    def move(self, tag_or_id, dx, dy):
+        for i in self._find(tag_or_id):
+            entry = self.items[i]
+            entry[0] = [v + (dy if j % 2 else dx) for j, v in enumerate(entry[0])]
+            x1, y1, x2, y2 = entry[4]
+            entry[4] = (x1 + dx, y1 + dy, x2 + dx, y2 + dy)
+
+    def itemconfigure(self, tag_or_id, state=None, text=None, **options):
+        for i in self._find(tag_or_id):
+            if state is not None:
+                self.items[i][2] = state
+            if text is not None:
+                self.items[i][3] = text
+                self._set_bbox(i)
+
+    itemconfig = itemconfigure
+
+    def delete(self, tag_or_id):
+        for i in self._find(tag_or_id):
+            del self.items[i]
+
+    def bind(self, *args):
+        pass
+
+    def tag_raise(self, *args):
+        pass
+
+    def update(self):
+        pass
@@ -1,6 +1,26 @@
+import concurrent.futures
+import io
+import os
+import random
+import struct
+import sys
+import tempfile
+import threading
 import unittest
+from array import array
 
 from main.btree import *
+from main.bplustree import *
+from main.pagedtree import *
+from main.layout import *
+from model_canvas import ModelCanvas
+
+# the explorer imports its modules without the package, like main.py does
+sys.path.append(os.path.join(os.path.dirname(os.path.abspath(__file__)), "main"))
+try:
+    from btreecanvas import BTreeCanvas, NodeItem, SubtreeItem
+except ImportError: # no tkinter
+    BTreeCanvas = None
 
 class TestBTree(unittest.TestCase):
     def test_insert(self):
@@ -185,6 +205,424 @@ class TestBTree(unittest.TestCase):
         self.assertEqual(node11.right, node5)
         self.assertEqual(node5.left, node9) # because we swapped earlier
     
+    def test_iteration(self):
+        tree = BTree([5, 11, 7, 4, 6, 9, 2, 3, 10])
+        self.assertEqual(list(tree), [2, 3, 4, 5, 6, 7, 9, 10, 11])
+        self.assertEqual(list(reversed(tree)), [11, 10, 9, 7, 6, 5, 4, 3, 2])
+        self.assertEqual(tree.sorted_nodes(), list(tree.iter_nodes()))
+        self.assertEqual(
+            [depth for _, depth in tree._iter_depths()],
+            [tree.depth_of_node(node) for node in tree.iter_nodes()]
+        )
+
+        # iteration is lazy, so stopping early doesn't visit the rest of the tree
+        it = iter(tree)
+        self.assertEqual([next(it), next(it)], [2, 3])
+
+        self.assertEqual(list(BTree()), [])
+        self.assertEqual(list(reversed(BTree())), [])
+    
+    def test_order_statistics(self):
+        tree = BTree([5, 11, 7, 4, 6, 9, 2, 3, 10])
+        vals = [2, 3, 4, 5, 6, 7, 9, 10, 11]
+        self.assertEqual(len(tree), 9)
+        self.assertEqual(tree.root.size, 9)
+        self.assertEqual(tree.find(7).size, 4)
+
+        for i, v in enumerate(vals):
+            self.assertEqual(tree.rank(v), i)
+            self.assertEqual(tree.select(i).val, v)
+        self.assertEqual(tree.rank(8), 6)
+        self.assertEqual(tree.rank(0), 0)
+        self.assertEqual(tree.rank(100), 9)
+        self.assertEqual(tree.select(-1).val, 11)
+        self.assertRaises(IndexError, tree.select, 9)
+        self.assertEqual(tree.count_range(3, 10), 6)
+        self.assertEqual(tree.count_range(10, 3), 0)
+
+        tree.insert(8)
+        tree.insert(8) # duplicates don't change any sizes
+        tree.delete(5)
+        tree.rotate_pivot(tree.find(11))
+        self.assertEqual(len(tree), 9)
+        self.assertEqual(tree.rank(8), 5)
+        self.assertEqual(len(BTree()), 0)
+
+    def test_sizes(self):
+        # sizes should survive inserts, deletes (including swaps) and rotations in every kind of tree
+        def check(node):
+            if node is None:
+                return 0
+            size = 1 + check(node.left) + check(node.right)
+            self.assertEqual(node.size, size)
+            return size
+
+        rng = random.Random(5)
+        for tree_class in (BTree, RBTree, AVLTree, SplayTree):
+            tree = tree_class()
+            for _ in range(1000):
+                v = rng.randrange(100)
+                if rng.random() < 0.6:
+                    tree.insert(v)
+                else:
+                    tree.delete(v)
+            check(tree.root)
+            self.assertEqual(len(tree), len(list(tree)))
+
+            for node in tree.sorted_nodes():
+                tree.rotate_pivot(node)
+            check(tree.root)
+    
+    def test_mapping(self):
+        tree = AVLTree()
+        for v in [5, 2, 8, 1]:
+            tree[v] = str(v)
+        tree[2] = "two"
+        self.assertEqual(list(tree.items()), [(1, "1"), (2, "two"), (5, "5"), (8, "8")])
+        self.assertEqual(list(tree.values()), ["1", "two", "5", "8"])
+        self.assertEqual(tree[8], "8")
+        self.assertRaises(KeyError, tree.__getitem__, 3)
+        self.assertEqual(tree.get(3, "none"), "none")
+        self.assertEqual(tree.pop(5), "5")
+        self.assertEqual(tree.pop(5, None), None)
+        self.assertRaises(KeyError, tree.pop, 5)
+        del tree[1]
+        self.assertRaises(KeyError, tree.__delitem__, 1)
+        self.assertEqual(list(tree.keys()), [2, 8])
+        f = io.BytesIO()
+        self.assertRaises(ValueError, tree.dump, f)
+        self.assertEqual(f.getvalue(), b"") # nothing half-written
+
+        # unions take the other tree's values, like dict's |
+        a, b = BTree(), BTree()
+        for v in range(0, 100, 2):
+            a[v] = "a"
+        for v in range(0, 100, 3):
+            b[v] = "b"
+        merged = dict(a.union(b).items())
+        self.assertEqual(merged[6], "b")
+        self.assertEqual(merged[4], "a")
+        self.assertEqual(merged[9], "b")
+
+        # values can come from a tree that has none yet
+        a = BTree(range(10))
+        b = BTree()
+        b[20] = "b"
+        merged = a.union(b)
+        self.assertEqual(merged.get(20), "b")
+        self.assertEqual(merged.get(5, "none"), None)
+        self.assertEqual(len(merged), 11)
+
+    def test_node_slots(self):
+        # only trees with a key function or mapping values pay for the extra slots
+        plain = RBTree(range(100))
+        self.assertEqual(sys.getsizeof(BTree([1]).root), sys.getsizeof(BTNode.__new__(BTNode)))
+        self.assertLess(sys.getsizeof(plain.root), sys.getsizeof(RBTree([1], key=abs).root))
+        self.assertEqual(plain.root.val, plain.root.key)
+        self.assertIsNone(plain.root.value)
+        self.assertRaises(AttributeError, setattr, plain.root, "value", 1)
+
+        # setting a value switches the tree to the bigger nodes, keeping its shape and colours
+        def shape(node):
+            return None if node is None else (node.val, node.red, node.size, shape(node.left), shape(node.right))
+
+        before = shape(plain.root)
+        plain[50] = "fifty"
+        self.assertEqual(shape(plain.root), before)
+        self.assertEqual(plain[50], "fifty")
+        self.assertIsNone(plain[49])
+        for node in plain.iter_nodes():
+            for child in (node.left, node.right):
+                if child is not None:
+                    self.assertIs(child.parent, node)
+
+    def test_key_function(self):
+        class Record:
+            comparisons = 0
+
+            def __init__(self, name):
+                self.name = name
+
+            def __lt__(self, other):
+                Record.comparisons += 1
+                return self.name < other.name
+
+        records = [Record(name) for name in ["pear", "apple", "fig", "kiwi", "date"]]
+        calls = []
+
+        def name_of(record):
+            calls.append(record)
+            return record.name
+
+        for tree_class in (BTree, RBTree, AVLTree, SplayTree):
+            calls.clear()
+            tree = tree_class(records, key=name_of)
+            self.assertEqual([r.name for r in tree], ["apple", "date", "fig", "kiwi", "pear"])
+            self.assertEqual(len(calls), len(records)) # once per value
+            self.assertEqual(Record.comparisons, 0)
+
+            tree[Record("fig")] = 3 # a different object with the same key
+            self.assertEqual(len(tree), 5)
+            self.assertEqual(tree.get(Record("fig")), 3)
+            self.assertIs(tree.find(Record("kiwi")).val, records[3])
+            self.assertEqual(tree.rank(Record("g")), 3)
+            self.assertEqual([r.name for r in tree.range(Record("b"), Record("g"))], ["date", "fig"])
+            tree.delete(Record("apple"))
+            self.assertEqual(tree.select(0).val.name, "date")
+            self.assertEqual(tree.floor(Record("g")).val.name, "fig")
+
+        tree = BTree.bulk_load(records, key=name_of)
+        self.assertEqual([r.name for r in tree], ["apple", "date", "fig", "kiwi", "pear"])
+        left, right = tree.split(Record("e"))
+        self.assertEqual([r.name for r in left], ["apple", "date"])
+        self.assertEqual(right.key, name_of)
+        self.assertRaises(TypeError, right.freeze)
+        self.assertRaises(ValueError, left.union, BTree())
+
+    def test_parallel_bulk_load(self):
+        rng = random.Random(19)
+        vals = [rng.randrange(3000) for _ in range(2000)]
+        with concurrent.futures.ProcessPoolExecutor(2) as pool:
+            for tree_class in (BTree, RBTree, AVLTree, SplayTree):
+                tree = tree_class.parallel_bulk_load(vals, pool, parts=4)
+                self.assertEqual(list(tree), sorted(set(vals)))
+                self.assertEqual(len(tree), len(set(vals)))
+                self.assertLessEqual(tree.depth(), 13)
+                for node in tree.iter_nodes():
+                    children = [child for child in (node.left, node.right) if child is not None]
+                    self.assertEqual(node.size, 1 + sum(child.size for child in children))
+                    for child in children:
+                        self.assertIs(child.parent, node)
+            self.assertEqual(list(BTree.parallel_bulk_load([3, 1, 2], pool)), [1, 2, 3])
+        with concurrent.futures.ThreadPoolExecutor(2) as pool:
+            tree = RBTree.parallel_bulk_load(vals, pool, parts=3)
+            TestRBTree().check_invariants(tree)
+            tree = AVLTree.parallel_bulk_load(vals, pool, parts=3)
+            TestAVLTree().check_invariants(tree)
+
+    def test_split_join(self):
+        for tree_class in (BTree, RBTree, AVLTree, SplayTree):
+            tree = tree_class([5, 11, 7, 4, 6, 9, 2, 3, 10])
+            left, right = tree.split(7)
+            self.assertIsNone(tree.root)
+            self.assertEqual(list(left), [2, 3, 4, 5, 6])
+            self.assertEqual(list(right), [7, 9, 10, 11])
+            self.assertEqual((len(left), len(right)), (5, 4))
+
+            right.delete(7)
+            joined = tree_class.join(left, 7, right)
+            self.assertEqual(list(joined), [2, 3, 4, 5, 6, 7, 9, 10, 11])
+            self.assertEqual(joined.rank(9), 6)
+            self.assertIsNone(left.root)
+
+            left, right = joined.split(1)
+            self.assertIsNone(left.root)
+            self.assertEqual(len(right), 9)
+            self.assertRaises(ValueError, tree_class.join, right, 5, tree_class())
+            self.assertRaises(TypeError, tree_class.join, right, 100, PersistentBTree())
+
+    def test_set_operations(self):
+        rng = random.Random(18)
+        for tree_class in (BTree, RBTree, AVLTree, SplayTree):
+            for _ in range(20):
+                a = set(rng.sample(range(200), rng.randrange(100)))
+                b = set(rng.sample(range(200), rng.randrange(100)))
+                for operation, expected in (("union", a | b), ("intersection", a & b), ("difference", a - b)):
+                    tree_a = tree_class(rng.sample(sorted(a), len(a)))
+                    tree_b = tree_class(rng.sample(sorted(b), len(b)))
+                    result = getattr(tree_a, operation)(tree_b)
+                    self.assertEqual(list(result), sorted(expected))
+                    self.assertEqual(len(result), len(expected))
+                    self.assertIsNone(tree_a.root)
+                    self.assertIsNone(tree_b.root)
+        self.assertRaises(ValueError, tree_a.union, tree_a)
+
+    def test_parallel_set_operations(self):
+        a = range(0, 3000, 2)
+        b = range(0, 3000, 3)
+        with concurrent.futures.ThreadPoolExecutor(4) as pool:
+            self.assertEqual(list(AVLTree(a).union(AVLTree(b), executor=pool)), sorted(set(a) | set(b)))
+            self.assertEqual(list(BTree(b).difference(BTree(a), executor=pool, parts=7)), sorted(set(b) - set(a)))
+            # empty trees, and fewer values than parts
+            self.assertIsNone(BTree().union(BTree(), executor=pool, parts=4).root)
+            self.assertEqual(list(BTree([2]).union(BTree(), executor=pool, parts=4)), [2])
+            self.assertEqual(list(BTree().intersection(BTree([1, 2]), executor=pool, parts=4)), [])
+        with concurrent.futures.ProcessPoolExecutor(2) as pool:
+            tree = RBTree.from_sorted(a).intersection(RBTree.from_sorted(b), executor=pool)
+            self.assertEqual(list(tree), sorted(set(a) & set(b)))
+
+    def test_bounds(self):
+        tree = BTree([5, 11, 7, 4, 6, 9, 2, 3, 10])
+        self.assertEqual(tree.floor(8).val, 7)
+        self.assertEqual(tree.floor(7).val, 7)
+        self.assertIsNone(tree.floor(1))
+        self.assertEqual(tree.ceiling(8).val, 9)
+        self.assertEqual(tree.ceiling(9).val, 9)
+        self.assertIsNone(tree.ceiling(12))
+        self.assertEqual(tree.lower_bound(6).val, 6)
+        self.assertEqual(tree.upper_bound(6).val, 7)
+        self.assertEqual(tree.upper_bound(8).val, 9)
+        self.assertIsNone(tree.upper_bound(11))
+        self.assertIsNone(BTree().floor(1))
+
+    def test_range(self):
+        tree = BTree([5, 11, 7, 4, 6, 9, 2, 3, 10])
+        self.assertEqual(list(tree.range(4, 10)), [4, 5, 6, 7, 9])
+        self.assertEqual(list(tree.range(4, 10, reverse=True)), [9, 7, 6, 5, 4])
+        self.assertEqual(list(tree.range(8, 8)), [])
+        self.assertEqual(list(tree.range(lo=9)), [9, 10, 11])
+        self.assertEqual(list(tree.range(hi=4)), [2, 3])
+        self.assertEqual(list(tree.range(hi=4, reverse=True)), [3, 2])
+        self.assertEqual(list(tree.range()), list(tree))
+        self.assertEqual(list(tree.range(12, 20)), [])
+        self.assertEqual(list(BTree().range(0, 10)), [])
+    
+    def test_from_sorted(self):
+        tree = BTree.from_sorted(range(1, 8))
+        self.assertEqual(tree.root.val, 4)
+        self.assertEqual(tree.root.left.val, 2)
+        self.assertEqual(tree.root.right.right.val, 7)
+        self.assertEqual(tree.root.right.right.parent, tree.root.right)
+        self.assertEqual(tree.depth(), 3)
+
+        tree = BTree.from_sorted([1, 2, 2, 3, 5, 5])
+        self.assertEqual(list(tree), [1, 2, 3, 5])
+        self.assertEqual(len(tree), 4)
+        self.assertRaises(ValueError, BTree.from_sorted, [1, 3, 2])
+
+        vals = list(range(1000))
+        random.Random(3).shuffle(vals)
+        tree = BTree.bulk_load(vals)
+        self.assertEqual(list(tree), list(range(1000)))
+        self.assertEqual(tree.depth(), 10)
+        for i in range(0, 1000, 7):
+            # select() relies on the sizes being right
+            self.assertEqual(tree.select(i).val, i)
+
+        self.assertIsNone(BTree.from_sorted([]).root)
+    
+    def test_batches(self):
+        tree = BTree([5, 11, 7, 4, 6, 9, 2, 3, 10])
+        nodes = tree.find_many([10, 1, 5, 8, 10, 3])
+        self.assertEqual(nodes, [tree.find(10), None, tree.find(5), None, tree.find(10), tree.find(3)])
+
+        tree.insert_many([8, 1, 12, 8, 5])
+        self.assertEqual(list(tree), [1, 2, 3, 4, 5, 6, 7, 8, 9, 10, 11, 12])
+        self.assertEqual(tree.find(8).parent, tree.find(9))
+
+        tree.delete_many([12, 5, 5, 100, 2])
+        self.assertEqual(list(tree), [1, 3, 4, 6, 7, 8, 9, 10, 11])
+        self.assertEqual(len(tree), 9)
+
+        # finger searches have to agree with plain ones in every kind of tree
+        rng = random.Random(11)
+        for tree_class in (BTree, RBTree, AVLTree, SplayTree):
+            tree = tree_class()
+            expected = set()
+            for _ in range(20):
+                batch = [rng.randrange(1000) for _ in range(rng.randrange(1, 100))]
+                if rng.random() < 0.6:
+                    tree.insert_many(batch)
+                    expected.update(batch)
+                else:
+                    tree.delete_many(batch)
+                    expected.difference_update(batch)
+                self.assertEqual(list(tree), sorted(expected))
+                self.assertEqual(len(tree), len(expected))
+
+            queries = [rng.randrange(1000) for _ in range(200)]
+            self.assertEqual(
+                [node is not None and node.val for node in tree.find_many(queries)],
+                [q in expected and q for q in queries]
+            )
+
+        # the plain tree doesn't rebalance, so a batch shouldn't go in as a chain
+        vals = list(range(20000))
+        rng.shuffle(vals)
+        tree = BTree()
+        tree.insert_many(vals + vals[:100])
+        self.assertEqual(list(tree), list(range(20000)))
+        self.assertEqual(tree.depth(), 15)
+        tree.insert_many([i + 0.5 for i in range(0, 20000, 2)])
+        self.assertLessEqual(tree.depth(), 15 + 14)
+        self.assertEqual(len(tree), 30000)
+
+        # with a key function the first of each group of equal keys is kept, as with insert()
+        tree = BTree(key=abs)
+        tree.insert_many([3, -1, 2, 1, -3])
+        self.assertEqual(list(tree), [-1, 2, 3])
+        tree.insert_many([-2, 5, -5, 4])
+        self.assertEqual(list(tree), [-1, 2, 3, 4, 5])
+
+    def test_snapshot(self):
+        tree = BTree([5, 11, 7, 4, 6, 9, 2, 3, 10])
+        tree.rotate_pivot(tree.find(7)) # the shape should survive, not just the values
+
+        def shape(node):
+            return None if node is None else (node.val, node.size, shape(node.left), shape(node.right))
+
+        f = io.BytesIO()
+        tree.dump(f)
+        f.seek(0)
+        loaded = BTree.load(f)
+        self.assertEqual(shape(loaded.root), shape(tree.root))
+        self.assertIsNone(loaded.root.parent)
+        for node in loaded.iter_nodes():
+            for child in (node.left, node.right):
+                if child is not None:
+                    self.assertIs(child.parent, node)
+
+        # several chunks, with keys that need each encoding
+        old_chunk = BTree.SNAPSHOT_CHUNK
+        BTree.SNAPSHOT_CHUNK = 100
+        try:
+            for vals in (list(range(-500, 500)), [i / 4 for i in range(1000)], [str(i) for i in range(1000)], [2**70, 1, 2]):
+                random.Random(len(vals)).shuffle(vals)
+                tree = BTree(vals)
+                f = io.BytesIO()
+                tree.dump(f)
+                f.seek(0)
+                self.assertEqual(shape(BTree.load(f).root), shape(tree.root))
+        finally:
+            BTree.SNAPSHOT_CHUNK = old_chunk
+
+        f = io.BytesIO()
+        BTree().dump(f)
+        f.seek(0)
+        self.assertIsNone(BTree.load(f).root)
+
+        f = io.BytesIO()
+        BTree(range(10)).dump(f)
+        self.assertRaises(ValueError, BTree.load, io.BytesIO(f.getvalue()[:-20]))
+        self.assertRaises(ValueError, BTree.load, io.BytesIO(b"XXXX" + f.getvalue()[4:]))
+    
+    def test_degenerate(self):
+        # sorted input produces a linked list, which used to blow the recursion limit
+        tree = BTree(range(5000))
+        self.assertEqual(tree.depth(), 5000)
+        self.assertTrue(tree.find(4999))
+        self.assertFalse(tree.find(5000))
+        self.assertEqual(list(tree.sorted_list()), list(range(5000)))
+
+        tree.delete(0) # root with only a right child
+        self.assertEqual(tree.root.val, 1)
+        self.assertIsNone(tree.root.parent)
+        tree.delete(4999)
+        self.assertEqual(list(tree.sorted_list()), list(range(1, 4999)))
+    
+    def test_swap_left_child(self):
+        tree = BTree([5, 3, 7, 2, 4])
+        node3 = tree.find(3)
+        node5 = tree.find(5)
+        tree._swap_nodes(node5, node3)
+        self.assertEqual(tree.root, node3)
+        self.assertEqual(node3.left, node5)
+        self.assertEqual(node3.right.val, 7)
+        self.assertEqual(node5.left.val, 2)
+        self.assertEqual(node5.right.val, 4)
+        self.assertEqual(node5.parent, node3)
+        self.assertEqual((node3.size, node5.size), (5, 3))
+    
     def test_btnode(self):
         tree = BTree([5, 10, 7, 4]) # as in test_insert
         node10 = tree.root.right
@@ -199,6 +637,1017 @@ class TestBTree(unittest.TestCase):
         self.assertEqual(node4.sibling(), node10)
         self.assertEqual(node7.uncle(), node4)
 
+        for tree_class in (BTree, RBTree, AVLTree, SplayTree):
+            self.assertFalse(hasattr(tree_class([1]).root, "__dict__"))
+
+
+class TestRBTree(unittest.TestCase):
+    def check_invariants(self, tree):
+        # returns the black height of the tree, failing if any red-black or BST property is violated
+        self.assertFalse(tree.root is not None and tree.root.red)
+        if tree.root is not None:
+            self.assertIsNone(tree.root.parent)
+
+        def check(node, lo, hi):
+            if node is None:
+                return 1
+            self.assertTrue(lo is None or lo < node.val)
+            self.assertTrue(hi is None or node.val < hi)
+            for child in (node.left, node.right):
+                if child is not None:
+                    self.assertEqual(child.parent, node)
+                    self.assertFalse(node.red and child.red)
+            left_height = check(node.left, lo, node.val)
+            right_height = check(node.right, node.val, hi)
+            self.assertEqual(left_height, right_height)
+            return left_height + (0 if node.red else 1)
+
+        return check(tree.root, None, None)
+
+    def test_insert(self):
+        tree = RBTree()
+        for v in range(1, 4):
+            tree.insert(v)
+        # sorted insertion rotates 2 up to the root
+        self.assertEqual(tree.root.val, 2)
+        self.assertFalse(tree.root.red)
+        self.assertTrue(tree.root.left.red)
+        self.assertTrue(tree.root.right.red)
+
+        tree = RBTree(range(1000))
+        self.check_invariants(tree)
+        self.assertLessEqual(tree.depth(), 2 * 10)
+        self.assertEqual(list(tree.sorted_list()), list(range(1000)))
+
+    def test_from_sorted(self):
+        for n in (1, 2, 3, 7, 8, 100, 1000):
+            tree = RBTree.from_sorted(range(n))
+            self.check_invariants(tree)
+            self.assertEqual(list(tree), list(range(n)))
+        tree.insert(1000)
+        tree.delete(500)
+        self.check_invariants(tree)
+
+    def test_snapshot(self):
+        tree = RBTree(range(300))
+        for v in range(0, 300, 3):
+            tree.delete(v)
+        f = io.BytesIO()
+        tree.dump(f)
+        f.seek(0)
+        loaded = RBTree.load(f)
+        self.check_invariants(loaded)
+        self.assertEqual(
+            [(n.val, n.red) for n in loaded.iter_nodes()],
+            [(n.val, n.red) for n in tree.iter_nodes()]
+        )
+        f.seek(0)
+        loaded = AVLTree.load(f) # a balanced RBTree isn't necessarily an AVL tree, but the heights get computed
+        self.assertEqual(loaded.depth(), tree.depth())
+
+    def test_random(self):
+        rng = random.Random(1234)
+        vals = list(range(500))
+        rng.shuffle(vals)
+        tree = RBTree(vals)
+        self.check_invariants(tree)
+
+        rng.shuffle(vals)
+        for i, v in enumerate(vals):
+            tree.delete(v)
+            self.assertFalse(tree.find(v))
+            if i % 25 == 0:
+                self.check_invariants(tree)
+        self.assertIsNone(tree.root)
+
+    def test_mixed(self):
+        rng = random.Random(99)
+        tree = RBTree()
+        present = set()
+        for _ in range(3000):
+            v = rng.randrange(200)
+            if rng.random() < 0.6:
+                tree.insert(v)
+                present.add(v)
+            else:
+                tree.delete(v)
+                present.discard(v)
+        self.check_invariants(tree)
+        self.assertEqual(list(tree.sorted_list()), sorted(present))
+
+
+    def test_join_split(self):
+        rng = random.Random(17)
+        for _ in range(50):
+            # very different black heights on either side
+            small = RBTree(rng.sample(range(1000), rng.randrange(20)))
+            large = RBTree(range(1001, 1001 + rng.randrange(500)))
+            joined = RBTree.join(small, 1000, large)
+            self.check_invariants(joined)
+
+            left, right = joined.split(rng.randrange(1500))
+            self.check_invariants(left)
+            self.check_invariants(right)
+            self.assertEqual(list(left) + list(right), list(left.union(right)))
+
+        a, b = RBTree(range(0, 600, 2)), RBTree(range(0, 600, 5))
+        self.check_invariants(a.difference(b))
+
+        # split works out the black heights as it goes, and its joins have to agree with them
+        for n in (1, 2, 3, 7, 100, 1000):
+            for _ in range(20):
+                tree = RBTree(rng.sample(range(3 * n), n))
+                vals = list(tree)
+                key = rng.randrange(-1, 3 * n + 1)
+                left, right = tree.split(key)
+                self.check_invariants(left)
+                self.check_invariants(right)
+                self.assertEqual(list(left), [v for v in vals if v < key])
+                self.assertEqual(list(right), [v for v in vals if v >= key])
+
+
+class TestAVLTree(unittest.TestCase):
+    def check_invariants(self, tree):
+        def check(node, lo, hi):
+            if node is None:
+                return 0
+            self.assertTrue(lo is None or lo < node.val)
+            self.assertTrue(hi is None or node.val < hi)
+            for child in (node.left, node.right):
+                if child is not None:
+                    self.assertEqual(child.parent, node)
+            left_height = check(node.left, lo, node.val)
+            right_height = check(node.right, node.val, hi)
+            self.assertLessEqual(abs(left_height - right_height), 1)
+            self.assertEqual(node.height, 1 + max(left_height, right_height))
+            return node.height
+
+        check(tree.root, None, None)
+
+    def test_insert(self):
+        tree = AVLTree(range(1, 8))
+        # sorted insertion of 2^3 - 1 keys gives a perfect tree
+        self.assertEqual(tree.root.val, 4)
+        self.assertEqual(tree.depth(), 3)
+        self.check_invariants(tree)
+
+        tree = AVLTree(range(1000))
+        self.check_invariants(tree)
+        self.assertEqual(tree.depth(), max(map(tree.depth_of_node, tree.sorted_nodes())))
+        self.assertLessEqual(tree.depth(), 1.44 * 10)
+
+    def test_from_sorted(self):
+        for n in (1, 2, 3, 7, 8, 100, 1000):
+            tree = AVLTree.bulk_load(reversed(range(n)))
+            self.check_invariants(tree)
+            self.assertEqual(list(tree), list(range(n)))
+        tree.insert(1000)
+        tree.delete(500)
+        self.check_invariants(tree)
+
+    def test_delete(self):
+        rng = random.Random(4321)
+        vals = list(range(500))
+        rng.shuffle(vals)
+        tree = AVLTree(vals)
+        self.check_invariants(tree)
+
+        rng.shuffle(vals)
+        for i, v in enumerate(vals):
+            tree.delete(v)
+            self.assertFalse(tree.find(v))
+            if i % 25 == 0:
+                self.check_invariants(tree)
+        self.assertIsNone(tree.root)
+        self.assertEqual(tree.depth(), 0)
+
+
+    def test_join_split(self):
+        rng = random.Random(16)
+        for _ in range(50):
+            small = AVLTree(rng.sample(range(1000), rng.randrange(20)))
+            large = AVLTree(range(1001, 1001 + rng.randrange(500)))
+            joined = AVLTree.join(small, 1000, large)
+            self.check_invariants(joined)
+            self.assertEqual(len(joined), len(list(joined)))
+
+            left, right = joined.split(rng.randrange(1500))
+            self.check_invariants(left)
+            self.check_invariants(right)
+
+        a, b = AVLTree(range(0, 600, 2)), AVLTree(range(0, 600, 5))
+        result = a.union(b)
+        self.check_invariants(result)
+        self.assertLessEqual(result.depth(), 1.44 * 9)
+
+
+class TestSplayTree(unittest.TestCase):
+    def test_splay(self):
+        tree = SplayTree(range(100))
+        # each insert splays the new (largest) value to the root, leaving a left-leaning chain
+        self.assertEqual(tree.root.val, 99)
+        self.assertEqual(tree.depth(), 100)
+
+        node = tree.find(0)
+        self.assertEqual(tree.root, node)
+        self.assertIsNone(node.parent)
+        # splaying the deepest node roughly halves the depth
+        self.assertLessEqual(tree.depth(), 52)
+        self.assertEqual(list(tree.sorted_list()), list(range(100)))
+
+        self.assertEqual(tree.depth_of(50), tree.depth_of_node(tree._search(50, tree.root)[0]))
+        self.assertEqual(tree.root, node) # depth_of doesn't splay
+
+        self.assertIsNone(tree.find(1000))
+        self.assertEqual(tree.root.val, 99) # missed lookups splay the last node visited
+
+    def test_delete(self):
+        rng = random.Random(7)
+        vals = list(range(300))
+        rng.shuffle(vals)
+        tree = SplayTree(vals)
+        rng.shuffle(vals)
+        for v in vals[:150]:
+            tree.delete(v)
+            self.assertFalse(tree.find(v))
+        self.assertEqual(list(tree.sorted_list()), sorted(vals[150:]))
+        for node in tree.sorted_nodes():
+            if node.parent is not None:
+                self.assertTrue(node.is_left_child() or node.is_right_child())
+
+
+class TestBPlusTree(unittest.TestCase):
+    def check_invariants(self, tree):
+        # checks the node sizes, the key order, that all leaves are at the same depth, and the leaf links
+        leaves = []
+
+        def check(node, lo, hi, depth, is_root):
+            self.assertLessEqual(len(node.keys), tree.max_keys)
+            if not is_root:
+                self.assertGreaterEqual(len(node.keys), tree.min_keys)
+            self.assertEqual(node.keys, sorted(node.keys))
+            for k in node.keys:
+                self.assertTrue(lo is None or lo <= k)
+                self.assertTrue(hi is None or k < hi)
+            if isinstance(node, BPlusLeaf):
+                leaves.append((node, depth))
+                return
+            self.assertEqual(len(node.children), len(node.keys) + 1)
+            bounds = [lo] + node.keys + [hi]
+            for i, child in enumerate(node.children):
+                check(child, bounds[i], bounds[i + 1], depth + 1, False)
+
+        check(tree.root, None, None, 1, True)
+        self.assertEqual({depth for _, depth in leaves}, {tree.depth()})
+        for (leaf, _), (next_leaf, _) in zip(leaves, leaves[1:]):
+            self.assertIs(leaf.next, next_leaf)
+            self.assertIs(next_leaf.prev, leaf)
+        self.assertIsNone(leaves[0][0].prev)
+        self.assertIsNone(leaves[-1][0].next)
+        self.assertEqual(len(tree), sum(len(leaf.keys) for leaf, _ in leaves))
+
+    def test_insert(self):
+        tree = BPlusTree(order=4)
+        for v in range(1, 5):
+            tree.insert(v)
+        # the leaf [1, 2, 3, 4] overflows and splits, with 3 going up as the separator
+        self.assertEqual(tree.root.keys, [3])
+        self.assertEqual([c.keys for c in tree.root.children], [[1, 2], [3, 4]])
+        self.assertIsNone(tree.insert(3))
+        self.assertEqual(len(tree), 4)
+
+        for order in (3, 4, 5, 16):
+            vals = list(range(500))
+            random.Random(order).shuffle(vals)
+            tree = BPlusTree(vals, order=order)
+            self.check_invariants(tree)
+            self.assertEqual(list(tree), list(range(500)))
+            self.assertEqual(list(reversed(tree)), list(reversed(range(500))))
+            self.assertIsNotNone(tree.find(250))
+            self.assertTrue(250 in tree)
+            self.assertFalse(500 in tree)
+        self.assertLessEqual(BPlusTree(range(1000), order=16).depth(), 4)
+
+    def test_delete(self):
+        rng = random.Random(21)
+        for order in (3, 4, 7, 32):
+            tree = BPlusTree(order=order)
+            present = set()
+            for _ in range(3000):
+                v = rng.randrange(300)
+                if rng.random() < 0.55:
+                    tree.insert(v)
+                    present.add(v)
+                else:
+                    tree.delete(v)
+                    present.discard(v)
+            self.check_invariants(tree)
+            self.assertEqual(list(tree.sorted_list()), sorted(present))
+
+            for v in list(present):
+                tree.delete(v)
+            self.assertEqual(len(tree), 0)
+            self.assertEqual(tree.depth(), 1)
+
+    def test_from_sorted(self):
+        for order in (3, 4, 8, 64):
+            for n in (0, 1, 2, 3, 10, 100, 1000):
+                tree = BPlusTree.from_sorted(range(n), order=order)
+                self.assertEqual(list(tree), list(range(n)))
+                if n:
+                    self.check_invariants(tree)
+        tree = BPlusTree.bulk_load([5, 3, 3, 1], order=4)
+        self.assertEqual(list(tree), [1, 3, 5])
+        self.assertRaises(ValueError, BPlusTree.from_sorted, [2, 1])
+
+    def test_range(self):
+        tree = BPlusTree(range(0, 100, 2), order=4)
+        self.assertEqual(list(tree.range(10, 20)), [10, 12, 14, 16, 18])
+        self.assertEqual(list(tree.range(11, 19, reverse=True)), [18, 16, 14, 12])
+        self.assertEqual(list(tree.range(hi=5)), [0, 2, 4])
+        self.assertEqual(list(tree.range(lo=95)), [96, 98])
+        self.assertEqual(list(tree.range(lo=95, reverse=True)), [98, 96])
+        self.assertEqual(list(tree.range()), list(tree))
+        self.assertEqual(list(tree.range(50, 50)), [])
+
+
+class TestPagedBTree(unittest.TestCase):
+    def setUp(self):
+        handle, self.path = tempfile.mkstemp(suffix=".btpg")
+        os.close(handle)
+        os.remove(self.path)
+
+    def tearDown(self):
+        if os.path.exists(self.path):
+            os.remove(self.path)
+
+    def test_persistence(self):
+        rng = random.Random(8)
+        vals = list(range(0, 6000, 2))
+        rng.shuffle(vals)
+        # tiny pages and a tiny cache, so that we split, evict and grow the file a lot
+        with PagedBTree(self.path, page_size=128, cache_pages=4) as tree:
+            for v in vals:
+                self.assertTrue(tree.insert(v))
+            self.assertFalse(tree.insert(vals[0]))
+            self.assertEqual(len(tree), 3000)
+            self.assertGreater(tree.depth(), 2)
+            self.assertEqual(list(tree), list(range(0, 6000, 2)))
+
+        with PagedBTree(self.path, cache_pages=4) as tree:
+            self.assertEqual(tree.page_size, 128) # read back from the file
+            self.assertEqual(len(tree), 3000)
+            self.assertTrue(tree.find(1000))
+            self.assertFalse(tree.find(1001))
+            self.assertTrue(4 in tree)
+            for v in vals[:1000]:
+                tree.delete(v)
+            tree.delete(1001)
+            self.assertEqual(len(tree), 2000)
+
+        with PagedBTree(self.path) as tree:
+            self.assertEqual(list(tree), sorted(vals[1000:]))
+            self.assertEqual(list(reversed(tree)), sorted(vals[1000:], reverse=True))
+
+    def test_range(self):
+        with PagedBTree(self.path, page_size=128) as tree:
+            for v in range(0, 500, 5):
+                tree.insert(v)
+            self.assertEqual(list(tree.range(100, 130)), [100, 105, 110, 115, 120, 125])
+            self.assertEqual(list(tree.range(101, 130, reverse=True)), [125, 120, 115, 110, 105])
+            self.assertEqual(list(tree.range(lo=480)), [480, 485, 490, 495])
+            self.assertEqual(list(tree.range(hi=12, reverse=True)), [10, 5, 0])
+            self.assertEqual(list(tree.range(600, 700)), [])
+
+    def test_bad_layout(self):
+        # bad settings are caught before the file is created
+        self.assertRaises(ValueError, PagedBTree, self.path, page_size=64)
+        self.assertRaises(ValueError, PagedBTree, self.path, key_format="64s", page_size=128)
+        self.assertRaises(struct.error, PagedBTree, self.path, key_format="y")
+        self.assertFalse(os.path.exists(self.path))
+
+    def test_key_format(self):
+        with PagedBTree(self.path, key_format="d", page_size=256) as tree:
+            for v in (2.5, -1.0, 1e10):
+                tree.insert(v)
+            self.assertRaises(struct.error, tree.insert, "not a float")
+            self.assertEqual(len(tree), 3)
+        with PagedBTree(self.path) as tree:
+            self.assertEqual(list(tree), [-1.0, 2.5, 1e10])
+        # reopening with settings that don't match the file is an error, repeating them isn't
+        self.assertRaises(ValueError, PagedBTree, self.path, key_format="q")
+        self.assertRaises(ValueError, PagedBTree, self.path, page_size=4096)
+        with PagedBTree(self.path, key_format="d", page_size=256) as tree:
+            self.assertEqual(len(tree), 3)
+
+        with open(self.path, "wb") as f:
+            f.write(b"not a tree" * 100)
+        self.assertRaises(ValueError, PagedBTree, self.path)
+
+
+def _lookup_shared(name, queries):
+    # runs in a worker process
+    frozen = FrozenBTree.attach(name)
+    try:
+        return frozen.find_many(queries)
+    finally:
+        frozen.close()
+
+
+class TestFrozenBTree(unittest.TestCase):
+    def test_freeze(self):
+        tree = BTree([5, 11, 7, 4, 6, 9, 2, 3, 10])
+        frozen = tree.freeze()
+        tree.insert(8) # later changes don't affect the snapshot
+        self.assertEqual(list(frozen), [2, 3, 4, 5, 6, 7, 9, 10, 11])
+        self.assertEqual(list(reversed(frozen)), [11, 10, 9, 7, 6, 5, 4, 3, 2])
+        self.assertEqual(len(frozen), 9)
+        self.assertEqual(frozen[0], 2)
+        self.assertEqual(frozen[-1], 11)
+        self.assertIsInstance(frozen.keys, array)
+
+        self.assertTrue(frozen.contains(7))
+        self.assertFalse(frozen.contains(8))
+        self.assertTrue(9 in frozen)
+        self.assertEqual(frozen.rank(8), 6)
+        self.assertEqual(frozen.rank(100), 9)
+        self.assertEqual(frozen.count_range(3, 10), 6)
+        self.assertEqual(list(frozen.range(4, 10)), [4, 5, 6, 7, 9])
+        self.assertEqual(list(frozen.range(4, 10, reverse=True)), [9, 7, 6, 5, 4])
+        self.assertEqual(list(frozen.range(hi=4)), [2, 3])
+        self.assertEqual(list(frozen.range(10, 4)), [])
+        self.assertEqual(frozen.find_many([10, 1, 5, 8, 11]), [7, -1, 3, -1, 8])
+
+    def test_key_types(self):
+        frozen = BTree([2.5, 0.5, 1.5]).freeze()
+        self.assertEqual(frozen.keys.typecode, "d")
+        self.assertEqual(frozen.find_many([1.5, 1.0]), [1, -1])
+
+        frozen = BTree(["b", "c", "a"]).freeze()
+        self.assertIsInstance(frozen.keys, tuple)
+        self.assertEqual(frozen.find_many(["c", "d"]), [2, -1])
+        self.assertEqual(list(frozen.range("b")), ["b", "c"])
+
+        self.assertIsInstance(BTree([2**70, 1]).freeze().keys, tuple)
+        self.assertEqual(BTree().freeze().find_many([1]), [-1])
+
+    def test_file(self):
+        frozen = BTree.from_sorted(range(0, 1000, 2)).freeze()
+        handle, path = tempfile.mkstemp(suffix=".btfz")
+        os.close(handle)
+        try:
+            frozen.save(path)
+            opened = FrozenBTree.open(path)
+            self.assertEqual(list(opened), list(frozen))
+            self.assertTrue(500 in opened)
+            self.assertEqual(opened.rank(501), 251)
+            self.assertEqual(opened.find_many([4, 5]), [2, -1])
+            opened.close()
+            self.assertRaises(TypeError, opened.__contains__, 500)
+            self.assertRaises(TypeError, opened.find_many, [4])
+            self.assertEqual(repr(opened), "FrozenBTree(closed)")
+
+            # a snapshot that can't be saved leaves an existing file alone
+            self.assertRaises(TypeError, BTree(["a"]).freeze().save, path)
+            opened = FrozenBTree.open(path)
+            self.assertEqual(len(opened), 500)
+            opened.close()
+        finally:
+            os.remove(path)
+
+    def test_byte_order(self):
+        # snapshots say which byte order their keys are in, so one from the other kind of machine still opens
+        keys = [-3, 0, 2**40, 5 * 2**50]
+        native = "<" if sys.byteorder == "little" else ">"
+        for order, version in (("<", 2), (">", 2), ("<", 1)):
+            data = FrozenBTree.SHARED_HEADER.pack(
+                FrozenBTree.SHARED_MAGIC, version, b"q", order.encode() if version == 2 else b"\0", len(keys)
+            ) + struct.pack(f"{order}{len(keys)}q", *keys)
+            handle, path = tempfile.mkstemp(suffix=".btfz")
+            with os.fdopen(handle, "wb") as f:
+                f.write(data)
+            try:
+                opened = FrozenBTree.open(path)
+                self.assertEqual(list(opened), keys)
+                self.assertEqual(opened.rank(2**40), 2)
+                self.assertEqual(isinstance(opened.keys, memoryview), order == native)
+                opened.close()
+            finally:
+                os.remove(path)
+
+        data = bytearray(BTree([1, 2]).freeze()._shared_bytes())
+        self.assertEqual(data[6:7], native.encode())
+        data[6:7] = b"?"
+        handle, path = tempfile.mkstemp(suffix=".btfz")
+        with os.fdopen(handle, "wb") as f:
+            f.write(data)
+        try:
+            self.assertRaises(ValueError, FrozenBTree.open, path)
+        finally:
+            os.remove(path)
+
+    def test_shared_memory(self):
+        frozen = BTree.from_sorted([i / 2 for i in range(1000)]).freeze()
+        block = frozen.to_shared_memory()
+        try:
+            with concurrent.futures.ProcessPoolExecutor(2) as pool:
+                results = list(pool.map(_lookup_shared, [block.name] * 2, [[1.5, 2.25], [499.5, 1000.0]]))
+            self.assertEqual(results, [[3, -1], [999, -1]])
+
+            attached = FrozenBTree.attach(block.name)
+            self.assertEqual(list(attached.range(1, 3)), [1.0, 1.5, 2.0, 2.5])
+            attached.close()
+        finally:
+            block.close()
+            block.unlink()
+
+    @unittest.skipIf(np is None, "needs numpy")
+    def test_vectorized(self):
+        frozen = BTree.from_sorted(range(0, 1000, 2)).freeze()
+        result = frozen.find_many(np.arange(10))
+        self.assertIsInstance(result, np.ndarray)
+        self.assertEqual(result.tolist(), [0, -1, 1, -1, 2, -1, 3, -1, 4, -1])
+        self.assertEqual(frozen.find_many([998, 1000]), [499, -1])
+
+
+class TestPersistentBTree(unittest.TestCase):
+    def shape(self, node):
+        return None if node is None else (node.val, node.size, self.shape(node.left), self.shape(node.right))
+
+    def test_sharing(self):
+        v1 = PersistentBTree.from_btree(BTree([5, 11, 7, 4, 6, 9, 2, 3, 10]))
+        v2 = v1.insert(8)
+        self.assertFalse(8 in v1)
+        self.assertTrue(8 in v2)
+        self.assertEqual(len(v1), 9)
+        self.assertEqual(len(v2), 10)
+        # only the path 5 -> 11 -> 7 -> 9 -> (8) is new
+        self.assertIs(v2.root.left, v1.root.left)
+        self.assertIsNot(v2.root.right, v1.root.right)
+        self.assertIs(v2.root.right.left.left, v1.root.right.left.left)
+        self.assertIs(v2.root.right.left.right.right, v1.root.right.left.right.right)
+        self.assertIs(v2.insert(8), v2)
+        self.assertIs(v2.delete(100), v2)
+        self.assertEqual(list(v1), [2, 3, 4, 5, 6, 7, 9, 10, 11])
+
+    def test_matches_btree(self):
+        # every operation should reshape the tree exactly like the BTree operation does
+        rng = random.Random(17)
+        tree = BTree()
+        version = PersistentBTree()
+        for _ in range(2000):
+            v = rng.randrange(100)
+            op = rng.random()
+            if op < 0.5:
+                tree.insert(v)
+                version = version.insert(v)
+            elif op < 0.75:
+                tree.delete(v)
+                version = version.delete(v)
+            elif tree.find(v) is not None:
+                tree.rotate_pivot(tree.find(v))
+                version = version.rotate_pivot(v)
+        self.assertEqual(self.shape(version.root), self.shape(tree.root))
+        self.assertEqual(version.depth(), tree.depth())
+
+        copy = version.to_btree()
+        self.assertEqual(self.shape(copy.root), self.shape(tree.root))
+        for node in copy.iter_nodes():
+            if node.parent is not None:
+                self.assertTrue(node.parent.left is node or node.parent.right is node)
+        self.assertEqual(self.shape(PersistentBTree.from_btree(copy).root), self.shape(tree.root))
+        self.assertIsNone(PersistentBTree.from_btree(BTree()).root)
+
+    def test_from_btree_changes(self):
+        # only the changed nodes and their ancestors get copied, the rest is shared with the previous version
+        tree = BTree.from_sorted(range(1000))
+        v1 = PersistentBTree.from_btree(tree)
+        changed = [tree.insert(-1), tree.insert(1000.5)]
+        node = tree.find(900)
+        changed.append(node.parent)
+        tree.delete_node(node)
+        v2 = PersistentBTree.from_btree(tree, v1, changed)
+        self.assertEqual(self.shape(v2.root), self.shape(tree.root))
+        self.assertIs(v2.find(375), v1.find(375))
+        self.assertIs(v2.find(625), v1.find(625))
+        self.assertIsNot(v2.find(0), v1.find(0))
+        self.assertEqual(list(v1), list(range(1000)))
+
+
+class TestPersistentAVLTree(unittest.TestCase):
+    def check(self, version):
+        # AVL balance, sizes and heights, and keys in order
+        def walk(node):
+            if node is None:
+                return 0
+            left, right = walk(node.left), walk(node.right)
+            self.assertLessEqual(abs(left - right), 1)
+            self.assertEqual(node.height, 1 + max(left, right))
+            self.assertEqual(node.size, 1 + (node.left.size if node.left else 0) + (node.right.size if node.right else 0))
+            return node.height
+        walk(version.root)
+        vals = list(version)
+        self.assertEqual([version._key_of(v) for v in vals], sorted(set(map(version._key_of, vals))))
+
+    def test_matches_set(self):
+        rng = random.Random(19)
+        version, expected = PersistentAVLTree(), set()
+        history = []
+        for i in range(3000):
+            v = rng.randrange(300)
+            if rng.random() < 0.6:
+                version = version.insert(v)
+                expected.add(v)
+            else:
+                version = version.delete(v)
+                expected.discard(v)
+            history.append((version, sorted(expected)))
+            if i % 100 == 0:
+                self.check(version)
+        # older versions never change
+        for version, vals in history[::50]:
+            self.assertEqual(list(version), vals)
+            self.assertEqual(len(version), len(vals))
+
+    def test_sorted_input(self):
+        version = PersistentAVLTree()
+        for v in range(3000):
+            version = version.insert(v)
+        self.check(version)
+        self.assertLessEqual(version.depth(), 1.44 * 12 + 1)
+        for v in range(0, 3000, 2):
+            version = version.delete(v)
+        self.check(version)
+        self.assertEqual(list(version), list(range(1, 3000, 2)))
+
+    def test_queries(self):
+        version = PersistentAVLTree.from_sorted(range(0, 100, 2))
+        self.check(version)
+        self.assertEqual(version.depth(), 6)
+        self.assertIs(version.insert(10), version)
+        self.assertIs(version.delete(11), version)
+        self.assertTrue(10 in version)
+        self.assertFalse(11 in version)
+        self.assertEqual(version.rank(11), 6)
+        self.assertEqual(version.rank(12), 6)
+        self.assertEqual(version.select(6).val, 12)
+        self.assertEqual(version.select(-1).val, 98)
+        self.assertRaises(IndexError, version.select, 50)
+        self.assertEqual(version.count_range(10, 20), 5)
+        self.assertEqual(list(version.range(11, 20)), [12, 14, 16, 18])
+        self.assertEqual(list(version.range(hi=5)), [0, 2, 4])
+        self.assertEqual(list(version.range(90, reverse=True)), [98, 96, 94, 92, 90])
+        self.assertEqual(list(version.range(11, 20, reverse=True)), [18, 16, 14, 12])
+        self.assertEqual(list(reversed(version))[:2], [98, 96])
+        self.assertRaises(ValueError, PersistentAVLTree.from_sorted, [1, 3, 2])
+        self.assertEqual(list(PersistentAVLTree.from_sorted([1, 1, 2])), [1, 2])
+
+        # key functions, as in BTree
+        version = PersistentAVLTree(key=abs)
+        for v in [3, -1, 2, -3]:
+            version = version.insert(v)
+        self.assertEqual(list(version), [-1, 2, 3])
+        self.assertEqual(version.find(-2).val, 2)
+        self.assertEqual(list(version.delete(-3)), [-1, 2])
+
+
+class TestConcurrentBTree(unittest.TestCase):
+    def test_basics(self):
+        tree = ConcurrentBTree([5, 3, 8])
+        snapshot = tree.snapshot()
+        self.assertTrue(tree.insert(4))
+        self.assertFalse(tree.insert(4))
+        tree.delete(5)
+        tree.insert_many([1, 2])
+        tree.delete_many([8, 100])
+        self.assertEqual(list(tree), [1, 2, 3, 4])
+        self.assertEqual(len(tree), 4)
+        self.assertTrue(3 in tree)
+        self.assertIsNone(tree.find(5))
+        self.assertEqual(list(snapshot), [3, 5, 8])
+
+        # the versions stay balanced, even when built from sorted values one at a time
+        tree = ConcurrentBTree(range(3000))
+        self.assertEqual(tree.snapshot().depth(), 12)
+        for v in range(3000, 6000):
+            tree.insert(v)
+        self.assertLessEqual(tree.snapshot().depth(), 1.44 * 13 + 1)
+        self.assertEqual(tree.rank(4000), 4000)
+        self.assertEqual(tree.select(-1).val, 5999)
+        self.assertEqual(tree.count_range(10, 20), 10)
+        self.assertEqual(list(tree.range(5995)), [5995, 5996, 5997, 5998, 5999])
+        self.assertEqual(list(tree.range(hi=3, reverse=True)), [2, 1, 0])
+
+        tree = ConcurrentBTree([3, -1, 2, -3], key=abs)
+        self.assertEqual(list(tree), [-1, 2, 3])
+        tree.insert_many([4, -4, 5])
+        self.assertEqual(list(tree), [-1, 2, 3, 4, 5])
+        self.assertEqual(tree.find(-5).val, 5)
+        empty = ConcurrentBTree(key=abs)
+        empty.insert_many([-2, 1, 2])
+        self.assertEqual(list(empty), [1, -2])
+
+    def test_stress(self):
+        # Writers keep every value paired with its negation (inserted and deleted together), so any consistent
+        # version is symmetric. Readers check every version they see, without any locking.
+        tree = ConcurrentBTree()
+        stop = threading.Event()
+
+        def writer(seed):
+            # half the writers go through the values in sorted order, the rest at random
+            rng = random.Random(seed)
+            for i in range(2000):
+                v = 1 + (i + seed) % 399 if seed % 2 else rng.randrange(1, 400)
+                if rng.random() < 0.6:
+                    tree.insert_many([v, -v])
+                else:
+                    tree.delete_many([v, -v])
+
+        def reader():
+            checked = 0
+            while not stop.is_set() or checked == 0:
+                snapshot = tree.snapshot()
+                vals = list(snapshot)
+                assert vals == sorted(set(vals)), "iteration out of order"
+                assert vals == [-v for v in reversed(vals)], "saw a half-finished update"
+                assert len(snapshot) == len(vals)
+                for v in vals[:10]:
+                    assert snapshot.find(-v) is not None
+                checked += 1
+            return checked
+
+        with concurrent.futures.ThreadPoolExecutor(8) as pool:
+            readers = [pool.submit(reader) for _ in range(4)]
+            writers = [pool.submit(writer, seed) for seed in range(4)]
+            for future in writers:
+                future.result()
+            stop.set()
+            for future in readers:
+                self.assertGreater(future.result(), 0)
+
+        self.assertLessEqual(tree.snapshot().depth(), 1.44 * (len(tree) + 1).bit_length() + 1)
+        vals = list(tree)
+        self.assertEqual(vals, [-v for v in reversed(vals)])
+        self.assertEqual(len(tree), len(vals))
+
+
+class TestLayout(unittest.TestCase):
+    def test_iter_layout(self):
+        tree = BTree(random.Random(5).sample(range(1000), 300))
+        ranks = {node: i for i, node in enumerate(tree.iter_nodes())}
+        seen = 0
+        for node, rank, depth, parent_rank in iter_layout(tree.root):
+            self.assertEqual(rank, ranks[node])
+            self.assertEqual(depth, tree.depth_of_node(node) - 1)
+            self.assertEqual(parent_rank, None if node.parent is None else ranks[node.parent])
+            seen += 1
+        self.assertEqual(seen, len(tree))
+        self.assertEqual(tree_depth(tree.root), tree.depth())
+        self.assertEqual(list(iter_layout(None)), [])
+
+        # PersistentBTree nodes have no parents, but that isn't needed
+        version = PersistentBTree.from_btree(tree)
+        self.assertEqual(
+            sorted((node.val, rank, depth) for node, rank, depth, _ in iter_layout(version.root)),
+            sorted((node.val, rank, depth) for node, rank, depth, _ in iter_layout(tree.root))
+        )
+
+    def test_view_layout(self):
+        tree = BTree(random.Random(6).sample(range(10000), 2000))
+        everything = {node: (3 + 2 * rank, 5 + 7 * depth) for node, rank, depth, _ in iter_layout(tree.root)}
+
+        nodes, connections, subtrees = view_layout(tree.root, 3, 2, 5, 7, (-10, -10, 10 ** 6, 10 ** 6))
+        self.assertEqual(nodes, everything)
+        self.assertEqual(len(connections), len(tree) - 1)
+        self.assertEqual(subtrees, {})
+
+        box = (1000, 20, 1500, 60)
+        nodes, connections, subtrees = view_layout(tree.root, 3, 2, 5, 7, box)
+        self.assertEqual(nodes, {
+            node: (x, y) for node, (x, y) in everything.items() if 1000 <= x <= 1500 and 20 <= y <= 60
+        })
+        for node, (px, py, x, y) in connections.items():
+            self.assertEqual((px, py), everything[node.parent])
+            self.assertEqual((x, y), everything[node])
+        for node in nodes:
+            if node.parent is not None:
+                self.assertIn(node, connections)
+
+        # collapsing narrow subtrees still accounts for every node in view
+        nodes, connections, subtrees = view_layout(tree.root, 0, 0.5, 0, 10, (0, 0, 1000, 10 ** 6), 30)
+        self.assertTrue(subtrees)
+        self.assertEqual(len(nodes) + sum(node.size for node in subtrees), len(tree))
+        for node, (x, y, left_x, right_x) in subtrees.items():
+            self.assertLess(node.size * 0.5, 30)
+            self.assertLessEqual(left_x, x)
+            self.assertLessEqual(x, right_x)
+
+    def test_write_svg(self):
+        import xml.etree.ElementTree as ElementTree
+        tree = BTree(["b", "a<&>", "c", "d"])
+        out = io.StringIO()
+        write_svg(tree.root, out)
+        svg = ElementTree.fromstring(out.getvalue())
+        ns = "{http://www.w3.org/2000/svg}"
+        self.assertEqual(svg.get("width"), str(2 * 20 + 3 * 40))
+        self.assertEqual(svg.get("height"), str(2 * 20 + 2 * 40))
+        self.assertEqual(len(svg.findall(ns + "circle")), 4)
+        self.assertEqual(len(svg.findall(ns + "line")), 3)
+        self.assertEqual(sorted(text.text for text in svg.findall(ns + "text")), sorted(tree))
+
+        # the lines stop at the edges of the circles: this one goes from b at (60, 20) down to a at (20, 60)
+        line = svg.find(ns + "line")
+        offset = 10 / 2 ** 0.5
+        for name, expected in [("x1", 60 - offset), ("y1", 20 + offset), ("x2", 20 + offset), ("y2", 60 - offset)]:
+            self.assertAlmostEqual(float(line.get(name)), expected, places=3)
+
+        out = io.StringIO()
+        write_svg(None, out)
+        self.assertEqual(len(ElementTree.fromstring(out.getvalue())), 1) # just the style
+
+    @unittest.skipIf(Image is None, "needs Pillow")
+    def test_write_png(self):
+        tree = BTree(random.Random(7).sample(range(1000), 200))
+        out = io.BytesIO()
+        write_png(tree.root, out, max_width=1000)
+        image = Image.open(io.BytesIO(out.getvalue()))
+        self.assertEqual(image.size, (1000, 2 * 20 + (tree.depth() - 1) * 40))
+
+
+# The explorer, drawn on a ModelCanvas so that no display is needed
+@unittest.skipIf(BTreeCanvas is None, "needs tkinter")
+class TestBTreeCanvas(unittest.TestCase):
+    def shape(self, node):
+        return None if node is None else (node.val, node.size, self.shape(node.left), self.shape(node.right))
+
+    def make_tree(self, n, seed=7):
+        canvas = ModelCanvas()
+        return canvas, BTreeCanvas(canvas, random.Random(seed).sample(range(10 * n), n))
+
+    def views(self, tree):
+        # a walk around the tree, zoomed in and out
+        rng = random.Random(8)
+        tree.reset_view()
+        yield
+        for _ in range(12):
+            tree.zoom_by(0.4, rng.randrange(1024))
+            tree.scroll(rng.randint(-400, 400), rng.randint(-40, 120))
+            yield
+        tree.fit_view()
+        yield
+
+    def check_items(self, canvas, tree):
+        # the items match a fresh layout of the view, and the canvas agrees with the items
+        nodes, connections, subtrees = tree.build_view_coords()
+        self.assertEqual({node: item.coords for node, item in tree.node_items.items()}, nodes)
+        self.assertEqual({node: item.coords for node, item in tree.connection_items.items()}, connections)
+        self.assertEqual({node: item.coords for node, item in tree.subtree_items.items()}, subtrees)
+        r = NodeItem.RADIUS
+        for node, item in tree.node_items.items():
+            self.assertIs(item.node, node)
+            x, y = item.coords
+            self.assertEqual(canvas.items[item.item_main_circle][0], [x - r, y - r, x + r, y + r])
+            self.assertEqual(canvas.items[item.item_main_circle][2], "normal")
+            self.assertEqual(canvas.items[item.item_label][3], str(node.val))
+        for item in tree.free_node_items:
+            self.assertEqual(canvas.items[item.item_main_circle][2], "hidden")
+
+    def test_node_at(self):
+        canvas, tree = self.make_tree(3000)
+        rng = random.Random(9)
+        for _ in self.views(tree):
+            self.check_items(canvas, tree)
+            for node, item in tree.node_items.items():
+                # zoomed right out, neighbouring nodes can end up in the same place
+                x, y = item.coords
+                found = tree.node_at(x, y)
+                self.assertEqual(tree.node_items[found].coords, (x, y))
+                if tree.zoom == 1:
+                    self.assertIs(found, node)
+
+            # anywhere else, it's the closest node within the radius
+            for _ in range(300):
+                x, y = rng.uniform(0, 1024), rng.uniform(0, 768)
+                distances = [
+                    (item.coords[0] - x) ** 2 + (item.coords[1] - y) ** 2 for item in tree.node_items.values()
+                ]
+                found = tree.node_at(x, y)
+                if min(distances, default=1e9) <= NodeItem.RADIUS ** 2:
+                    item = tree.node_items[found]
+                    self.assertEqual((item.coords[0] - x) ** 2 + (item.coords[1] - y) ** 2, min(distances))
+                else:
+                    self.assertIsNone(found)
+
+    def test_subtree_at(self):
+        canvas, tree = self.make_tree(3000)
+        tree.fit_view()
+        self.assertTrue(tree.subtree_items)
+        for node, item in tree.subtree_items.items():
+            top_x, y, left_x, right_x = item.coords
+            # the middle of the triangle's base, and just under its tip
+            for x, y in ((left_x + right_x) / 2, y + SubtreeItem.HEIGHT), (top_x, y + 1):
+                found = tree.subtree_at(x, y)
+                self.assertIsNotNone(found)
+                if found is not node: # thin neighbours overlap by a couple of pixels
+                    self.assertLessEqual(abs(tree.subtree_items[found].coords[0] - top_x), 4)
+        self.assertIsNone(tree.subtree_at(-500, 100))
+
+        # clicking one zooms in on it
+        node, item = next(iter(tree.subtree_items.items()))
+        found = tree.subtree_at(item.coords[0], item.coords[1] + 1)
+        tree.on_mouse1(type("Event", (), {"x": item.coords[0], "y": item.coords[1] + 1}))
+        self.assertIn(found, tree.node_items)
+        self.assertEqual(tree.view_y, (tree.depth_of_node(found) - 1) * BTreeCanvas.VERT_SPACING)
+
+    def test_culling_and_pooling(self):
+        canvas, tree = self.make_tree(20000)
+        width, height = tree.canvas_size()
+        margin = BTreeCanvas.HORIZ_SPACING
+        item_counts = []
+        for _ in range(2):
+            for _ in self.views(tree):
+                # only what's in view gets drawn, however big the tree is
+                self.assertLess(len(tree.node_items), 600)
+                for x, y in (item.coords for item in tree.node_items.values()):
+                    self.assertTrue(-margin <= x <= width + margin and -margin <= y <= height + margin)
+                self.assertLessEqual(len(tree.node_items) + sum(node.size for node in tree.subtree_items), len(tree))
+            item_counts.append(len(canvas.items))
+        # going round again reuses the pooled items rather than creating more
+        self.assertEqual(item_counts[0], item_counts[1])
+        self.check_items(canvas, tree)
+
+    def test_undo_redo(self):
+        canvas, tree = self.make_tree(300)
+        rng = random.Random(10)
+        for step in range(150):
+            op = rng.random()
+            if op < 0.25:
+                tree.insert(rng.randrange(3000))
+            elif op < 0.4:
+                tree.delete(rng.randrange(3000))
+            elif op < 0.55 and tree.root is not None:
+                tree.rotate_pivot(tree.select(rng.randrange(len(tree))))
+            elif op < 0.7:
+                with tree.batch():
+                    for _ in range(5):
+                        tree.insert(rng.randrange(3000))
+                        tree.delete(rng.randrange(3000))
+                    if tree.root is not None:
+                        tree.rotate_pivot(tree.select(rng.randrange(len(tree))))
+            elif op < 0.8:
+                tree.insert_many(rng.sample(range(3000), 20))
+            elif op < 0.9:
+                for _ in range(rng.randrange(1, 4)):
+                    tree.undo()
+            else:
+                tree.redo()
+            self.assertEqual(self.shape(tree.root), self.shape(tree.versions[tree.version_index].root))
+            if step % 10 == 0:
+                self.check_items(canvas, tree)
+
+        # undoing everything empties the tree, and redoing everything brings it all back
+        final = self.shape(tree.root)
+        while tree.version_index > 0:
+            tree.undo()
+        self.assertIsNone(tree.root)
+        self.assertFalse(tree.node_items)
+        while tree.version_index + 1 < len(tree.versions):
+            tree.redo()
+        self.assertEqual(self.shape(tree.root), final)
+        self.check_items(canvas, tree)
+
+    def test_tree_operations(self):
+        # the operations that make new trees out of the explorer's nodes fail clearly, before touching anything
+        canvas, tree = self.make_tree(50)
+        other = BTreeCanvas(ModelCanvas(), [1, 2])
+        before = self.shape(tree.root)
+        for call in (
+            lambda: tree.split(5), lambda: tree.union(other), lambda: tree.intersection(other),
+            lambda: tree.difference(other), lambda: BTreeCanvas.join(tree, 10**6, other),
+            lambda: BTreeCanvas.parallel_bulk_load([1], None, canvas),
+        ):
+            self.assertRaises(TypeError, call)
+        self.assertEqual(self.shape(tree.root), before)
+
+        # the constructors that take values work when given the canvas
+        tree = BTreeCanvas.from_sorted(range(100), ModelCanvas())
+        self.assertEqual(tree.depth(), 7)
+        self.assertEqual(self.shape(tree.root), self.shape(tree.versions[tree.version_index].root))
+        self.assertEqual(list(BTreeCanvas.bulk_load([3, 1, 2], ModelCanvas())), [1, 2, 3])
+        f = io.BytesIO()
+        tree.dump(f)
+        f.seek(0)
+        self.assertEqual(self.shape(BTreeCanvas.load(f, ModelCanvas()).root), self.shape(tree.root))
+
+    def test_insert_many(self):
+        # a random batch into an empty explorer is bulk-built rather than going in one node at a time
+        canvas, tree = self.make_tree(0)
+        tree.insert_many(random.Random(11).sample(range(100000), 20000))
+        self.assertEqual(tree.depth(), 15)
+        self.assertEqual(len(tree.versions), 2)
+        self.assertEqual(self.shape(tree.root), self.shape(tree.versions[-1].root))
+        self.check_items(canvas, tree)
+
 
 if __name__ == "__main__":
     unittest.main()
\ No newline at end of file